@@ -0,0 +1,390 @@
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from logger import get_logger
+from classes import Simulation
+from replication import replication_seed
+from runners import do_one_run
+
+logger = get_logger()
+
+# set in each worker process by _init_worker, so the catalog and blueprint are only sent once per worker
+_worker_catalog = None
+_worker_blueprint = None
+
+
+class OnlineStats:
+    """
+    count, mean, variance, min and max of a stream of equally shaped arrays, one per replication, element
+    by element. Welford updates, so only the running values are kept. two of them merge exactly, so each
+    worker can keep its own and they are combined at the end.
+    """
+
+    def __init__(self, shape):
+        self.shape = tuple(shape)
+        self.n = 0
+        self.mean = np.zeros(self.shape)
+        self.m2 = np.zeros(self.shape)
+        self.min = np.full(self.shape, np.inf)
+        self.max = np.full(self.shape, -np.inf)
+
+    def add(self, values):
+        values = np.asarray(values, dtype=float)
+        self.n += 1
+        delta = values - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (values - self.mean)
+        np.minimum(self.min, values, out=self.min)
+        np.maximum(self.max, values, out=self.max)
+
+    def merge(self, other):
+        """adds the values seen by another OnlineStats of the same shape"""
+        if other.n == 0:
+            return self
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.n / n
+        self.m2 = self.m2 + other.m2 + delta ** 2 * self.n * other.n / n
+        self.n = n
+        np.minimum(self.min, other.min, out=self.min)
+        np.maximum(self.max, other.max, out=self.max)
+        return self
+
+    def variance(self, ddof=1):
+        if self.n <= ddof:
+            return np.full(self.shape, np.nan)
+        return self.m2 / (self.n - ddof)
+
+    def std(self, ddof=1):
+        return np.sqrt(self.variance(ddof))
+
+
+class QuantileSketch:
+    """
+    approximate quantiles of a stream of equally shaped arrays, element by element, in fixed memory
+    whatever the number of replications. two sketches merge, so each worker can keep its own.
+
+    while the values are whole numbers spanning at most exact_range, as the daily counts of a run are, it
+    keeps exact counts of every value, and the quantiles are exactly those of numpy.quantile. otherwise
+    every element keeps a merging t-digest: a sorted list of (mean, weight) centroids, with the k1 (arcsin)
+    scale function limiting how much a centroid can hold, so the ones near the tails stay single values and
+    the ones near the median take many. that keeps about compression centroids per element.
+    """
+
+    def __init__(self, shape, compression=50, exact_range=256):
+        self.shape = tuple(shape)
+        self.compression = compression
+        self.exact_range = exact_range
+        self.cells = int(np.prod(self.shape, dtype=int))
+        # exact counts: counts[cell, value - low], until a value does not fit
+        self.low = None
+        self.counts = np.zeros((self.cells, 0), dtype=np.int64)
+        # t-digest centroids, sorted by mean in every row, with the empty ones (weight 0) at the end
+        self.means = None
+        self.weights = None
+        self.buffer = []
+        self.min = np.full(self.cells, np.inf)
+        self.max = np.full(self.cells, -np.inf)
+
+    @property
+    def exact(self):
+        return self.means is None
+
+    def add(self, values):
+        values = np.asarray(values, dtype=float).reshape(self.cells)
+        np.minimum(self.min, values, out=self.min)
+        np.maximum(self.max, values, out=self.max)
+        if self.exact and self._fits(values.min(), values.max(), values):
+            self._count(values)
+            return
+        self._to_digest()
+        self.buffer.append(values)
+        if len(self.buffer) >= self.compression:
+            self._compress()
+
+    def _fits(self, low, high, values=None):
+        if values is not None and not np.array_equal(values, np.floor(values)):
+            return False
+        if self.low is not None:
+            low, high = min(low, self.low), max(high, self.low + self.counts.shape[1] - 1)
+        return high - low < self.exact_range
+
+    def _widen(self, low, high):
+        """makes the counts cover the whole numbers from low to high"""
+        low, high = int(low), int(high)
+        if self.low is None:
+            self.low = low
+        start = self.low - min(low, self.low)
+        stop = max(high - self.low + 1, self.counts.shape[1])
+        if start or stop > self.counts.shape[1]:
+            counts = np.zeros((self.cells, start + stop), dtype=np.int64)
+            counts[:, start:start + self.counts.shape[1]] = self.counts
+            self.counts = counts
+            self.low -= start
+
+    def _count(self, values):
+        self._widen(values.min(), values.max())
+        self.counts[np.arange(self.cells), values.astype(np.int64) - self.low] += 1
+
+    def _to_digest(self):
+        """turns the exact counts into centroids, one per value seen, for when a value does not fit"""
+        if not self.exact:
+            return
+        if self.low is None:
+            self.means = np.zeros((self.cells, 0))
+            self.weights = np.zeros((self.cells, 0))
+        else:
+            values = np.arange(self.low, self.low + self.counts.shape[1], dtype=float)
+            self.means = np.broadcast_to(values, self.counts.shape).copy()
+            self.weights = self.counts.astype(float)
+            self._compress(force=True)
+        self.counts = np.zeros((self.cells, 0), dtype=np.int64)
+        self.low = None
+
+    def merge(self, other):
+        """adds the values seen by another QuantileSketch of the same shape"""
+        np.minimum(self.min, other.min, out=self.min)
+        np.maximum(self.max, other.max, out=self.max)
+        if self.exact and other.exact:
+            if other.low is None:
+                return self
+            if self._fits(other.low, other.low + other.counts.shape[1] - 1):
+                self._widen(other.low, other.low + other.counts.shape[1] - 1)
+                start = other.low - self.low
+                self.counts[:, start:start + other.counts.shape[1]] += other.counts
+                return self
+        other_means, other_weights = other._centroids()
+        self._to_digest()
+        self._compress()
+        self.means = np.hstack([self.means, other_means])
+        self.weights = np.hstack([self.weights, other_weights])
+        self._compress(force=True)
+        return self
+
+    def _centroids(self):
+        """(means, weights) of this sketch as centroids, without changing it"""
+        if self.exact:
+            if self.low is None:
+                return np.zeros((self.cells, 0)), np.zeros((self.cells, 0))
+            values = np.arange(self.low, self.low + self.counts.shape[1], dtype=float)
+            return np.broadcast_to(values, self.counts.shape).copy(), self.counts.astype(float)
+        self._compress()
+        return self.means, self.weights
+
+    def _scale(self, q):
+        return self.compression / (2 * math.pi) * np.arcsin(np.clip(2 * q - 1, -1, 1))
+
+    def _scale_inverse(self, k):
+        return (np.sin(np.clip(k * 2 * math.pi / self.compression, -math.pi / 2, math.pi / 2)) + 1) / 2
+
+    def _compress(self, force=False):
+        if not self.buffer and not force:
+            return
+        means = np.hstack([self.means] + [values[:, None] for values in self.buffer])
+        weights = np.hstack([self.weights] + [np.ones((self.cells, 1))] * len(self.buffer))
+        self.buffer = []
+        if means.shape[1] == 0:
+            return
+
+        # sort by mean, the empty centroids last
+        order = np.argsort(np.where(weights > 0, means, np.inf), axis=1, kind='stable')
+        means = np.take_along_axis(means, order, axis=1)
+        weights = np.take_along_axis(weights, order, axis=1)
+        total = weights.sum(axis=1)
+        safe_total = np.where(total > 0, total, 1)
+
+        # the merging t-digest pass, for all the elements at once: a centroid takes in the next one while
+        # its weight stays within one unit of the scale function from where the centroid starts
+        rows = np.arange(self.cells)
+        out_means = np.zeros_like(means)
+        out_weights = np.zeros_like(weights)
+        position = np.zeros(self.cells, dtype=int)
+        before = np.zeros(self.cells)
+        weight = weights[:, 0].copy()
+        weighted = weights[:, 0] * means[:, 0]
+        limit = safe_total * self._scale_inverse(self._scale(0.0) + 1)
+        for column in range(1, means.shape[1]):
+            next_weight = weights[:, column]
+            merge = before + weight + next_weight <= limit
+            start = ~merge & (next_weight > 0)
+            out_weights[rows[start], position[start]] = weight[start]
+            out_means[rows[start], position[start]] = weighted[start] / weight[start]
+            position[start] += 1
+            before[start] += weight[start]
+            limit[start] = safe_total[start] * self._scale_inverse(self._scale(before[start] / safe_total[start]) + 1)
+            weight = np.where(start, next_weight, weight + np.where(merge, next_weight, 0))
+            weighted = np.where(start, next_weight * means[:, column],
+                                weighted + np.where(merge, next_weight * means[:, column], 0))
+        filled = weight > 0
+        out_weights[rows[filled], position[filled]] = weight[filled]
+        out_means[rows[filled], position[filled]] = weighted[filled] / weight[filled]
+
+        used = int(position.max()) + 1
+        self.means = out_means[:, :used]
+        self.weights = out_weights[:, :used]
+
+    def quantile(self, q):
+        """
+        the q quantile of every element, as an array of the sketch's shape. it interpolates between order
+        statistics like numpy.quantile, exactly while the sketch keeps exact counts
+        """
+        if self.exact:
+            return self._exact_quantile(q)
+        self._compress()
+        if self.weights.shape[1] == 0:
+            return np.full(self.shape, np.nan)
+        # each centroid holds the order statistics from its start to start + weight - 1 and sits in the middle
+        # of them, so a single value is exactly where numpy puts it. the exact min and max close off both ends,
+        # and take the place of a centroid sitting on either end
+        total = self.weights.sum(axis=1, keepdims=True)
+        centre = np.cumsum(self.weights, axis=1) - (self.weights + 1) / 2
+        dropped = (self.weights == 0) | (centre <= 0) | (centre >= total - 1)
+        # the dropped ones move to the top end, where they sort after the others
+        x = np.sort(np.hstack([np.zeros((self.cells, 1)), np.where(dropped, total - 1, centre), total - 1]), axis=1)
+        y = np.sort(np.hstack([self.min[:, None], np.where(dropped, self.max[:, None], self.means),
+                               self.max[:, None]]), axis=1)
+
+        target = q * (total - 1)
+        lower = np.clip((x <= target).sum(axis=1, keepdims=True) - 1, 0, x.shape[1] - 2)
+        x0, x1 = np.take_along_axis(x, lower, axis=1), np.take_along_axis(x, lower + 1, axis=1)
+        y0, y1 = np.take_along_axis(y, lower, axis=1), np.take_along_axis(y, lower + 1, axis=1)
+        span = x1 - x0
+        fraction = np.divide(target - x0, span, out=np.zeros_like(span), where=span > 0)
+        return (y0 + np.clip(fraction, 0, 1) * (y1 - y0)).reshape(self.shape)
+
+    def _exact_quantile(self, q):
+        if self.low is None:
+            return np.full(self.shape, np.nan)
+        cumulative = np.cumsum(self.counts, axis=1)
+        total = cumulative[:, -1]
+        position = q * (total - 1)
+        below = np.floor(position)
+        above = np.minimum(below + 1, total - 1)
+
+        def order_statistic(rank):
+            return self.low + (cumulative <= rank[:, None]).sum(axis=1)
+
+        lower = order_statistic(below)
+        return (lower + (position - below) * (order_statistic(above) - lower)).reshape(self.shape)
+
+
+class ReplicationAggregate:
+    """
+    per day statistics over replications of a run, kept without the trajectories: OnlineStats and,
+    with compression, a QuantileSketch of the serviceable cars and of the given metrics for every part
+    number, plus OnlineStats of the service_current of each run.
+    add_run takes the result of a run, which can be dropped straight after, and merge combines aggregates
+    built by different workers.
+    """
+
+    def __init__(self, part_names, days, metrics=('serv', 'warehouse', 'depot'), compression=50):
+        self.part_names = list(part_names)
+        self.days = days
+        self.metrics = tuple(metrics)
+        self.service = OnlineStats(())
+        self.stats = {'serviceable': OnlineStats((days,))}
+        self.stats.update({metric: OnlineStats((days, len(self.part_names))) for metric in self.metrics})
+        self.sketches = {}
+        if compression:
+            self.sketches = {name: QuantileSketch(stats.shape, compression) for name, stats in self.stats.items()}
+
+    @classmethod
+    def for_catalog(cls, part_catalog, days, metrics=('serv', 'warehouse', 'depot'), compression=50):
+        return cls([part_number.name for part_number in part_catalog], days, metrics, compression)
+
+    @property
+    def replications(self):
+        return self.service.n
+
+    def add(self, name, values):
+        self.stats[name].add(values)
+        if name in self.sketches:
+            self.sketches[name].add(values)
+
+    def add_run(self, result):
+        """adds the (service_current, car_serviceable, car_breakage, serv_tracker, ...) result of a run"""
+        self.service.add(result[0])
+        self.add('serviceable', result[1])
+        if self.metrics:
+            trajectory = result[3].trajectory
+            columns = [trajectory.index[name] for name in self.part_names]
+            for metric in self.metrics:
+                self.add(metric, trajectory.data[metric][:, columns])
+
+    def merge(self, other):
+        self.service.merge(other.service)
+        for name, stats in self.stats.items():
+            stats.merge(other.stats[name])
+        for name, sketch in self.sketches.items():
+            sketch.merge(other.sketches[name])
+        return self
+
+    def summary(self, name, quantiles=(0.05, 0.5, 0.95)):
+        """
+        {'mean', 'std', 'min', 'max', 'quantiles': {q: values}} of 'serviceable' (one value per day) or of a
+        metric (days x part numbers, in part_names order)
+        """
+        stats = self.stats[name]
+        result = {'mean': stats.mean, 'std': stats.std(), 'min': stats.min, 'max': stats.max}
+        if name in self.sketches:
+            result['quantiles'] = {q: self.sketches[name].quantile(q) for q in quantiles}
+        return result
+
+    def band(self, name, part_name=None, quantiles=(0.05, 0.5, 0.95)):
+        """the daily quantiles of one series, for example band('warehouse', 'Wheel'), as {q: values}"""
+        bands = self.summary(name, quantiles)['quantiles']
+        if part_name is None:
+            return bands
+        column = self.part_names.index(part_name)
+        return {q: values[:, column] for q, values in bands.items()}
+
+
+def _init_worker(part_catalog, car_blueprint):
+    global _worker_catalog, _worker_blueprint
+    _worker_catalog = part_catalog
+    _worker_blueprint = car_blueprint
+
+
+def _aggregate_worker(counts, days, fleet_size, hours_per_day, seed, indices, metrics, compression, run):
+    # the allocation comes over by part name, so the keys are this worker's own catalog objects
+    simulation = Simulation(part_catalog=_worker_catalog)
+    spares_allocated = {part: counts[part.name] for part in _worker_catalog if part.name in counts}
+    return aggregate_replications(spares_allocated, days, fleet_size, hours_per_day, _worker_blueprint, simulation,
+                                  seed, indices, metrics, compression, run=run)
+
+
+def aggregate_replications(spares_allocated, days, fleet_size, hours_per_day, car_blueprint, simulation=None,
+                           seed=0, replications=100, metrics=('serv', 'warehouse', 'depot'), compression=50,
+                           max_workers=1, run=do_one_run):
+    """
+    runs the given number of replications (or the replication indices given as a range or list), seeded
+    with replication.replication_seed, and returns a ReplicationAggregate of them. each run's trajectory is
+    dropped as soon as it has been added.
+    with max_workers other than 1 the replications are split over a process pool, each worker aggregates
+    its share and the aggregates are merged.
+    """
+    simulation = Simulation.resolve(simulation)
+    indices = range(replications) if isinstance(replications, int) else list(replications)
+    aggregate = ReplicationAggregate.for_catalog(simulation.part_catalog, days, metrics, compression)
+
+    if max_workers == 1:
+        for index in indices:
+            aggregate.add_run(run(spares_allocated, days, fleet_size, hours_per_day, car_blueprint,
+                                  simulation.new_run(replication_seed(seed, index))))
+        return aggregate
+
+    counts = {part.name: count for part, count in spares_allocated.items()}
+    workers = max_workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                             initargs=(list(simulation.part_catalog), car_blueprint)) as executor:
+        futures = [executor.submit(_aggregate_worker, counts, days, fleet_size, hours_per_day, seed,
+                                   list(indices)[worker::workers], metrics, compression, run)
+                   for worker in range(workers)]
+        for future in futures:
+            aggregate.merge(future.result())
+
+    logger.info(f"Aggregated {aggregate.replications} replications on {workers} workers")
+    return aggregate
@@ -0,0 +1,137 @@
+import math
+
+from logger import get_logger
+from classes import Simulation
+from mathstuff import weibull_mean
+
+logger = get_logger()
+
+
+def pipeline_mean(part, per_car, fleet_size, hours_per_day):
+    """
+    average number of parts of one type away for repair at any time: the removal rate of the fleet (parts
+    per day, from the Weibull MTBF) times the depot turn around time in days. the engines keep a part in the
+    depot for at least one day, so a TAT of 0 counts as one day.
+    parts which never fail, or have no depot TAT (None), have an empty pipeline. only failures are counted,
+    removals at the depot limit (overhauls) are not modelled, so parts with a depot_limit below their
+    failure hours have a bigger pipeline than this.
+    """
+    if part.depot_tat is None or part.failure_hours == float('inf'):
+        return 0.0
+    mtbf = weibull_mean(part.shape_factor, part.failure_hours)
+    removals_per_day = per_car * fleet_size * hours_per_day / mtbf
+    return removals_per_day * max(1, math.ceil(part.depot_tat))
+
+
+def pipeline_means(part_quantities, fleet_size, hours_per_day, simulation=None):
+    """{part name: pipeline mean} for every part type of the catalog used in the blueprint"""
+    return {part.name: pipeline_mean(part, part_quantities[part.name], fleet_size, hours_per_day)
+            for part in Simulation.resolve(simulation).part_catalog if part.name in part_quantities}
+
+
+def _pipeline_log_pmf(mean, variance_to_mean):
+    """
+    log probability of x parts in the pipeline: Poisson (METRIC), or negative binomial with the given
+    variance to mean ratio when that is above one (VARI-METRIC)
+    """
+    if variance_to_mean <= 1:
+        log_mean = math.log(mean)
+        return lambda x: x * log_mean - mean - math.lgamma(x + 1)
+    p = 1 / variance_to_mean
+    r = mean / (variance_to_mean - 1)
+    log_p, log_q = math.log(p), math.log(1 - p)
+    return lambda x: (math.lgamma(x + r) - math.lgamma(r) - math.lgamma(x + 1) + r * log_p + x * log_q)
+
+
+def backorder_table(mean, max_spares, variance_to_mean=1.0):
+    """
+    expected backorders with 0 to max_spares spares, for a pipeline with the given mean.
+    EBO(s + 1) = EBO(s) - P(pipeline > s)
+    """
+    table = [mean]
+    if mean <= 0:
+        return [0.0] * (max_spares + 1)
+    log_pmf = _pipeline_log_pmf(mean, variance_to_mean)
+    cdf = 0.0
+    for spares in range(max_spares):
+        cdf += math.exp(log_pmf(spares))
+        table.append(max(0.0, table[-1] - max(0.0, 1 - cdf)))
+    return table
+
+
+def expected_backorders(spares, mean, variance_to_mean=1.0):
+    """expected number of places in the fleet waiting for a part, with the given number of spares"""
+    return backorder_table(mean, max(0, spares), variance_to_mean)[max(0, spares)]
+
+
+def _availability_term(backorders, per_car, fleet_size):
+    # share of the cars not held up by this part type, treating the backorders as spread evenly over the fleet
+    fraction = max(1 - backorders / (fleet_size * per_car), 1e-12)
+    return per_car * math.log(fraction)
+
+
+def expected_serviceability(spares_allocated, part_quantities, fleet_size, hours_per_day, simulation=None,
+                            variance_to_mean=1.0):
+    """
+    steady state fleet availability of an allocation, in percent like the service_current of a run:
+    product over the part types of (1 - EBO / (fleet size * quantity per car)) ** quantity per car.
+    spares_allocated is {Part_attributes: parts bought}, including the ones fitted to the fleet.
+    """
+    log_availability = 0.0
+    for part, allocated in spares_allocated.items():
+        per_car = part_quantities.get(part.name, 0)
+        if per_car == 0:
+            continue
+        spares = allocated - per_car * fleet_size
+        if spares < 0:
+            return 0.0
+        mean = pipeline_mean(part, per_car, fleet_size, hours_per_day)
+        log_availability += _availability_term(expected_backorders(spares, mean, variance_to_mean), per_car,
+                                               fleet_size)
+    return math.exp(log_availability) * 100
+
+
+def marginal_allocation(budget, part_quantities, fleet_size, hours_per_day, simulation=None,
+                        variance_to_mean=1.0):
+    """
+    analytic starting allocation by marginal analysis: the fleet comes fully equipped, then the spare with
+    the largest gain in log availability per unit cost is bought, one at a time, until nothing affordable
+    improves the availability.
+    returns the spares allocated and the budget left, like runners.do_first_allocation
+    """
+    spares_allocated = {}
+    for part in Simulation.resolve(simulation).part_catalog:
+        if part.name in part_quantities:
+            spares_allocated[part] = part_quantities[part.name] * fleet_size
+
+    candidates = {}
+    for part in spares_allocated:
+        mean = pipeline_mean(part, part_quantities[part.name], fleet_size, hours_per_day)
+        if mean > 0 and part.cost > 0:
+            candidates[part] = [mean, 0, backorder_table(mean, 16, variance_to_mean)]
+
+    def gain(part):
+        mean, spares, table = candidates[part]
+        if spares + 1 >= len(table):
+            table = candidates[part][2] = backorder_table(mean, 2 * len(table), variance_to_mean)
+        per_car = part_quantities[part.name]
+        return (_availability_term(table[spares + 1], per_car, fleet_size)
+                - _availability_term(table[spares], per_car, fleet_size)) / part.cost
+
+    gains = {part: gain(part) for part in candidates}
+    while True:
+        affordable = [part for part in gains if part.cost <= budget]
+        if not affordable:
+            break
+        best = max(affordable, key=lambda part: gains[part])
+        if gains[best] <= 0:
+            break
+        spares_allocated[best] += 1
+        budget -= best.cost
+        candidates[best][1] += 1
+        gains[best] = gain(best)
+
+    logger.info(f"Analytic allocation: { {part.name: value for part, value in spares_allocated.items()} }, "
+                f"expected serviceability "
+                f"{expected_serviceability(spares_allocated, part_quantities, fleet_size, hours_per_day, simulation, variance_to_mean)}")
+    return spares_allocated, budget
@@ -0,0 +1,317 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from logger import get_logger
+from classes import Simulation, Part_attributes, Part_physical, Car
+from reader import load_part_attributes, load_blueprints, build_blueprint_tree
+from runners import do_one_run
+
+logger = get_logger()
+
+BASELINE_VERSION = 1
+
+# the point every scaling case starts from. each case changes one of these at a time
+BASE_CASE = {'parts': 20, 'depth': 3, 'fan_out': 3, 'reuse': 0.5, 'fleet_size': 20, 'spares_depth': 2,
+             'days': 365, 'hours_per_day': 10}
+SCALING = {
+    'fleet_size': (5, 20, 80),
+    'fan_out': (2, 3, 5),
+    'spares_depth': (0, 2, 8),
+    'days': (90, 365, 1460),
+}
+QUICK_SCALING = {
+    'fleet_size': (5, 20),
+    'fan_out': (2, 3),
+    'spares_depth': (0, 2),
+    'days': (90, 365),
+}
+
+# whether a bigger number is better, for comparing against a baseline
+HIGHER_IS_BETTER = {'part_hours_per_second': True, 'seconds': False, 'peak_bytes': False,
+                    'seconds_per_slot': False}
+
+
+def synthetic_catalog(parts, simulation=None, seed=0, shape_factor=(0.8, 3.0), failure_hours=(200, 5000),
+                      life_limited=0.3, life_limit=(2000, 20000), depot_tat=(2, 30), cost=(10, 2000)):
+    """
+    a catalog of made up part numbers, Part_0 to Part_<parts - 1>, added to the given simulation.
+    the Weibull shape and scale, depot TAT and cost are drawn uniformly from the given ranges, and the given
+    share of the parts also get a life limit.
+    """
+    rng = random.Random(seed)
+    catalog = []
+    for index in range(parts):
+        catalog.append(Part_attributes(
+            name=f"Part_{index}",
+            failure_hours=round(rng.uniform(*failure_hours)),
+            life_limit=round(rng.uniform(*life_limit)) if rng.random() < life_limited else float('inf'),
+            shape_factor=round(rng.uniform(*shape_factor), 2),
+            depot_tat=rng.randint(*depot_tat),
+            cost=round(rng.uniform(*cost)),
+            simulation=simulation,
+        ))
+    return catalog
+
+
+def synthetic_blueprint_rows(part_names, depth=3, fan_out=3, reuse=0.5, seed=0):
+    """
+    (place, part_type, parent_place) rows of a tree with the given depth below the root and fan out at every
+    node. each place takes a part type already used in the tree with probability reuse, and otherwise the next
+    unused one (cycling through part_names when they run out).
+    """
+    rng = random.Random(seed)
+    fresh = iter(part_names * (1 + (fan_out ** (depth + 1)) // max(1, len(part_names))))
+    used = [next(fresh)]
+    rows = [('Root', used[0], 'None')]
+    level = ['Root']
+    for x1 in range(depth):
+        next_level = []
+        for parent in level:
+            for child in range(fan_out):
+                place = f"{parent}.{child}"
+                if rng.random() < reuse:
+                    part_type = rng.choice(used)
+                else:
+                    part_type = next(fresh)
+                    used.append(part_type)
+                rows.append((place, part_type, parent))
+                next_level.append(place)
+        level = next_level
+    return rows
+
+
+def synthetic_blueprint(part_names, depth=3, fan_out=3, reuse=0.5, seed=0):
+    """the Blueprint tree of synthetic_blueprint_rows"""
+    return build_blueprint_tree(synthetic_blueprint_rows(part_names, depth, fan_out, reuse, seed))
+
+
+def write_workbooks(directory, catalog, rows):
+    """writes the catalog and blueprint rows as parts_data.xlsx and blueprint_data.xlsx, for the loaders"""
+    import openpyxl
+
+    parts_path = os.path.join(directory, 'parts_data.xlsx')
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(['part_type', 'failure_hours', 'life_limit', 'oh_limit', 'shape_factor', 'cost', 'depot_tat',
+                  'placeholder'])
+    for part in catalog:
+        sheet.append([part.name, part.failure_hours, None if part.life_limit == float('inf') else part.life_limit,
+                      None, part.shape_factor, part.cost, part.depot_tat, False])
+    workbook.save(parts_path)
+
+    blueprint_path = os.path.join(directory, 'blueprint_data.xlsx')
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(['place', 'part_type', 'parent_place'])
+    for row in rows:
+        sheet.append(list(row))
+    workbook.save(blueprint_path)
+    return parts_path, blueprint_path
+
+
+def _case(params):
+    """a fresh simulation with the synthetic catalog and blueprint of a case, and its allocation"""
+    simulation = Simulation(seed=0)
+    catalog = synthetic_catalog(params['parts'], simulation)
+    car_blueprint = synthetic_blueprint([part.name for part in catalog], params['depth'], params['fan_out'],
+                                        params['reuse'])
+    part_quantities = car_blueprint.get_part_quantities()
+    spares_allocated = {part: part_quantities[part.name] * params['fleet_size'] + params['spares_depth']
+                        for part in catalog if part.name in part_quantities}
+    return simulation, car_blueprint, spares_allocated
+
+
+def _best_of(function, repeats):
+    best = float('inf')
+    for x1 in range(repeats):
+        gc.collect()
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _peak_bytes(function):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def time_run(params, repeats=3, run=do_one_run):
+    """
+    seconds for one run of the case (best of repeats), simulated part hours per second (installed slots x
+    fleet size x days x hours per day over the seconds) and the peak traced memory of a run
+    """
+    simulation, car_blueprint, spares_allocated = _case(params)
+    slots = len(car_blueprint.compile().places)
+
+    def one_run():
+        run(spares_allocated, params['days'], params['fleet_size'], params['hours_per_day'], car_blueprint,
+            simulation.new_run(0))
+
+    seconds = _best_of(one_run, repeats)
+    part_hours = slots * params['fleet_size'] * params['days'] * params['hours_per_day']
+    return {'seconds': seconds, 'part_hours_per_second': part_hours / seconds, 'peak_bytes': _peak_bytes(one_run)}
+
+
+def time_fill(params, repeats=3):
+    """seconds to build and fill the fleet from the warehouse, and per slot filled"""
+    simulation, car_blueprint, spares_allocated = _case(params)
+    slots = len(car_blueprint.compile().places)
+    best = float('inf')
+    for x1 in range(repeats):
+        run = simulation.new_run(0)
+        for part, count in spares_allocated.items():
+            for x2 in range(count):
+                Part_physical(part, simulation=run)
+        Part_physical.assign_parts_to_location(None, "Warehouse", run)
+        gc.collect()
+        start = time.perf_counter()
+        for x2 in range(params['fleet_size']):
+            Car(car_blueprint, run).fill_parts()
+        best = min(best, time.perf_counter() - start)
+    return {'seconds': best, 'seconds_per_slot': best / (slots * params['fleet_size'])}
+
+
+def time_loaders(params, repeats=3):
+    """seconds to load the case's workbooks, parsing them (cold) and from the input cache (warm)"""
+    simulation, car_blueprint, spares_allocated = _case(params)
+    rows = synthetic_blueprint_rows([part.name for part in simulation.part_catalog], params['depth'],
+                                    params['fan_out'], params['reuse'])
+    with tempfile.TemporaryDirectory() as directory:
+        parts_path, blueprint_path = write_workbooks(directory, simulation.part_catalog, rows)
+
+        def load(cache):
+            load_part_attributes(parts_path, Simulation(), cache)
+            load_blueprints(blueprint_path, cache)
+
+        cold = _best_of(lambda: load(False), repeats)
+        load(True)
+        warm = _best_of(lambda: load(True), repeats)
+    return {'cold': {'seconds': cold}, 'warm': {'seconds': warm}}
+
+
+def run_suite(scaling=None, repeats=3, loaders=True):
+    """
+    times every case of scaling ({parameter: values}, SCALING by default), each changing one parameter of
+    BASE_CASE. returns {case name: {measure: value}}
+    """
+    scaling = SCALING if scaling is None else scaling
+    cases = {}
+    for parameter, values in scaling.items():
+        for value in values:
+            params = dict(BASE_CASE, **{parameter: value})
+            cases[f"{parameter}={value}"] = params
+
+    results = {}
+    for name, params in cases.items():
+        results[f"run {name}"] = time_run(params, repeats)
+        results[f"fill {name}"] = time_fill(params, repeats)
+        logger.info(f"Benchmark {name}: {results[f'run {name}']}")
+    if loaders:
+        for name, value in time_loaders(BASE_CASE, repeats).items():
+            results[f"load {name}"] = value
+    return results
+
+
+def save_baseline(results, path):
+    """writes the results as a JSON baseline, with where they were measured"""
+    baseline = {'version': BASELINE_VERSION, 'python': sys.version.split()[0], 'machine': platform.machine(),
+                'platform': platform.platform(), 'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'base_case': BASE_CASE, 'results': results}
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(baseline, file, indent=2, sort_keys=True)
+    logger.info(f"Saved benchmark baseline to {path}")
+
+
+def load_baseline(path):
+    with open(path, encoding='utf-8') as file:
+        baseline = json.load(file)
+    if baseline.get('version') != BASELINE_VERSION:
+        raise ValueError(f"Benchmark baseline {path} is version {baseline.get('version')}, "
+                         f"expected {BASELINE_VERSION}")
+    return baseline
+
+
+def compare(results, baseline, tolerance=0.25):
+    """
+    the measures which got worse than the baseline by more than tolerance (a fraction), as a list of
+    (case, measure, baseline value, current value, relative change). cases missing from either side are
+    skipped.
+    """
+    regressions = []
+    for name, measures in results.items():
+        for measure, value in measures.items():
+            old = baseline['results'].get(name, {}).get(measure)
+            if old is None or measure not in HIGHER_IS_BETTER or not old:
+                continue
+            change = (value - old) / old
+            worse = -change if HIGHER_IS_BETTER[measure] else change
+            if worse > tolerance:
+                regressions.append((name, measure, old, value, change))
+    return regressions
+
+
+def bytes_per_serial(serials=100000, location="Warehouse"):
+    """
+    memory taken by each Part_physical serial, measured with tracemalloc over a fresh simulation holding
+    the given number of serials of one part number. includes the registry entry and the stock index.
+    """
+    simulation = Simulation(seed=0)
+    part_number = Part_attributes('Benchmark', failure_hours=1000, shape_factor=2, depot_tat=10, cost=100,
+                                  simulation=simulation)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        for x1 in range(serials):
+            Part_physical(part_number, location=location, simulation=simulation)
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return (after - before) / serials
+
+
+def _print_results(results):
+    for name, measures in results.items():
+        print(f"{name:32} " + "  ".join(f"{measure} {value:.4g}" for measure, value in sorted(measures.items())))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="scaling benchmarks on synthetic catalogs and blueprints")
+    parser.add_argument('--quick', action='store_true', help="fewer and smaller cases")
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--save', metavar='PATH', help="write the results as a JSON baseline")
+    parser.add_argument('--compare', metavar='PATH', help="compare the results with a JSON baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    results = run_suite(QUICK_SCALING if args.quick else SCALING, args.repeats)
+    results['serial'] = {'bytes': bytes_per_serial(10000 if args.quick else 100000)}
+    _print_results(results)
+
+    if args.save:
+        save_baseline(results, args.save)
+    if args.compare:
+        regressions = compare(results, load_baseline(args.compare), args.tolerance)
+        for name, measure, old, value, change in regressions:
+            print(f"REGRESSION {name} {measure}: {old:.4g} -> {value:.4g} ({change:+.0%})")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
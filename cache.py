@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+from logger import get_logger
+from classes import Simulation
+from runners import do_one_run
+
+logger = get_logger()
+
+# bump this when a change to the engines changes their results, so old cache entries stop matching
+CACHE_VERSION = 1
+
+
+def _blueprint_tree(node):
+    return [node.place, node.part_type, [_blueprint_tree(child) for child in node.children]]
+
+
+def _part_attributes(part):
+    return {name: repr(value) for name, value in sorted(vars(part).items())}
+
+
+def run_key(spares_allocated, days, fleet_size, hours_per_day, car_blueprint, part_catalog, seed, engine=''):
+    """
+    sha256 of everything a run depends on: the allocation, the mission profile, the blueprint tree, the
+    attributes of every part in the catalog, the random seed and the engine used
+    """
+    content = {
+        'version': CACHE_VERSION,
+        'engine': engine,
+        'allocation': sorted((part.name, count) for part, count in spares_allocated.items()),
+        'days': days,
+        'fleet_size': fleet_size,
+        'hours_per_day': hours_per_day,
+        'blueprint': _blueprint_tree(car_blueprint),
+        'catalog': [_part_attributes(part) for part in part_catalog],
+        'seed': seed,
+    }
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=repr).encode()).hexdigest()
+
+
+class RunCache:
+    """
+    on disk cache of run results, one pickle per run key. reading an entry marks it as recently used, and
+    once the files add up to more than max_bytes the least recently used ones are removed.
+    the cache only holds plain files, so it can be shared by sweep workers and kept between sessions.
+    the size of the cache is kept as a running total, so writes only scan the directory when the total goes
+    over max_bytes. entries written by other processes are counted from the next scan.
+    """
+
+    def __init__(self, directory='.run_cache', max_bytes=1 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self.total_bytes = self._scan()[1]
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+    def get(self, key):
+        """the stored result, or None"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                result = pickle.load(file)
+            os.utime(path)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+    def put(self, key, result):
+        path = self._path(key)
+        file_descriptor, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(file_descriptor, 'wb') as file:
+            pickle.dump(result, file, protocol=pickle.HIGHEST_PROTOCOL)
+        size = os.path.getsize(temp_path)
+        try:
+            size -= os.path.getsize(path)
+        except FileNotFoundError:
+            pass
+        os.replace(temp_path, path)
+        self.total_bytes += size
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def _scan(self):
+        """(mtime, size, path) of every entry, and their total size"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.pkl'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries, sum(size for x1, size, x2 in entries)
+
+    def evict(self):
+        """removes the least recently used entries until the cache fits in max_bytes"""
+        entries, total = self._scan()
+        for x1, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self.total_bytes = total
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(('.pkl', '.tmp')):
+                os.remove(entry.path)
+        self.total_bytes = 0
+
+    def run(self, spares_allocated, days, fleet_size, hours_per_day, car_blueprint, simulation=None, seed=None,
+            run=do_one_run):
+        """
+        the result of run (do_one_run by default) for a fresh simulation seeded with seed, from the cache if
+        it has been run before. runs without a seed are not reproducible, so they are never cached.
+        """
+        simulation = Simulation.resolve(simulation)
+        if seed is None:
+            return run(spares_allocated, days, fleet_size, hours_per_day, car_blueprint, simulation.new_run())
+
+        key = run_key(spares_allocated, days, fleet_size, hours_per_day, car_blueprint, simulation.part_catalog,
+                      seed, f"{run.__module__}.{run.__qualname__}")
+        result = self.get(key)
+        if result is None:
+            result = run(spares_allocated, days, fleet_size, hours_per_day, car_blueprint, simulation.new_run(seed))
+            self.put(key, result)
+        return result
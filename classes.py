@@ -1,11 +1,95 @@
+import heapq
 import random
 import math
+from array import array
 from collections import defaultdict
 
 from logger import get_logger
 
 logger = get_logger()
 
+# where the parts waiting in each transit location end up at the end of the day
+TRANSIT_DESTINATIONS = {'Transit_Graveyard': 'Graveyard', 'Transit_Depot_OH': 'Depot',
+                        'Transit_Depot_UER': 'Depot', 'Transit_Warehouse': 'Warehouse'}
+
+
+class Simulation:
+    """
+    holds the state of one simulation: the part catalog, the serial inventory, the cars and the random
+    number generator. independent simulations can coexist in one process or run in worker processes.
+
+    anything created without a simulation goes into Simulation.default, whose lists are the class level
+    master lists and which draws from the global random module.
+
+    trace switches on the per event debug logging of the hot paths (hours, moves, fills, serviceability
+    checks). metrics is an optional metrics.RunMetrics which counts the transitions instead, and profiler
+    an optional profiling.PhaseTimer which times the phases of the runs.
+    """
+
+    default = None
+
+    def __init__(self, part_catalog=None, seed=None, rng=None, trace=False, metrics=None, profiler=None):
+        # Part_attributes in this simulation
+        self.part_catalog = part_catalog if part_catalog is not None else []
+        # Part_physical serials by serial number, in serial number order. this is the only registry of the
+        # serials, parts is a live view of it
+        self.parts_by_serial = {}
+        self.serial_counter = 1
+        self.cars = []
+        # serviceable parts sitting in the warehouse: part type name -> heap of serial numbers.
+        # the heaps can hold stale serials, stock_serials is the set of serials actually in stock
+        self.warehouse_stock = defaultdict(list)
+        self.stock_serials = set()
+        # part counts kept up to date as the parts move, so the daily summaries do not scan every serial.
+        # (part type name, location) -> count, part type name -> count of serials and of serviceable ones
+        self.location_counts = defaultdict(int)
+        self.type_counts = defaultdict(int)
+        self.serviceable_counts = defaultdict(int)
+        # transit location -> parts which went there since the transit was last settled
+        self.in_transit = defaultdict(list)
+        self.rng = rng if rng is not None else random.Random(seed)
+        self.trace = trace
+        self.metrics = metrics
+        self.profiler = profiler
+        # current day of the run, set by the engines so the metrics can be counted per day
+        self.day = None
+
+    @property
+    def parts(self):
+        """the Part_physical serials, in serial number order"""
+        return self.parts_by_serial.values()
+
+    @classmethod
+    def resolve(cls, simulation):
+        """Returns the simulation to use, falling back to the default one."""
+        return cls.default if simulation is None else simulation
+
+    def new_run(self, seed=None):
+        """
+        Returns a fresh simulation sharing this one's part catalog, ready for a run. This is cheaper than
+        resetting the serials and cars of an existing simulation. trace, metrics and profiler carry over.
+        """
+        return Simulation(part_catalog=self.part_catalog, seed=seed, trace=self.trace, metrics=self.metrics,
+                          profiler=self.profiler)
+
+    def reset(self):
+        """Removes all serials and cars, keeping the part catalog."""
+        self.parts_by_serial.clear()
+        self.serial_counter = 1
+        self.cars.clear()
+        self.warehouse_stock.clear()
+        self.stock_serials.clear()
+        self.clear_counts()
+        self.day = None
+
+    def clear_counts(self):
+        self.location_counts.clear()
+        self.type_counts.clear()
+        self.serviceable_counts.clear()
+        self.in_transit.clear()
+
+
+Simulation.default = Simulation(rng=random)
 
 
 class Part_attributes:
@@ -13,11 +97,11 @@ class Part_attributes:
     this is the part number Class
     """
 
-    master_list = []  # Class-level attribute to track all parts created
+    master_list = Simulation.default.part_catalog  # Class-level attribute to track all parts created
 
     def __init__(self, name, failure_hours=float('inf'), life_limit=float('inf'), depot_limit=float('inf'),
                  depot_repair=float('inf'), depot_overhaul=float('inf'), shape_factor=1, depot_tat=1, cost=1000,
-                 placeholder=False):
+                 placeholder=False, simulation=None):
         self.name = name
         self.failure_hours = failure_hours
         self.shape_factor = shape_factor
@@ -30,8 +114,8 @@ class Part_attributes:
         self.cost = cost
         # placeholders are for imaginary containers for subparts, if I ever decide to use it
 
-        # Add the current instance to the master list whenever a new part is created
-        Part_attributes.master_list.append(self)
+        # Add the current instance to the part catalog whenever a new part is created
+        Simulation.resolve(simulation).part_catalog.append(self)
 
     def __repr__(self):
         return (f"PartBlueprint(Name: {self.name}, Failure Hours: {self.failure_hours}, "
@@ -41,99 +125,166 @@ class Part_attributes:
                 f"Cost: {self.cost}, Placeholder: {self.placeholder})")
 
     @classmethod
-    def remove_part(cls, part):
+    def remove_part(cls, part, simulation=None):
         """Removes a specific part from the master list."""
-        if part in cls.master_list:
-            cls.master_list.remove(part)
+        part_catalog = Simulation.resolve(simulation).part_catalog
+        if part in part_catalog:
+            part_catalog.remove(part)
             logger.info(f"Removed {part.name} from master list.")
         else:
             logger.info(f"{part.name} not found in master list.")
 
     @classmethod
-    def reset_master_list(cls):
+    def reset_master_list(cls, simulation=None):
         """Removes all instances and resets the master list to an empty list."""
-        # Explicitly delete instances
-        for part in cls.master_list:
-            del part  # Deletes the instance itself, which triggers __del__ if defined
-        cls.master_list.clear()  # Clear the master list itself
+        Simulation.resolve(simulation).part_catalog.clear()  # Clear the master list itself
         logger.info("Master list has been reset and all parts have been removed.")
 
-    def __del__(self):
-        """Optional: Define custom deletion behavior when an instance is deleted."""
-        logger.info(f"Part {self.name} is being deleted.")
-
-
 
 class Part_physical:
     # this class stores the serial number information
-    master_list = []
-    # Class-level list to store all created parts
-    master_dict = {}
-    # Class-level counter to generate unique serial numbers
-    serial_counter = 1
+    # the class level lists belong to the default simulation
+    master_list = Simulation.default.parts
+    master_dict = Simulation.default.parts_by_serial
 
-    def __init__(self, blueprint: Part_attributes, operating_hours= 0, location=None):
+    # a simulation can hold millions of serials, so they have no instance dict. the constants of the part
+    # number (cost, life and depot limits) are read through the blueprint
+    __slots__ = ('simulation', 'blueprint', 'serial_number', 'car', 'slot', '_serviceable', '_location',
+                 'operating_hours', 'failure_hours', 'depot_tat')
+
+    def __init__(self, blueprint: Part_attributes, operating_hours= 0, location=None, simulation=None):
         """
         Initialize the Part instance, associating it with a PartBlueprint and setting its location.
         """
+        self.simulation = Simulation.resolve(simulation)
         self.blueprint = blueprint
-        self.serial_number = Part_physical.serial_counter
+        self.serial_number = self.simulation.serial_counter
+        # the car and slot the part is fitted to
+        self.car = None
+        self.slot = -1
+        self._serviceable = False
+        self._location = None
+        self.simulation.type_counts[blueprint.name] += 1
+        self.simulation.location_counts[(blueprint.name, None)] += 1
         self.location = location
         self.operating_hours = 0
         if self.blueprint.failure_hours != float('inf'):
-            self.failure_hours = self.weibull_inverse_cdf(self.blueprint.shape_factor,self.blueprint.failure_hours)
+            self.failure_hours = self.weibull_inverse_cdf(self.blueprint.shape_factor,self.blueprint.failure_hours,
+                                                          self.simulation.rng)
         else:
             self.failure_hours = self.blueprint.failure_hours
-        self.life_limit = self.blueprint.life_limit
-        self.depot_limit = self.blueprint.depot_limit
         self.serviceable = self.operating_hours < self.failure_hours
         self.depot_tat = 0
-        self.cost = self.blueprint.cost
-
 
-        # Register this part in the global list of created parts
-        Part_physical.master_dict[Part_physical.serial_counter] = self
-        Part_physical.master_list.append(self)
+        # Register this part in the simulation's registry of created parts
+        self.simulation.parts_by_serial[self.serial_number] = self
 
         # Increment the serial number counter for the next part
-        Part_physical.serial_counter += 1
+        self.simulation.serial_counter += 1
 
     def __repr__(self):
         return (f"Part(Serial: {self.serial_number}, Name: {self.blueprint.name}, "
                 f"Location: {self.location}, Operating Hours: {self.operating_hours}, "
                 f"Failure Hours: {self.blueprint.failure_hours}, actual failure time :{self.failure_hours}, Serviceable: {self.serviceable})")
 
+    @property
+    def life_limit(self):
+        return self.blueprint.life_limit
+
+    @property
+    def depot_limit(self):
+        return self.blueprint.depot_limit
+
+    @property
+    def cost(self):
+        return self.blueprint.cost
+
+    @property
+    def location(self):
+        return self._location
+
+    @location.setter
+    def location(self, value):
+        simulation = self.simulation
+        counts = simulation.location_counts
+        counts[(self.blueprint.name, self._location)] -= 1
+        counts[(self.blueprint.name, value)] += 1
+        self._location = value
+        if value in TRANSIT_DESTINATIONS:
+            simulation.in_transit[value].append(self)
+        self._update_stock()
+
+    @property
+    def serviceable(self):
+        return self._serviceable
+
+    @serviceable.setter
+    def serviceable(self, value):
+        if bool(value) != bool(self._serviceable):
+            self.simulation.serviceable_counts[self.blueprint.name] += 1 if value else -1
+            if self.car is not None:
+                self.car._part_changed(self.slot, value)
+        self._serviceable = value
+        self._update_stock()
+
+    def _update_stock(self):
+        """Keeps the warehouse stock index in step with the part's location and serviceability."""
+        stock_serials = self.simulation.stock_serials
+        if self._location == "Warehouse" and self._serviceable:
+            if self.serial_number not in stock_serials:
+                stock_serials.add(self.serial_number)
+                heapq.heappush(self.simulation.warehouse_stock[self.blueprint.name], self.serial_number)
+        else:
+            # the serial is left in the heap and skipped when it comes to the top
+            stock_serials.discard(self.serial_number)
+
+    @classmethod
+    def issue_from_warehouse(cls, part_type, simulation=None):
+        """
+        Return the serviceable warehouse part of this type with the lowest serial number, or None if there
+        is no stock. The part is taken out of the stock index, so the caller has to move it somewhere.
+        """
+        simulation = Simulation.resolve(simulation)
+        stock = simulation.warehouse_stock.get(part_type)
+        while stock:
+            serial_number = heapq.heappop(stock)
+            if serial_number in simulation.stock_serials:
+                simulation.stock_serials.discard(serial_number)
+                return simulation.parts_by_serial[serial_number]
+        return None
+
     @staticmethod
-    def weibull_inverse_cdf(shape_factor, scale_factor):
+    def weibull_inverse_cdf(shape_factor, scale_factor, rng=random):
         """
         Generate a value from the inverse CDF of the Weibull distribution.
 
         Parameters:
         shape_factor (beta): The shape parameter (β)
         scale_factor (lambda): The scale parameter (λ)
-        u (float): A uniform random variable between 0 and 1.
+        rng: where the uniform random variable u between 0 and 1 comes from.
 
         Returns:
         float: A value sampled from the Weibull distribution.
         """
-        u = random.random()
+        u = rng.random()
         fail_time = scale_factor * (-math.log(1 - u))**(1 / shape_factor)
         return fail_time
 
     @classmethod
-    def all_parts(cls):
+    def all_parts(cls, simulation=None):
         """Method to return all parts created and their locations."""
         return "\n".join(f"Serial Number: {part.serial_number}, {part.blueprint.name}, Location: {part.location}, "
                          f"Operating Hours: {part.operating_hours}, Failure Hours: {part.failure_hours}, "
                          f"Serviceable: {part.serviceable}"
-                         for part in cls.master_list)
+                         for part in Simulation.resolve(simulation).parts)
 
     def reset_operating_hours(self):
         """Method to reset operating hours to zero."""
         self.operating_hours = 0
         # Update serviceable status after reset
         if self.blueprint.failure_hours != float('inf'):
-            self.failure_hours = self.weibull_inverse_cdf(self.blueprint.shape_factor,self.blueprint.failure_hours)
+            self.failure_hours = self.weibull_inverse_cdf(self.blueprint.shape_factor,self.blueprint.failure_hours,
+                                                          self.simulation.rng)
             #print("hello we are here")
         else:
             self.failure_hours = self.blueprint.failure_hours
@@ -161,6 +312,22 @@ class Part_physical:
         else:
             return False
 
+    def hours_to_transition(self):
+        """
+        Number of whole operating hours until the part next reaches its life limit, depot limit or
+        failure time, or None if it never will. Checks are made after each hour, so this is at least 1.
+        """
+        threshold = min(self.life_limit, self.depot_limit, self.failure_hours)
+        if threshold == float('inf'):
+            return None
+        hours = max(1, math.ceil(threshold - self.operating_hours))
+        # guard against rounding in the subtraction, the hourly checks compare the sums directly
+        while hours > 1 and self.operating_hours + hours - 1 >= threshold:
+            hours -= 1
+        while self.operating_hours + hours < threshold:
+            hours += 1
+        return hours
+
     def update_operating_hours(self, hours):
         """Update the operating hours and check if the part is still serviceable."""
         self.operating_hours += hours
@@ -168,21 +335,31 @@ class Part_physical:
         if self.reach_life() == True:
             self.serviceable = False
             self.location = 'Transit_Graveyard'
+            self._count('Life_Ex')
         elif self.needs_depot() == True:
             self.serviceable = False
             self.location = 'Transit_Depot_OH'
             self.depot_tat = self.blueprint.depot_tat
+            self._count('Overhaul')
         elif self.has_failed() == True:
             self.serviceable = False
             self.location = 'Transit_Depot_UER'
             self.depot_tat = self.blueprint.depot_tat
+            self._count('Failed')
         else:
             self.serviceable = True
 
         #self.blueprint.serviceable = self.serviceable
-        logger.info(
-            f"Operating hours for part {self.serial_number} ({self.blueprint.name}) updated to {self.operating_hours}. "
-            f"Serviceable: {self.serviceable}")
+        if self.simulation.trace:
+            logger.debug(
+                f"Operating hours for part {self.serial_number} ({self.blueprint.name}) updated to {self.operating_hours}. "
+                f"Serviceable: {self.serviceable}")
+
+    def _count(self, transition):
+        """counts a transition of this part if the simulation has metrics"""
+        metrics = self.simulation.metrics
+        if metrics is not None:
+            metrics.count(transition, self.blueprint.name, self.simulation.day)
 
     def update_depot_days(self, hours):
         """Update the operating hours and check if the part is still serviceable."""
@@ -192,133 +369,148 @@ class Part_physical:
             self.serviceable = True
             self.location = 'Transit_Warehouse'
             # update failure time
-            self.failure_hours += self.weibull_inverse_cdf(self.blueprint.shape_factor,self.blueprint.failure_hours)
+            self.failure_hours += self.weibull_inverse_cdf(self.blueprint.shape_factor,self.blueprint.failure_hours,
+                                                           self.simulation.rng)
+            self._count('Repaired')
 
 
     @classmethod
-    def remove_part(cls, serial_number):
+    def remove_part(cls, serial_number, simulation=None):
         """Removes a specific part from the master list based on serial number."""
-        if serial_number in cls.master_dict:
-            part = cls.master_dict.pop(serial_number)  # Remove the part from the master list and store the reference
+        simulation = Simulation.resolve(simulation)
+        if serial_number in simulation.parts_by_serial:
+            # Remove the part from the registry, and from the counts
+            part = simulation.parts_by_serial.pop(serial_number)
+            simulation.stock_serials.discard(serial_number)
+            name = part.blueprint.name
+            simulation.type_counts[name] -= 1
+            simulation.location_counts[(name, part.location)] -= 1
+            if part.serviceable:
+                simulation.serviceable_counts[name] -= 1
             logger.info(f"Removed Serial Number {serial_number} from master list ")
-            if part in cls.master_list:
-                del part
 
         else:
             logger.info(f"Part with Serial Number {serial_number} not found in master list.")
 
     @classmethod
-    def reset_master_list(cls):
+    def reset_master_list(cls, simulation=None):
         """Removes all instances and resets the master list to an empty list."""
-        Part_physical.master_dict.clear()  # Clear the master list itself
-        for parts in Part_physical.master_list:
-            del parts
-        cls.master_list.clear()  # Finally clear the list itself
+        simulation = Simulation.resolve(simulation)
+        simulation.parts_by_serial.clear()  # Clear the master list itself
+        simulation.warehouse_stock.clear()
+        simulation.stock_serials.clear()
+        simulation.clear_counts()
+        simulation.serial_counter = 1
         logger.info("Master list has been reset")
 
-    def __del__(self):
-        """Optional: Define custom deletion behavior when an instance is deleted."""
-        pass
-
     @classmethod
-    def assign_parts_to_location(cls, current_location, future_location):
+    def assign_parts_to_location(cls, current_location, future_location, simulation=None):
         """
         Iterate over all parts in the master list and if their location matches the current_location,
         assign them to the future_location.
         """
-        for part in cls.master_list:
+        simulation = Simulation.resolve(simulation)
+        for part in simulation.parts:
             if part.location == current_location:
                 part.location = future_location
-                logger.info(f"Part {part.serial_number} ({part.blueprint.name}) moved from {current_location} to {future_location}.")
-            else:
-                logger.info(f"Part {part.serial_number} ({part.blueprint.name}) is not located at {current_location}, no change.")
+                if simulation.trace:
+                    logger.debug(f"Part {part.serial_number} ({part.blueprint.name}) moved from {current_location} to {future_location}.")
+            elif simulation.trace:
+                logger.debug(f"Part {part.serial_number} ({part.blueprint.name}) is not located at {current_location}, no change.")
+
 
+    @classmethod
+    def count_at(cls, part_type, location, simulation=None):
+        """Number of parts of a type at a location, from the simulation's count table."""
+        return Simulation.resolve(simulation).location_counts.get((part_type, location), 0)
 
     @classmethod
-    def group_parts_by_blueprint(cls):
+    def settle_transit(cls, locations=tuple(TRANSIT_DESTINATIONS), simulation=None):
+        """
+        Moves the parts waiting in the given transit locations on to their destination: the graveyard,
+        the depot or the warehouse. Returns the number of parts moved.
+        """
+        simulation = Simulation.resolve(simulation)
+        moved = 0
+        for location in locations:
+            destination = TRANSIT_DESTINATIONS[location]
+            for part in simulation.in_transit.pop(location, ()):
+                # a part can have moved on again since it was queued
+                if part.location == location:
+                    part.location = destination
+                    moved += 1
+        return moved
+
+    @classmethod
+    def group_parts_by_blueprint(cls, simulation=None):
         """
         Groups parts by their blueprint, and counts the total and serviceable parts.
         Returns a dictionary where each key is the blueprint name, and the value is
         a dictionary containing:
         - 'serviceable_count': The count of serviceable parts for that blueprint.
         - 'total_count': The total count of parts for that blueprint.
-        """
-        blueprint_stats = defaultdict(
-            lambda: {'serviceable_count': 0, 'total_count': 0, "Life_Ex": 0, "Overhaul": 0, "Failed": 0})
-
-        for part in cls.master_list:
-            blueprint_name = part.blueprint.name  # Get the name of the blueprint
-            blueprint_stats[blueprint_name]['total_count'] += 1  # Increment total count
-
-            if part.serviceable == True:
-                blueprint_stats[blueprint_name]['serviceable_count'] += 1  # Increment serviceable count
-            if part.location == "Transit_Graveyard":
-                blueprint_stats[blueprint_name]["Life_Ex"] += 1
-                # send to the Graveyard
-                part.location = "Graveyard"
-            elif part.location == 'Transit_Depot_OH':
-                blueprint_stats[blueprint_name]['Overhaul'] += 1
-                # send to the Depot
-                part.location = "Depot"
-            if part.location == 'Transit_Depot_UER':
-                blueprint_stats[blueprint_name]['Failed'] += 1
-                # send to the Depot
-                part.location = "Depot"
-
-        return dict(blueprint_stats)
+        - 'Life_Ex', 'Overhaul', 'Failed': parts waiting to go to the graveyard or the depot.
+        Those parts are then moved on, see settle_transit.
+        """
+        simulation = Simulation.resolve(simulation)
+        blueprint_stats = {}
+        for blueprint_name, total in simulation.type_counts.items():
+            if total:
+                blueprint_stats[blueprint_name] = {
+                    'serviceable_count': simulation.serviceable_counts.get(blueprint_name, 0),
+                    'total_count': total,
+                    "Life_Ex": cls.count_at(blueprint_name, 'Transit_Graveyard', simulation),
+                    "Overhaul": cls.count_at(blueprint_name, 'Transit_Depot_OH', simulation),
+                    "Failed": cls.count_at(blueprint_name, 'Transit_Depot_UER', simulation)}
+
+        cls.settle_transit(('Transit_Graveyard', 'Transit_Depot_OH', 'Transit_Depot_UER'), simulation)
+        return blueprint_stats
 
     @classmethod
-    def parts_grouped_depot_warehouse(cls):
+    def parts_grouped_depot_warehouse(cls, simulation=None):
         """
-        Groups parts by their blueprint, and counts the total and serviceable parts.
+        Groups parts by their blueprint, and counts the parts under repair and the ones which just
+        finished repair. The finished ones are then moved to the warehouse, see settle_transit.
         Returns a dictionary where each key is the blueprint name, and the value is
         a dictionary containing:
-        - 'serviceable_count': The count of serviceable parts for that blueprint.
         - 'total_count': The total count of parts for that blueprint.
+        - 'Under_Repair', 'Finished_Repair'
         """
-        blueprint_stats = defaultdict(
-            lambda: {'total_count': 0, "Under_Repair": 0, "Finished_Repair": 0})
-
-        for part in cls.master_list:
-            blueprint_name = part.blueprint.name  # Get the name of the blueprint
-            blueprint_stats[blueprint_name]['total_count'] += 1  # Increment total count
+        simulation = Simulation.resolve(simulation)
+        blueprint_stats = {}
+        for blueprint_name, total in simulation.type_counts.items():
+            if total:
+                blueprint_stats[blueprint_name] = {
+                    'total_count': total,
+                    "Under_Repair": cls.count_at(blueprint_name, 'Depot', simulation),
+                    "Finished_Repair": cls.count_at(blueprint_name, 'Transit_Warehouse', simulation)}
 
-            if part.location == "Transit_Warehouse":
-                blueprint_stats[blueprint_name]["Finished_Repair"] += 1
-                # send to the Warehouse
-                part.location = "Warehouse"
-            elif part.location == 'Depot':
-                blueprint_stats[blueprint_name]['Under_Repair'] += 1
-                # we're done. no need to do anything else
+        cls.settle_transit(('Transit_Warehouse',), simulation)
+        return blueprint_stats
 
-        return dict(blueprint_stats)
     @classmethod
-    def parts_grouped_summary(cls):
+    def parts_grouped_summary(cls, simulation=None):
         """
-        Groups parts by their blueprint, and counts the total and serviceable parts.
+        Groups parts by their blueprint, and counts where they are.
         Returns a dictionary where each key is the blueprint name, and the value is
         a dictionary containing:
-        - 'serviceable_count': The count of serviceable parts for that blueprint.
         - 'total_count': The total count of parts for that blueprint.
+        - 'In_Use', 'Depot', 'Warehouse', 'Graveyard'
         """
-        blueprint_stats = defaultdict(
-            lambda: {'total_count': 0, "In_Use": 0, "Depot": 0,"Warehouse":0, "Graveyard":0})
+        simulation = Simulation.resolve(simulation)
+        blueprint_stats = {}
+        for blueprint_name, total in simulation.type_counts.items():
+            if total:
+                blueprint_stats[blueprint_name] = {
+                    'total_count': total,
+                    "In_Use": cls.count_at(blueprint_name, 'Car', simulation),
+                    "Depot": cls.count_at(blueprint_name, 'Depot', simulation),
+                    "Warehouse": cls.count_at(blueprint_name, 'Warehouse', simulation),
+                    "Graveyard": cls.count_at(blueprint_name, 'Graveyard', simulation)}
 
-        for part in cls.master_list:
-            blueprint_name = part.blueprint.name  # Get the name of the blueprint
-            blueprint_stats[blueprint_name]['total_count'] += 1  # Increment total count
+        return blueprint_stats
 
-            if part.location == "Car":
-                blueprint_stats[blueprint_name]["In_Use"] += 1
-            elif part.location == 'Depot':
-                blueprint_stats[blueprint_name]['Depot'] += 1
-            elif part.location == 'Warehouse':
-                blueprint_stats[blueprint_name]['Warehouse'] += 1
-            elif part.location == 'Graveyard':
-                blueprint_stats[blueprint_name]['Graveyard'] += 1
-                # we're done. no need to do anything else
 
-        return dict(blueprint_stats)
 class Blueprint:
     def __init__(self, place, part_type):
         """
@@ -328,13 +520,24 @@ class Blueprint:
         self.place = place
         self.part_type = part_type
         self.children = []
+        self._compiled = None
 
     def add_child(self, place, part_type):
         # Add a child node with a specific place and part_type
         new_node = Blueprint(place, part_type)
         self.children.append(new_node)
+        self._compiled = None
         return new_node
 
+    def compile(self):
+        """
+        Returns the CompiledBlueprint of this tree, compiling it the first time. It is shared by every car
+        built from this blueprint, so the tree should not be changed below this node once cars exist.
+        """
+        if getattr(self, '_compiled', None) is None:
+            self._compiled = CompiledBlueprint(self)
+        return self._compiled
+
     def __repr__(self, level=0):
         # Recursive function to represent the blueprint structure
         result = "\t" * level + f"Place: {self.place}, Part Type: {self.part_type}\n"
@@ -366,104 +569,162 @@ class Blueprint:
         return part_quantities
 
 
-class Car:
-    # Class-level list to store all created parts
-    created_cars = []
-    # Class-level counter to generate unique serial numbers
-    serial_counter = 1
+class CompiledBlueprint:
+    """
+    A blueprint tree flattened into slots, one per place in preorder (the order the tree is filled in).
+    For each slot it keeps the place, the part type, the part type id, the parent slot (-1 for the root)
+    and subtree_end, the slot after the last one below it, so slots[i:subtree_end[i]] is the subtree of i.
+    A place which appears more than once in the tree only gets a slot the first time, as cars have always
+    held one part per place.
+    """
 
     def __init__(self, blueprint):
+        places, part_types, parents, ends = [], [], [], []
+        slot_of_place = {}
+        # iterative preorder walk: (node, parent slot), with an end marker to close the subtree
+        stack = [(blueprint, -1)]
+        while stack:
+            node, parent = stack.pop()
+            if node is None:
+                ends[parent] = len(places)
+                continue
+            slot = parent
+            if node.place not in slot_of_place:
+                slot = len(places)
+                slot_of_place[node.place] = slot
+                places.append(node.place)
+                part_types.append(node.part_type)
+                parents.append(parent)
+                ends.append(slot + 1)
+                stack.append((None, slot))
+            for child in reversed(node.children):
+                stack.append((child, slot))
+
+        self.places = tuple(places)
+        self.part_types = tuple(part_types)
+        self.type_names = tuple(dict.fromkeys(part_types))
+        type_index = {name: index for index, name in enumerate(self.type_names)}
+        self.type_ids = tuple(type_index[name] for name in part_types)
+        self.parent = tuple(parents)
+        self.subtree_end = tuple(ends)
+        self.slot_of_place = slot_of_place
+
+    def __len__(self):
+        return len(self.places)
+
+
+class Car:
+    # Class-level list of the cars in the default simulation
+    created_cars = Simulation.default.cars
+
+    def __init__(self, blueprint, simulation=None):
+        self.simulation = Simulation.resolve(simulation)
         self.blueprint = blueprint
-        self.parts = {}
+        self.compiled = blueprint.compile()
+        # serial number installed in each slot of the compiled blueprint, 0 where the slot is empty
+        self.slots = array('q', bytes(8 * len(self.compiled)))
+        # number of slots which are empty or hold an unserviceable part, and the slots whose part went
+        # unserviceable since the last remove_unserviceable_parts
+        self.bad_slots = len(self.compiled)
+        self.dirty_slots = set()
+        # the serviceable flag is only updated by check_serviceability
         self.serviceable = False
 
-        # Register this car in the global list of created cars
-        Car.created_cars.append(self)
+        # Register this car in the simulation's list of created cars
+        self.simulation.cars.append(self)
 
-        # Increment the serial number counter for the next car
-        Car.serial_counter += 1
+    @property
+    def parts(self):
+        """
+        The installed parts as {place: {'part_type': part type, 'part': Part_physical}}, in blueprint order.
+        This is built on each access, changing it does not change the car.
+        """
+        compiled = self.compiled
+        parts_by_serial = self.simulation.parts_by_serial
+        return {compiled.places[slot]: {'part_type': compiled.part_types[slot], 'part': parts_by_serial[serial]}
+                for slot, serial in enumerate(self.slots) if serial}
+
+    def installed_parts(self):
+        """The parts installed in the car, in blueprint order."""
+        parts_by_serial = self.simulation.parts_by_serial
+        return [parts_by_serial[serial] for serial in self.slots if serial]
 
     def fill_parts(self):
         """
-        Fills the car with parts based on its blueprint.
+        Fills the empty slots of the car from the warehouse, in blueprint order.
         This method should be called after the car has been created.
         """
-        self._fill_parts(self.blueprint)
-    def _fill_parts(self, node):
-        """
-        Recursively fill in the parts based on the Blueprint.
-        For each node in the blueprint, get the corresponding part from the master list.
-        """
-        # Check if the car node already has a part assigned
-        if node.place in self.parts:
-            #print(f"Car already has a part at {node.place}. Skipping.")
-            pass
+        slots = self.slots
+        compiled = self.compiled
+        for slot in range(len(slots)):
+            if slots[slot]:
+                continue
+            part = Part_physical.issue_from_warehouse(compiled.part_types[slot], self.simulation)
+            if part is not None:
+                self._install(slot, part)
+                # Set the part's location to "Car"
+                part.location = "Car"
+                part._count('Fitted')
+                if self.simulation.trace:
+                    logger.debug(f"Assigned part {part.blueprint.name} to place {compiled.places[slot]}.")
+
+    def _install(self, slot, part):
+        self.slots[slot] = part.serial_number
+        part.car = self
+        part.slot = slot
+        if part.serviceable:
+            self.bad_slots -= 1
         else:
-
-            for part in Part_physical.master_list:
-                # Check if part matches the blueprint and its location is None
-                if part.blueprint.name == node.part_type and part.location == "Warehouse" and part.serviceable == True:
-                    # Assign the part to the current location
-                    self.parts[node.place] = {
-                        'part_type': node.part_type,
-                        'part': part
-                    }
-                    # Set the part's location to "Car"
-                    part.location = "Car"
-                    logger.info(f"Assigned part {part.blueprint.name} to place {node.place}.")
-                    break  # Exit after assigning the part for this location
-
-        # Recursively fill in children (sub-parts)
-        for child in node.children:
-            self._fill_parts(child)
+            self.dirty_slots.add(slot)
+
+    def _uninstall(self, slot, part):
+        self.slots[slot] = 0
+        part.car = None
+        part.slot = -1
+        if part.serviceable:
+            self.bad_slots += 1
+
+    def _part_changed(self, slot, serviceable):
+        """called by an installed part when its serviceability changes"""
+        if serviceable:
+            self.bad_slots -= 1
+        else:
+            self.bad_slots += 1
+            self.dirty_slots.add(slot)
 
     def check_serviceability(self):
         """
-        Recursively check if all parts required by the car's blueprint are filled.
-        If all parts are assigned to their respective places, the car is serviceable.
+        The car is serviceable when every slot of the blueprint has a part and all the parts are serviceable.
+        This only reads the count of bad slots, which is kept up to date as parts come and go.
         """
-        # Start by checking the serviceability of the root node (the main car blueprint)
-        is_serviceable = self._check_serviceability_recursive(self.blueprint)
-
-        # Update the car's serviceable status based on the result
-        self.serviceable = is_serviceable
+        self.serviceable = self.bad_slots == 0
+        if not self.serviceable and self.simulation.trace:
+            self._trace_unserviceable()
         return self.serviceable
 
-    def _check_serviceability_recursive(self, node):
-        """
-        Helper function to recursively check serviceability by going through each node's place.
-        """
-        # Check if a part has been assigned to the current node's place
-        if node.place not in self.parts:
-            logger.info(f"Missing part at {node.place}. Car is not serviceable.")
-            return False  # If the part is not assigned, the car is not serviceable
-
-        # Check if the part assigned at the current node is serviceable
-        part = self.parts[node.place]['part']
-        if not part.serviceable:  # If the part itself is unserviceable
-            logger.info(f"Part {part.blueprint.name} at {node.place} is unserviceable.")
-            return False  # If the part is unserviceable, the car is not serviceable
-
-        # Recursively check each child node
-        for child in node.children:
-            if not self._check_serviceability_recursive(child):
-                return False  # If any child is not serviceable, return False
-
-        # If all checks pass, the node is serviceable
-        return True
+    def _trace_unserviceable(self):
+        parts_by_serial = self.simulation.parts_by_serial
+        for slot, serial in enumerate(self.slots):
+            if not serial:
+                logger.debug(f"Missing part at {self.compiled.places[slot]}. Car is not serviceable.")
+                return
+            part = parts_by_serial[serial]
+            if not part.serviceable:
+                logger.debug(f"Part {part.blueprint.name} at {self.compiled.places[slot]} is unserviceable.")
+                return
 
     def remove_unserviceable_parts(self):
         """
-        Remove all unserviceable parts from the car and set their location to None.
+        Remove all unserviceable parts from the car. The parts keep their location, the caller moves them.
         """
-        for place, part_info in list(self.parts.items()):
-            part = part_info['part']
-            if not part.serviceable:  # Check if the part is not serviceable
-                # Remove the part from the car's parts
-                del self.parts[place]
-                # Reset the part's location to None
-                #part.location = "Just_Broken"
-                #print(f"Removed unserviceable part {part.blueprint.name} from place {place}. Location reset to None.")
+        if not self.dirty_slots:
+            return
+        parts_by_serial = self.simulation.parts_by_serial
+        for slot in self.dirty_slots:
+            serial = self.slots[slot]
+            if serial and not parts_by_serial[serial].serviceable:
+                self._uninstall(slot, parts_by_serial[serial])
+        self.dirty_slots.clear()
 
     def do_run(self, amount):
         """
@@ -474,8 +735,7 @@ class Car:
             pass
             return
 
-        for place, part_info in self.parts.items():
-            part = part_info['part']
+        for part in self.installed_parts():
             part.update_operating_hours(amount)
             # i transfered this to part.
             #part.operating_hours += amount
@@ -498,20 +758,17 @@ class Car:
         return "\n".join(result)
 
     @classmethod
-    def count_serviceable_cars(cls):
-        # Count how many cars in created_cars are serviceable
-        serviceable_cars = sum(1 for car in cls.created_cars if car.check_serviceability())
+    def count_serviceable_cars(cls, simulation=None):
+        # Count how many cars in the simulation are serviceable
+        serviceable_cars = sum(1 for car in Simulation.resolve(simulation).cars if car.check_serviceability())
         return serviceable_cars
 
     @classmethod
-    def reset_all_cars(cls):
+    def reset_all_cars(cls, simulation=None):
         """
         Deletes all car instances and resets the created_cars list.
         """
         # Reset all car instances by clearing the list
-        cls.created_cars.clear()
-
-        # Optionally, reset the serial number counter
-        cls.serial_counter = 1
+        Simulation.resolve(simulation).cars.clear()
 
         logger.info("All car instances have been deleted and the master list has been reset.")
@@ -0,0 +1,252 @@
+"""
+headless command line entry point.
+
+    python cli.py run --days 1000 --fleet-size 5 --hours-per-day 5 --budget 1000 --output run.json
+    python cli.py optimize --budget 1000 --method greedy --steps Wheel=5 --output best.json
+    python cli.py sweep --budgets 1000:2000:100 --fleet-sizes 5,10 --workers 4 --output sweep.csv
+
+the inputs can be workbooks (.xlsx) or csv files. openpyxl is only imported for workbooks, and matplotlib
+only when a plot file is asked for, so nothing interactive happens and batch jobs start quickly.
+"""
+import argparse
+import csv
+import json
+import logging
+import sys
+
+from logger import get_logger, configure_logging
+from classes import Simulation
+from reader import load_part_attributes, load_part_attributes_csv, load_blueprints, load_blueprints_csv
+from runners import do_one_run, do_one_run_hourly, get_non_zero_parts, optimise_budget
+from availability import marginal_allocation
+
+logger = get_logger()
+
+
+def _engine(name):
+    if name == 'hourly':
+        return do_one_run_hourly
+    if name == 'array':
+        from fleet_arrays import do_array_run
+        return do_array_run
+    return do_one_run
+
+
+def _numbers(text, kind=int):
+    """'1000:2000:100' as the range from 1000 up to and including 2000 in steps of 100, or '5,10' as a list"""
+    if ':' in text:
+        parts = [kind(value) for value in text.split(':')]
+        start, stop = parts[0], parts[1]
+        step = parts[2] if len(parts) > 2 else 1
+        if step <= 0:
+            raise argparse.ArgumentTypeError(f"the step of '{text}' must be positive")
+        values = []
+        while start <= stop:
+            values.append(start)
+            start += step
+        return values
+    return [kind(value) for value in text.split(',')]
+
+
+def _steps(text):
+    """'Wheel=5,Engine=1' as {part name: spares per move}"""
+    steps = {}
+    for item in text.split(','):
+        name, separator, count = item.partition('=')
+        if not separator or not name.strip():
+            raise argparse.ArgumentTypeError(f"'{item}' should be part name=spares per move")
+        steps[name.strip()] = int(count)
+        if steps[name.strip()] <= 0:
+            raise argparse.ArgumentTypeError(f"the step of '{name.strip()}' must be positive")
+    return steps
+
+
+def load_inputs(parts_path, blueprint_path, simulation=None):
+    """loads the part catalog into the simulation and returns the blueprint, from .xlsx or .csv files"""
+    simulation = Simulation() if simulation is None else simulation
+    if parts_path.lower().endswith('.csv'):
+        load_part_attributes_csv(parts_path, simulation)
+    else:
+        load_part_attributes(parts_path, simulation)
+    if blueprint_path.lower().endswith('.csv'):
+        car_blueprint = load_blueprints_csv(blueprint_path)
+    else:
+        car_blueprint = load_blueprints(blueprint_path)
+    return simulation, car_blueprint
+
+
+def _by_name(spares_allocated):
+    return {part.name: count for part, count in spares_allocated.items()}
+
+
+def write_output(path, data):
+    """writes the result as JSON to path, or to stdout without one"""
+    if path is None:
+        json.dump(data, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+        return
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(data, file, indent=2)
+    logger.info(f"Wrote results to {path}")
+
+
+def command_run(args):
+    simulation, car_blueprint = load_inputs(args.parts, args.blueprint)
+    part_quantities = car_blueprint.get_part_quantities()
+    spares_allocated, budget = marginal_allocation(args.budget, part_quantities, args.fleet_size,
+                                                   args.hours_per_day, simulation)
+    service_current, car_serviceable, car_breakage, serv_tracker, depot_tracker, warehouse_tracker, graveyard_tracker = _engine(args.engine)(
+        spares_allocated, args.days, args.fleet_size, args.hours_per_day, car_blueprint, simulation.new_run(args.seed))
+
+    if args.trajectory:
+        serv_tracker.trajectory.to_npz(args.trajectory)
+    if args.plot:
+        from plotter import plot_serv
+        plot_serv(car_serviceable, car_breakage, filename=args.plot)
+
+    write_output(args.output, {'service_current': service_current, 'budget_left': budget,
+                               'spares_allocated': _by_name(spares_allocated),
+                               'car_serviceable': list(car_serviceable), 'car_breakage': list(car_breakage)})
+    return 0
+
+
+def command_optimize(args):
+    simulation, car_blueprint = load_inputs(args.parts, args.blueprint)
+    part_quantities = car_blueprint.get_part_quantities()
+    cache = None
+    if args.cache:
+        from cache import RunCache
+        cache = RunCache(args.cache)
+
+    if args.method == 'refine':
+        non_zero_parts = get_non_zero_parts(part_quantities, args.fleet_size, simulation)
+        serviceability, spares_allocated = optimise_budget(args.budget, args.days, args.fleet_size,
+                                                           args.hours_per_day, car_blueprint, part_quantities,
+                                                           non_zero_parts, simulation, args.seed, args.refinements,
+                                                           analytic_seed=True, cache=cache)
+    elif args.method == 'greedy':
+        from optimiser import greedy_allocation
+        result = greedy_allocation(args.budget, args.days, args.fleet_size, args.hours_per_day, car_blueprint,
+                                   part_quantities, simulation, args.seed, args.replications, steps=args.steps,
+                                   max_workers=args.workers, run=_engine(args.engine), cache=cache,
+                                   patience=args.patience)
+        serviceability, spares_allocated = result.serviceability, result.spares_allocated
+    else:
+        from optimiser import surrogate_allocation
+        start, x1 = marginal_allocation(args.budget, part_quantities, args.fleet_size, args.hours_per_day,
+                                        simulation)
+        serviceability, spares_allocated = surrogate_allocation(args.budget, args.days, args.fleet_size,
+                                                                args.hours_per_day, car_blueprint, part_quantities,
+                                                                simulation, args.seed, args.evaluations,
+                                                                args.replications, start, _engine(args.engine),
+                                                                cache)
+
+    write_output(args.output, {'method': args.method, 'budget': args.budget, 'serviceability': serviceability,
+                               'spares_allocated': _by_name(spares_allocated)})
+    return 0
+
+
+def command_sweep(args):
+    from sweep import make_grid, run_sweep
+
+    simulation, car_blueprint = load_inputs(args.parts, args.blueprint)
+    cache = None
+    if args.cache:
+        from cache import RunCache
+        cache = RunCache(args.cache)
+    grid = make_grid(args.budgets, args.fleet_sizes, args.hours_per_day, args.days)
+    results = sorted(run_sweep(grid, simulation.part_catalog, car_blueprint, args.seed, args.workers,
+                               args.refinements, cache),
+                     key=lambda result: (result.fleet_size, result.hours_per_day, result.days, result.budget))
+
+    rows = [{'budget': result.budget, 'fleet_size': result.fleet_size, 'hours_per_day': result.hours_per_day,
+             'days': result.days, 'serviceability': result.highest_servicability,
+             'spares_allocated': _by_name(result.spares_allocated)} for result in results]
+    if args.output and args.output.lower().endswith('.csv'):
+        part_names = sorted({name for row in rows for name in row['spares_allocated']})
+        with open(args.output, 'w', newline='', encoding='utf-8') as file:
+            writer = csv.writer(file)
+            writer.writerow(['budget', 'fleet_size', 'hours_per_day', 'days', 'serviceability'] + part_names)
+            for row in rows:
+                writer.writerow([row['budget'], row['fleet_size'], row['hours_per_day'], row['days'],
+                                 row['serviceability']] +
+                                [row['spares_allocated'].get(name, 0) for name in part_names])
+        logger.info(f"Wrote sweep results to {args.output}")
+    else:
+        write_output(args.output, rows)
+
+    if args.plot:
+        from plotter import plot_budget_serv
+        plot_budget_serv([row['budget'] for row in rows], [row['serviceability'] for row in rows],
+                         filename=args.plot)
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="spares allocation simulations, without any interaction")
+    parser.add_argument('--log-level', default='WARNING', choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'))
+    parser.add_argument('--log-file', help="also log to this file, from --log-level up")
+    parser.add_argument('--log-max-bytes', type=int, default=10 << 20, help="rotate the log file at this size")
+    parser.add_argument('--log-backups', type=int, default=3, help="rotated log files to keep")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def inputs(subparser):
+        subparser.add_argument('--parts', default='parts_data.xlsx', help="part attributes, .xlsx or .csv")
+        subparser.add_argument('--blueprint', default='blueprint_data.xlsx', help="blueprint tree, .xlsx or .csv")
+        subparser.add_argument('--seed', type=int, default=0)
+        subparser.add_argument('--output', help="results file, JSON (or CSV for sweep). stdout without one")
+
+    def mission(subparser):
+        subparser.add_argument('--days', type=int, default=1000)
+        subparser.add_argument('--fleet-size', type=int, default=5)
+        subparser.add_argument('--hours-per-day', type=int, default=5)
+        subparser.add_argument('--engine', choices=('event', 'hourly', 'array'), default='event')
+
+    run = subparsers.add_parser('run', help="one run of the analytic allocation of a budget")
+    inputs(run)
+    mission(run)
+    run.add_argument('--budget', type=float, default=1000)
+    run.add_argument('--trajectory', help="saves the daily counts to this .npz file")
+    run.add_argument('--plot', help="saves the serviceable and broken cars plot to this image file")
+    run.set_defaults(function=command_run)
+
+    optimize = subparsers.add_parser('optimize', help="best allocation of a budget")
+    inputs(optimize)
+    mission(optimize)
+    optimize.add_argument('--budget', type=float, default=1000)
+    optimize.add_argument('--method', choices=('refine', 'greedy', 'surrogate'), default='refine',
+                          help="runners.optimise_budget, optimiser.greedy_allocation or surrogate_allocation")
+    optimize.add_argument('--refinements', type=int, default=10)
+    optimize.add_argument('--replications', type=int, default=5)
+    optimize.add_argument('--evaluations', type=int, default=30)
+    optimize.add_argument('--workers', type=int, default=1)
+    optimize.add_argument('--steps', type=_steps, help="greedy spares per move, e.g. Wheel=5,Engine=1")
+    optimize.add_argument('--patience', type=int, default=None,
+                          help="greedy stops after this many rounds in a row without a gain above the noise")
+    optimize.add_argument('--cache', help="run cache directory")
+    optimize.set_defaults(function=command_optimize)
+
+    sweep = subparsers.add_parser('sweep', help="optimise_budget over a grid of budgets and mission profiles")
+    inputs(sweep)
+    sweep.add_argument('--budgets', type=_numbers, default=[1000], help="1000:2000:100 or 1000,1500")
+    sweep.add_argument('--fleet-sizes', type=_numbers, default=[5])
+    sweep.add_argument('--hours-per-day', type=_numbers, default=[5])
+    sweep.add_argument('--days', type=_numbers, default=[1000])
+    sweep.add_argument('--refinements', type=int, default=10)
+    sweep.add_argument('--workers', type=int, default=None, help="process pool size, 1 runs in this process")
+    sweep.add_argument('--cache', help="run cache directory, shared by the workers")
+    sweep.add_argument('--plot', help="saves the budget against serviceability plot to this image file")
+    sweep.set_defaults(function=command_sweep)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    level = getattr(logging, args.log_level)
+    configure_logging(level, args.log_file, args.log_max_bytes, args.log_backups,
+                      console_level=max(level, logging.WARNING))
+    return args.function(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,346 @@
+import math
+from collections import defaultdict
+
+import numpy as np
+
+from logger import get_logger
+from classes import Simulation
+from trajectory import Trajectory
+
+logger = get_logger()
+
+# location codes for the part arrays
+WAREHOUSE = 0
+CAR = 1
+DEPOT = 2
+GRAVEYARD = 3
+TRANSIT_WAREHOUSE = 4
+TRANSIT_DEPOT_OH = 5
+TRANSIT_DEPOT_UER = 6
+TRANSIT_GRAVEYARD = 7
+N_LOCATIONS = 8
+
+
+class FleetArrays:
+    """
+    structure of arrays version of the serial inventory and the fleet. every serial is an index into the
+    part arrays, every car is a row of car_slots holding the index of the serial in each blueprint place
+    (or -1 if the place is empty). blueprint constants are looked up through the part type id.
+
+    parts only pick up their operating hours when they come off a car: each car keeps a running total of
+    its hours (car_clock) and each fitted part remembers the car_clock it was fitted at. each car also
+    keeps the hours left until one of its parts reaches a limit, so a day only touches the cars which stop.
+    """
+
+    def __init__(self, spares_allocated, fleet_size, car_blueprint, simulation=None):
+        self.simulation = Simulation.resolve(simulation)
+        self.rng = self.simulation.rng
+
+        # part types, in catalog order so the trackers come out in the same order as do_one_run. allocation
+        # keys are matched by name, as copies of the catalog (from deepcopy or pickle) are different objects
+        self.part_types = list(self.simulation.part_catalog)
+        type_ids = {part_type.name: index for index, part_type in enumerate(self.part_types)}
+        for key in spares_allocated:
+            if key.name not in type_ids:
+                type_ids[key.name] = len(self.part_types)
+                self.part_types.append(key)
+        n_types = len(self.part_types)
+        self.type_inverse_shape = [1 / part_type.shape_factor for part_type in self.part_types]
+        self.type_scale = [part_type.failure_hours for part_type in self.part_types]
+        self.type_tat = np.array([part_type.depot_tat for part_type in self.part_types], dtype=float)
+
+        # blueprint places in preorder, the order Car.fill_parts visits them
+        slot_types = [type_ids.get(name, -1) for name in car_blueprint.compile().part_types]
+        self.slot_type = np.array(slot_types, dtype=np.int64)
+
+        # one entry per serial, in serial number order
+        part_type = []
+        failure_hours = []
+        for key, value in spares_allocated.items():
+            type_id = type_ids[key.name]
+            part_type.extend([type_id] * value)
+            if key.failure_hours != float('inf'):
+                failure_hours.extend(self._sample([type_id] * value))
+            else:
+                failure_hours.extend([key.failure_hours] * value)
+        n_parts = len(part_type)
+        self.part_type = np.array(part_type, dtype=np.int64)
+        self.operating_hours = np.zeros(n_parts, dtype=float)
+        self.failure_hours = np.array(failure_hours, dtype=float)
+        self.life_limit = np.array([part_type.life_limit for part_type in self.part_types], dtype=float)[self.part_type]
+        self.depot_limit = np.array([part_type.depot_limit for part_type in self.part_types], dtype=float)[self.part_type]
+        self.depot_tat = np.zeros(n_parts, dtype=float)
+        self.location = np.full(n_parts, WAREHOUSE, dtype=np.int8)
+        self.serviceable = self.operating_hours < self.failure_hours
+        # the first of the life limit, depot limit and failure time
+        self.threshold = np.minimum(np.minimum(self.life_limit, self.depot_limit), self.failure_hours)
+        # the car (and car_slots column) each part is fitted to, -1 if it is not on a car
+        self.car = np.full(n_parts, -1, dtype=np.int64)
+        self.slot = np.full(n_parts, -1, dtype=np.int64)
+        self.installed_at = np.zeros(n_parts, dtype=float)
+
+        self.car_slots = np.full((fleet_size, len(slot_types)), -1, dtype=np.int64)
+        self.car_empty = np.full(fleet_size, len(slot_types), dtype=np.int64)
+        self.car_clock = np.zeros(fleet_size, dtype=float)
+        self.car_hours_left = np.full(fleet_size, np.inf)
+        # the serviceable flag of each car, as of its last check
+        self.car_serviceable = np.zeros(fleet_size, dtype=bool)
+
+        # (part types x locations) count table, kept up to date by move()
+        self.table = np.zeros((n_types, N_LOCATIONS), dtype=np.int64)
+        np.add.at(self.table, (self.part_type, self.location), 1)
+        # parts waiting to move out of a transit location at the end of the day
+        self.in_transit = []
+        # day -> parts finishing their depot TAT at the start of that day
+        self.depot_returns = defaultdict(list)
+
+    def _sample(self, type_ids):
+        """
+        Weibull failure times for a list of part type ids. same formula and draw order as
+        Part_physical.weibull_inverse_cdf, so the random stream lines up with do_one_run
+        """
+        random = self.rng.random
+        scale = self.type_scale
+        inverse_shape = self.type_inverse_shape
+        return [scale[t] * (-math.log(1 - random())) ** inverse_shape[t] for t in type_ids]
+
+    def move(self, parts, location):
+        """moves the parts to a new location, keeping the count table in step"""
+        np.subtract.at(self.table, (self.part_type[parts], self.location[parts]), 1)
+        np.add.at(self.table, (self.part_type[parts], location), 1)
+        self.location[parts] = location
+
+    def fill(self):
+        """
+        fills the empty places of every car from the warehouse. within a part type the places are served in
+        car order and blueprint order, each taking the lowest serial left, same as calling fill_parts on
+        each car in turn. returns the serials which were fitted.
+        """
+        cars = np.nonzero(self.car_empty > 0)[0]
+        if len(cars) == 0:
+            return cars
+        rows, empty_slot = np.nonzero(self.car_slots[cars] < 0)
+        empty_car = cars[rows]
+        empty_type = self.slot_type[empty_slot]
+        valid = empty_type >= 0
+        empty_car, empty_slot, empty_type = empty_car[valid], empty_slot[valid], empty_type[valid]
+        if not (self.table[empty_type, WAREHOUSE] > 0).any():
+            return empty_car[:0]
+        stock = np.nonzero((self.location == WAREHOUSE) & self.serviceable)[0]
+
+        n_types = len(self.part_types)
+        # group the stock and the empty places by type, keeping their order inside each type
+        stock = stock[np.argsort(self.part_type[stock], kind='stable')]
+        stock_count = np.bincount(self.part_type[stock], minlength=n_types)
+        stock_start = np.concatenate(([0], np.cumsum(stock_count)[:-1]))
+
+        order = np.argsort(empty_type, kind='stable')
+        empty_car, empty_slot, empty_type = empty_car[order], empty_slot[order], empty_type[order]
+        empty_count = np.bincount(empty_type, minlength=n_types)
+        empty_start = np.concatenate(([0], np.cumsum(empty_count)[:-1]))
+        rank = np.arange(len(empty_type)) - empty_start[empty_type]
+
+        filled = rank < stock_count[empty_type]
+        issued = stock[stock_start[empty_type[filled]] + rank[filled]]
+        fitted_to = empty_car[filled]
+        self.car_slots[fitted_to, empty_slot[filled]] = issued
+        self.car[issued] = fitted_to
+        self.slot[issued] = empty_slot[filled]
+        self.installed_at[issued] = self.car_clock[fitted_to]
+        np.subtract.at(self.car_empty, fitted_to, 1)
+        self.move(issued, CAR)
+
+        # cars which are now complete work out how long they can run for
+        done = np.unique(fitted_to)
+        done = done[self.car_empty[done] == 0]
+        if len(done):
+            installed = self.car_slots[done]
+            until = self.hours_to_transition(installed.ravel()).reshape(installed.shape)
+            self.car_hours_left[done] = until.min(axis=1)
+        return issued
+
+    def complete(self):
+        """cars with every place filled. parts in cars are always serviceable"""
+        return self.car_empty == 0
+
+    def current_hours(self, parts):
+        """operating hours of the parts, including the hours run in the car they are fitted to"""
+        hours_run = self.operating_hours[parts]
+        car = self.car[parts]
+        fitted = car >= 0
+        hours_run[fitted] += self.car_clock[car[fitted]] - self.installed_at[parts[fitted]]
+        return hours_run
+
+    def hours_to_transition(self, parts):
+        """vectorised Part_physical.hours_to_transition, inf where the part never transitions"""
+        threshold = self.threshold[parts]
+        hours_run = self.current_hours(parts)
+        hours = np.maximum(1, np.ceil(threshold - hours_run))
+        # guard against rounding in the subtraction, the hourly checks compare the sums directly
+        hours -= (hours > 1) & (hours_run + hours - 1 >= threshold)
+        hours += hours_run + hours < threshold
+        return hours
+
+    def depot_pass(self, day):
+        """returns the parts which finish their depot TAT today, in serial order"""
+        returned = self.depot_returns.pop(day, None)
+        if returned is None:
+            return
+        returned = np.sort(np.concatenate(returned))
+        self.serviceable[returned] = True
+        self.move(returned, TRANSIT_WAREHOUSE)
+        self.in_transit.append(returned)
+        # update failure time
+        self.failure_hours[returned] += self._sample(self.part_type[returned].tolist())
+        self.threshold[returned] = np.minimum(np.minimum(self.life_limit[returned], self.depot_limit[returned]),
+                                              self.failure_hours[returned])
+
+    def run_hours(self, hours, day):
+        """
+        runs every car which is able to for up to the given hours. a car stops at the end of the hour in
+        which one of its parts reaches its life, depot or failure limit, as in the hourly run.
+        """
+        running = np.nonzero(self.car_serviceable & (hours > 0))[0]
+        if len(running) == 0:
+            return
+        ran = np.minimum(self.car_hours_left[running], hours[running])
+        self.car_clock[running] += ran
+        self.car_hours_left[running] -= ran
+
+        stopped = running[self.car_hours_left[running] == 0]
+        if len(stopped) == 0:
+            return
+        # the parts which reached a limit in the car's last hour
+        installed = self.car_slots[stopped]
+        hours_run = self.current_hours(installed.ravel()).reshape(installed.shape)
+        rows, places = np.nonzero(hours_run >= self.threshold[installed])
+        moved = installed[rows, places]
+        hours_run = hours_run[rows, places]
+        self.operating_hours[moved] = hours_run
+
+        life = hours_run >= self.life_limit[moved]
+        overhaul = ~life & (hours_run >= self.depot_limit[moved])
+        failed = ~life & ~overhaul & (hours_run >= self.failure_hours[moved])
+        self.serviceable[moved] = False
+        self.move(moved[life], TRANSIT_GRAVEYARD)
+        self.move(moved[overhaul], TRANSIT_DEPOT_OH)
+        self.move(moved[failed], TRANSIT_DEPOT_UER)
+        self.in_transit.append(moved)
+
+        # the depot TAT counts down from the next day, and always takes at least one day
+        to_depot = moved[overhaul | failed]
+        self.depot_tat[to_depot] = self.type_tat[self.part_type[to_depot]]
+        return_day = day + np.maximum(1, np.ceil(self.depot_tat[to_depot])).astype(np.int64)
+        for return_on in np.unique(return_day).tolist():
+            self.depot_returns[return_on].append(to_depot[return_day == return_on])
+
+        # take the parts off the cars
+        self.car_slots[stopped[rows], places] = -1
+        self.car[moved] = -1
+        self.slot[moved] = -1
+        np.add.at(self.car_empty, stopped[rows], 1)
+        self.car_hours_left[stopped] = np.inf
+
+    def settle_transit(self):
+        """moves the parts in transit to the graveyard, depot and warehouse"""
+        if not self.in_transit:
+            return
+        parts = np.concatenate(self.in_transit)
+        self.in_transit = []
+        location = self.location[parts]
+        self.move(parts[location == TRANSIT_GRAVEYARD], GRAVEYARD)
+        self.move(parts[(location == TRANSIT_DEPOT_OH) | (location == TRANSIT_DEPOT_UER)], DEPOT)
+        self.move(parts[location == TRANSIT_WAREHOUSE], WAREHOUSE)
+
+    def sync_hours(self):
+        """brings the operating hours of the parts still fitted to cars up to date"""
+        fitted = np.nonzero(self.car >= 0)[0]
+        self.operating_hours[fitted] = self.current_hours(fitted)
+        self.installed_at[fitted] = self.car_clock[self.car[fitted]]
+
+
+def do_array_run(spares_allocated,days,fleet_size,hours_per_day,car_blueprint,simulation=None):
+    """
+    numpy version of do_one_run. the serials and cars live in FleetArrays and whole fleets are advanced
+    with masks. takes the same inputs and returns the same trackers as do_one_run, and gives the same
+    results for the same random seed. only the simulation's catalog and random number generator are used,
+    no Part_physical or Car objects are created.
+    """
+    profiler = Simulation.resolve(simulation).profiler
+    if profiler is not None:
+        profiler.mark()
+    fleet = FleetArrays(spares_allocated, fleet_size, car_blueprint, simulation)
+    metrics = fleet.simulation.metrics
+    issued = fleet.fill()
+
+    n_types = len(fleet.part_types)
+    trajectory = Trajectory.for_catalog(fleet.part_types, days)
+    daily = trajectory.data
+    if metrics is not None:
+        fitted = np.zeros((max(days, 1), n_types), dtype=np.int64)
+        fitted[0] += np.bincount(fleet.part_type[issued], minlength=n_types)
+    car_breakage = []
+    car_serviceable = []
+    if profiler is not None:
+        profiler.lap('setup', len(fleet.part_type))
+
+    for x1 in range(days):
+        # fix the parts
+        fleet.depot_pass(x1)
+        if profiler is not None:
+            profiler.lap('depot')
+
+        # run the machines. cars are only checked after each hour, so on the first day a car
+        # which has not been checked yet sits out the first hour
+        if hours_per_day > 0:
+            complete = fleet.complete()
+            hours = np.where(fleet.car_serviceable, hours_per_day, np.where(complete, hours_per_day - 1, 0))
+            fleet.car_serviceable = complete
+            fleet.run_hours(hours, x1)
+            fleet.car_serviceable = fleet.complete()
+        if profiler is not None:
+            profiler.lap('run', fleet_size)
+
+        car_breakage.append(int(np.count_nonzero(~fleet.car_serviceable)))
+
+        # from warehouse to car
+        issued = fleet.fill()
+        if metrics is not None:
+            fitted[x1] += np.bincount(fleet.part_type[issued], minlength=n_types)
+        fleet.car_serviceable = fleet.complete()
+        car_serviceable.append(int(np.count_nonzero(fleet.car_serviceable)))
+        if profiler is not None:
+            profiler.lap('fill', len(issued))
+
+        # shift from car to depot, and from depot to warehouse
+        table = fleet.table
+        daily['life_ex'][x1] = table[:, TRANSIT_GRAVEYARD]
+        daily['overhaul'][x1] = table[:, TRANSIT_DEPOT_OH]
+        daily['breakage'][x1] = table[:, TRANSIT_DEPOT_UER]
+        daily['depot_done'][x1] = table[:, TRANSIT_WAREHOUSE]
+        fleet.settle_transit()
+
+        daily['depot_at'][x1] = table[:, DEPOT]
+        daily['serv'][x1] = table[:, CAR]
+        daily['depot'][x1] = table[:, DEPOT]
+        daily['warehouse'][x1] = table[:, WAREHOUSE]
+        daily['graveyard'][x1] = table[:, GRAVEYARD]
+        if profiler is not None:
+            profiler.lap('record', n_types)
+
+    fleet.sync_hours()
+
+    if metrics is not None:
+        names = [part_type.name for part_type in fleet.part_types]
+        metrics.count_days('Life_Ex', names, daily['life_ex'])
+        metrics.count_days('Overhaul', names, daily['overhaul'])
+        metrics.count_days('Failed', names, daily['breakage'])
+        metrics.count_days('Repaired', names, daily['depot_done'])
+        metrics.count_days('Fitted', names, fitted)
+        metrics.finish_run()
+    if profiler is not None:
+        profiler.finish_run()
+
+    service_current = (sum(car_serviceable) / fleet_size / days) * 100
+
+    return (service_current, car_serviceable, car_breakage) + trajectory.run_trackers()
@@ -1,28 +1,98 @@
+import atexit
 import logging
+import logging.handlers
+import os
+import queue
 import sys
 
-def get_logger(name="spares_tree"):
-    logger = logging.getLogger(name)
+LOGGER_NAME = "spares_tree"
+FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 
-    # Prevent re-adding handlers on repeated imports
-    if not logger.handlers:
-        logger.setLevel(logging.DEBUG)
+# logger name -> the listener thread which takes that logger's records off its queue and writes them out
+_listeners = {}
+
+
+def configure_logging(level=logging.WARNING, path=None, max_bytes=10 << 20, backup_count=3,
+                      console_level=logging.WARNING, name=LOGGER_NAME):
+    """
+    sets up the package logger. the logger only puts records on a queue, and a background thread formats
+    them and does the writing, so the simulation never waits on the console or the disk.
+    records below level are dropped straight away. the rest go to stdout from console_level up, and to the
+    file at path if one is given, rotated at max_bytes (0 to never rotate) keeping backup_count old files.
+    the file is only opened when the first record is written. calling it again for the same name replaces
+    the earlier setup, loggers with other names keep theirs.
+    """
+    stop_logging(name)
 
-        # Console handler
+    formatter = logging.Formatter(FORMAT)
+    handlers = []
+    if console_level is not None:
         console_handler = logging.StreamHandler(sys.stdout)
-        console_handler.setLevel(logging.WARNING)
+        console_handler.setLevel(console_level)
+        handlers.append(console_handler)
+    if path is not None:
+        file_handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count,
+                                                            delay=True)
+        file_handler.setLevel(level)
+        handlers.append(file_handler)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    logger = logging.getLogger(name)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(logging.handlers.QueueHandler(records))
+    logger.setLevel(level)
+    logger.propagate = False
+
+    listener = _listeners[name] = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    return logger
 
-        # File handler
-        file_handler = logging.FileHandler('app.log')
-        file_handler.setLevel(logging.DEBUG)
 
-        # Formatter
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        console_handler.setFormatter(formatter)
-        file_handler.setFormatter(formatter)
+def stop_logging(name=None):
+    """writes out the records still on the queue and stops the listener thread of name, or of every logger"""
+    names = list(_listeners) if name is None else [name]
+    for name in names:
+        listener = _listeners.pop(name, None)
+        if listener is not None:
+            listener.stop()
+            for handler in listener.handlers:
+                handler.close()
 
-        # Add handlers
-        logger.addHandler(console_handler)
-        logger.addHandler(file_handler)
+
+def _restart_after_fork():
+    # a forked worker process gets the queues but not the listener threads, so it needs its own. only the
+    # parent rotates the log files, the workers append to whichever file is current
+    if not _listeners:
+        return
+    for name, listener in list(_listeners.items()):
+        handlers = []
+        for handler in listener.handlers:
+            if isinstance(handler, logging.handlers.RotatingFileHandler):
+                worker_handler = logging.FileHandler(handler.baseFilename, delay=True)
+                worker_handler.setLevel(handler.level)
+                worker_handler.setFormatter(handler.formatter)
+                handler = worker_handler
+            handlers.append(handler)
+        _listeners[name] = logging.handlers.QueueListener(listener.queue, *handlers, respect_handler_level=True)
+        _listeners[name].start()
+    # pool workers leave through os._exit, which skips atexit, so flush the queue on the way out
+    import multiprocessing.util
+    multiprocessing.util.Finalize(None, stop_logging, exitpriority=0)
+
+
+atexit.register(stop_logging)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def get_logger(name=LOGGER_NAME):
+    logger = logging.getLogger(name)
+
+    # the first module to ask sets up the quiet default, warnings and errors on the console only
+    if not logger.handlers:
+        configure_logging(name=name)
 
     return logger
@@ -1,6 +1,7 @@
 import math
 
 def gamma_approx(x):
+    """Stirling's approximation of the gamma function. about 4% low at 2, use math.gamma where it matters"""
     if x <= 0:
         raise ValueError("Gamma function is not defined for non-positive values.")
     approx = math.sqrt(2 * math.pi / x) * (x / math.e) ** x
@@ -12,5 +13,100 @@ def weibull_mean(k, lambd):
         raise ValueError("Shape parameter k must be positive.")
 
     # Calculate the mean using the formula: lambda * Gamma(1 + 1/k)
-    gamma_term = gamma_approx(1 + 1 / k)
+    gamma_term = math.gamma(1 + 1 / k)
     return lambd * gamma_term
+
+
+def normal_quantile(p):
+    """
+    inverse of the standard normal CDF, using Acklam's rational approximation (relative error below 1.2e-9)
+    """
+    if not 0 < p < 1:
+        raise ValueError("p must be between 0 and 1.")
+    a = (-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02, 1.383577518672690e+02,
+         -3.066479806614716e+01, 2.506628277459239e+00)
+    b = (-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02, 6.680131188771972e+01,
+         -1.328068155288572e+01)
+    c = (-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00, -2.549732539343734e+00,
+         4.374664141464968e+00, 2.938163982698783e+00)
+    d = (7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00, 3.754408661907416e+00)
+    p_low = 0.02425
+
+    if p < p_low or p > 1 - p_low:
+        # the tails
+        q = math.sqrt(-2 * math.log(min(p, 1 - p)))
+        x = (((((c[0] * q + c[1]) * q + c[2]) * q + c[3]) * q + c[4]) * q + c[5]) / \
+            ((((d[0] * q + d[1]) * q + d[2]) * q + d[3]) * q + 1)
+        return x if p < p_low else -x
+
+    q = p - 0.5
+    r = q * q
+    return (((((a[0] * r + a[1]) * r + a[2]) * r + a[3]) * r + a[4]) * r + a[5]) * q / \
+        (((((b[0] * r + b[1]) * r + b[2]) * r + b[3]) * r + b[4]) * r + 1)
+
+
+def student_t_cdf(t, dof):
+    """
+    the Student t CDF for a whole number of degrees of freedom, from the finite series of Abramowitz and
+    Stegun 26.7.3 and 26.7.4
+    """
+    if dof < 1 or dof != int(dof):
+        raise ValueError("Degrees of freedom must be a whole number of at least 1.")
+    dof = int(dof)
+    theta = math.atan(t / math.sqrt(dof))
+    cos2 = math.cos(theta) ** 2
+    if dof % 2:
+        # odd: (2 / pi) (theta + sin cos (1 + 2/3 cos^2 + 2.4/3.5 cos^4 + ...)), up to cos^(dof - 2)
+        term = total = 1.0
+        for j in range(3, dof - 1, 2):
+            term *= (j - 1) / j * cos2
+            total += term
+        series = 2 / math.pi * (theta + (math.sin(theta) * math.cos(theta) * total if dof > 1 else 0.0))
+    else:
+        # even: sin (1 + 1/2 cos^2 + 1.3/2.4 cos^4 + ...), up to cos^(dof - 2)
+        term = total = 1.0
+        for j in range(2, dof - 1, 2):
+            term *= (j - 1) / j * cos2
+            total += term
+        series = math.sin(theta) * total
+    return 0.5 + 0.5 * series
+
+
+def _student_t_pdf(t, dof):
+    return math.exp(math.lgamma((dof + 1) / 2) - math.lgamma(dof / 2) - (dof + 1) / 2 * math.log1p(t * t / dof)) \
+        / math.sqrt(dof * math.pi)
+
+
+def student_t_quantile(p, dof):
+    """
+    inverse of the Student t CDF with dof degrees of freedom. exact for 1 and 2 degrees of freedom. above
+    that it is a Cornish-Fisher expansion about the normal quantile, which is 4% low with 3 degrees of
+    freedom at p = 0.9995 and still 0.5% low with 5, so below 10 degrees of freedom it is refined with
+    Newton steps on student_t_cdf. from 10 up the expansion alone is within 0.03% for p up to 0.9995.
+    """
+    if dof < 1:
+        raise ValueError("Degrees of freedom must be at least 1.")
+    if not 0 < p < 1:
+        raise ValueError("p must be between 0 and 1.")
+    if dof == 1:
+        return math.tan(math.pi * (p - 0.5))
+    if dof == 2:
+        return (2 * p - 1) / math.sqrt(2 * p * (1 - p))
+    if p < 0.5:
+        return -student_t_quantile(1 - p, dof)
+
+    z = normal_quantile(p)
+    t = (z
+         + (z ** 3 + z) / (4 * dof)
+         + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * dof ** 2)
+         + (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / (384 * dof ** 3)
+         + (79 * z ** 9 + 776 * z ** 7 + 1482 * z ** 5 - 1920 * z ** 3 - 945 * z) / (92160 * dof ** 4))
+    if dof >= 10 or dof != int(dof):
+        return t
+    # the CDF is concave above the median, so after the first step the iterates climb to the root
+    for x1 in range(50):
+        step = (student_t_cdf(t, dof) - p) / _student_t_pdf(t, dof)
+        t -= step
+        if abs(step) <= 1e-12 * max(1.0, abs(t)):
+            break
+    return t
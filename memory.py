@@ -0,0 +1,226 @@
+import ast
+import gc
+import os
+import sys
+import tracemalloc
+
+from logger import get_logger
+from classes import Simulation
+from profiling import PhaseTimer
+from runners import do_one_run
+
+logger = get_logger()
+
+# where the memory allocated by each module goes. a module maps to a subsystem, or to
+# {class or function name: subsystem} with None for the rest of the module
+SUBSYSTEMS = {
+    'classes.py': {'Simulation': 'serials', 'Part_attributes': 'serials', 'Part_physical': 'serials',
+                   'Car': 'cars', 'Blueprint': 'cars', 'CompiledBlueprint': 'cars', None: 'serials'},
+    'runners.py': {'do_one_run': 'trackers', 'do_one_run_hourly': 'trackers', '_record_day': 'trackers',
+                   '_day_counts': 'trackers', None: 'engine'},
+    'fleet_arrays.py': {'FleetArrays': 'serials', 'do_array_run': 'trackers', None: 'engine'},
+    'trajectory.py': 'trackers',
+    'streaming.py': 'trackers',
+    'aggregate.py': 'trackers',
+    'reader.py': 'caches',
+    'cache.py': 'caches',
+}
+
+# upper limits checked by check_budgets
+BUDGETS = {
+    'bytes_per_serial': 400,
+    # per day and part number, for all the metrics of the trajectory and the daily car counts
+    'bytes_per_tracked_day': 96,
+}
+
+# (filename, line) -> subsystem, built from the source the first time it is needed
+_line_subsystems = {}
+
+
+def _module_ranges(path, names):
+    """(first line, last line, subsystem) of the top level classes and functions named in names"""
+    with open(path, encoding='utf-8') as file:
+        tree = ast.parse(file.read())
+    return [(node.lineno, node.end_lineno, names[node.name]) for node in tree.body
+            if isinstance(node, (ast.ClassDef, ast.FunctionDef)) and node.name in names]
+
+
+def subsystem_of(filename, lineno):
+    """the subsystem an allocation made at filename:lineno counts towards, 'other' outside the package"""
+    key = (filename, lineno)
+    if key in _line_subsystems:
+        return _line_subsystems[key]
+    base = os.path.basename(filename)
+    mapping = SUBSYSTEMS.get(base)
+    if os.path.dirname(os.path.abspath(filename)) != os.path.dirname(os.path.abspath(__file__)) or mapping is None:
+        subsystem = 'other'
+    elif isinstance(mapping, str):
+        subsystem = mapping
+    else:
+        subsystem = mapping.get(None, 'other')
+        for first, last, name in _module_ranges(filename, mapping):
+            if first <= lineno <= last:
+                subsystem = name
+                break
+    _line_subsystems[key] = subsystem
+    return subsystem
+
+
+def bytes_by_subsystem(snapshot):
+    """{subsystem: bytes} of a tracemalloc snapshot, by where each block was allocated"""
+    totals = {}
+    for statistic in snapshot.statistics('lineno'):
+        frame = statistic.traceback[0]
+        subsystem = subsystem_of(frame.filename, frame.lineno)
+        totals[subsystem] = totals.get(subsystem, 0) + statistic.size
+    return dict(sorted(totals.items(), key=lambda item: -item[1]))
+
+
+class MemoryProfiler(PhaseTimer):
+    """
+    a PhaseTimer which also follows the memory, for setting as simulation.profiler. while tracemalloc is
+    running, every phase boundary records the peak traced memory reached in the phase (above what was
+    traced when the profiler was entered or the last run finished), and the end of each
+    run takes a snapshot of what the run holds, by subsystem (serials, cars, trackers, engine, caches).
+
+        with MemoryProfiler() as memory:
+            do_one_run(..., Simulation(part_catalog=catalog, profiler=memory))
+        memory.memory_reports[-1]
+
+    tracemalloc slows the runs down a lot, so the phase times are only rough while it is on.
+    """
+
+    def __init__(self, keep_reports=True):
+        super().__init__(keep_reports)
+        self.phase_peaks = {}
+        self.memory_reports = []
+        self._started = False
+        self._baseline = 0
+
+    def __enter__(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started = True
+        self._baseline = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._started:
+            tracemalloc.stop()
+            self._started = False
+
+    def lap(self, phase, items=0):
+        super().lap(phase, items)
+        if tracemalloc.is_tracing():
+            peak = tracemalloc.get_traced_memory()[1] - self._baseline
+            if peak > self.phase_peaks.get(phase, 0):
+                self.phase_peaks[phase] = peak
+            tracemalloc.reset_peak()
+
+    def finish_run(self):
+        report = super().finish_run()
+        if tracemalloc.is_tracing():
+            # a full collection also empties the free lists, so the tuples python keeps for reuse after the
+            # daily counts do not count as held by the run
+            gc.collect()
+            current, peak = tracemalloc.get_traced_memory()
+            self.memory_reports.append({
+                'peak_bytes': max([peak - self._baseline] + list(self.phase_peaks.values())),
+                'retained_bytes': current - self._baseline,
+                'phase_peaks': dict(self.phase_peaks),
+                'retained': bytes_by_subsystem(tracemalloc.take_snapshot()),
+            })
+            self.phase_peaks = {}
+            self._baseline = current
+            tracemalloc.reset_peak()
+        return report
+
+
+def _measure(spares_allocated, days, fleet_size, hours_per_day, car_blueprint, part_catalog, seed, run):
+    """the memory report of one run under tracemalloc, with the number of serials it created"""
+    with MemoryProfiler(keep_reports=False) as memory:
+        run_simulation = Simulation(part_catalog=part_catalog, seed=seed, profiler=memory)
+        result = run(spares_allocated, days, fleet_size, hours_per_day, car_blueprint, run_simulation)
+        report = dict(memory.memory_reports[-1])
+        report['serials'] = len(run_simulation.parts_by_serial)
+        del result, run_simulation
+    return report
+
+
+def measure_run(spares_allocated, days, fleet_size, hours_per_day, car_blueprint, simulation=None, seed=0,
+                run=do_one_run):
+    """
+    one run under tracemalloc. returns the peak and retained bytes, the retained bytes by subsystem and
+    the peak per phase, plus bytes per serial (the serial inventory over the serials created) and bytes per
+    tracked day. the run's simulation is kept alive until the end of the run, so retained is what a run
+    holds at its end.
+    bytes per tracked day is how much the trackers grow per day and part number, from a second run of half
+    the days with the same seed, so the fixed overhead of a run does not count and short runs give the same
+    answer as long ones.
+    """
+    simulation = Simulation.resolve(simulation)
+    report = _measure(spares_allocated, days, fleet_size, hours_per_day, car_blueprint, simulation.part_catalog,
+                      seed, run)
+    short_days = days // 2
+    short = _measure(spares_allocated, short_days, fleet_size, hours_per_day, car_blueprint,
+                     simulation.part_catalog, seed, run)
+
+    retained = report['retained']
+    tracked = max(1, (days - short_days) * len(simulation.part_catalog))
+    report['bytes_per_serial'] = retained.get('serials', 0) / max(1, report['serials'])
+    report['bytes_per_tracked_day'] = (retained.get('trackers', 0) - short['retained'].get('trackers', 0)) / tracked
+    return report
+
+
+def pool_size(available_bytes, peak_bytes, worker_overhead=60 << 20, max_workers=None):
+    """
+    how many sweep workers fit in available_bytes, each taking the peak of a run (from measure_run) on top
+    of the worker_overhead of an interpreter with numpy loaded. at least one
+    """
+    workers = int(available_bytes // (peak_bytes + worker_overhead))
+    if max_workers is not None:
+        workers = min(workers, max_workers)
+    return max(1, workers)
+
+
+def check_budgets(report, budgets=None):
+    """the measures of a measure_run report above their budget, as a list of (measure, value, budget)"""
+    budgets = BUDGETS if budgets is None else budgets
+    return [(measure, report[measure], limit) for measure, limit in budgets.items() if report[measure] > limit]
+
+
+def main(argv=None):
+    """
+    measures a run of the workbooks in this folder and checks it against BUDGETS. exits with 1 when a
+    budget is exceeded.
+        python memory.py [days] [fleet size] [hours per day]
+    """
+    from reader import load_part_attributes, load_blueprints
+
+    argv = sys.argv[1:] if argv is None else argv
+    days, fleet_size, hours_per_day = [int(value) for value in argv] + [1000, 5, 5][len(argv):]
+    simulation = Simulation()
+    load_part_attributes(simulation=simulation)
+    car_blueprint = load_blueprints()
+    part_quantities = car_blueprint.get_part_quantities()
+    spares_allocated = {part: part_quantities[part.name] * fleet_size * 2 for part in simulation.part_catalog
+                        if part.name in part_quantities}
+
+    report = measure_run(spares_allocated, days, fleet_size, hours_per_day, car_blueprint, simulation)
+    print(f"peak {report['peak_bytes']} bytes, retained {report['retained_bytes']} bytes")
+    for subsystem, size in report['retained'].items():
+        print(f"  {subsystem:10} {size:12d}")
+    for phase, size in report['phase_peaks'].items():
+        print(f"  peak in {phase:10} {size:12d}")
+    print(f"{report['bytes_per_serial']:.1f} bytes per serial ({report['serials']} serials), "
+          f"{report['bytes_per_tracked_day']:.1f} bytes per tracked day and part number")
+
+    failures = check_budgets(report)
+    for measure, value, limit in failures:
+        print(f"OVER BUDGET {measure}: {value:.1f} > {limit}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
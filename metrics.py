@@ -0,0 +1,87 @@
+from collections import Counter, defaultdict
+
+from logger import get_logger
+
+logger = get_logger()
+
+# transitions counted by the engines
+TRANSITIONS = ('Failed', 'Overhaul', 'Life_Ex', 'Repaired', 'Fitted')
+
+
+class RunMetrics:
+    """
+    in memory event counters for simulation runs: how many parts of each type went through each transition,
+    in total and per day. set it as simulation.metrics to switch counting on. the engines only check
+    whether simulation.metrics is None, so leaving it off costs nothing.
+    the counts are emitted with emit() once a run finishes, instead of logging every event.
+    """
+
+    def __init__(self):
+        # (transition, part type) -> count
+        self.totals = Counter()
+        # day -> Counter of (transition, part type)
+        self.daily = defaultdict(Counter)
+        self.runs = 0
+
+    def count(self, transition, part_type, day=None, amount=1):
+        """counts a transition of a part type, on a day if one is given"""
+        self.totals[(transition, part_type)] += amount
+        if day is not None:
+            self.daily[day][(transition, part_type)] += amount
+
+    def count_days(self, transition, part_types, daily_counts):
+        """
+        counts a whole run of a transition at once. daily_counts has a row per day and a column per part type
+        in the order of part_types, for example a numpy array from the array engine.
+        """
+        for day, row in enumerate(daily_counts):
+            for part_type, value in zip(part_types, row):
+                if value:
+                    self.count(transition, part_type, day, int(value))
+
+    def by_transition(self):
+        """transition -> total count over all part types"""
+        result = Counter()
+        for (transition, part_type), value in self.totals.items():
+            result[transition] += value
+        return dict(result)
+
+    def by_part_type(self):
+        """part type -> {transition: count}"""
+        result = defaultdict(dict)
+        for (transition, part_type), value in self.totals.items():
+            result[part_type][transition] = value
+        return dict(result)
+
+    def per_day(self, transition, part_type=None):
+        """list of daily counts of a transition, for one part type or all of them"""
+        if not self.daily:
+            return []
+        values = [0] * (max(self.daily) + 1)
+        for day, counts in self.daily.items():
+            for (name, part), value in counts.items():
+                if name == transition and (part_type is None or part == part_type):
+                    values[day] += value
+        return values
+
+    def merge(self, other):
+        """adds the counts of another RunMetrics, for example one from a worker process"""
+        self.totals.update(other.totals)
+        for day, counts in other.daily.items():
+            self.daily[day].update(counts)
+        self.runs += other.runs
+        return self
+
+    def summary(self):
+        return {'runs': self.runs, 'by_transition': self.by_transition(), 'by_part_type': self.by_part_type()}
+
+    def emit(self):
+        """logs the counts, one line per part type"""
+        logger.info(f"Run metrics after {self.runs} runs: {self.by_transition()}")
+        for part_type, counts in sorted(self.by_part_type().items()):
+            logger.info(f"  {part_type}: {counts}")
+
+    def finish_run(self):
+        """called by the engines at the end of a run"""
+        self.runs += 1
+        self.emit()
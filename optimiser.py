@@ -0,0 +1,308 @@
+import math
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from logger import get_logger
+from classes import Simulation
+from replication import replication_seed, confidence_half_width
+from runners import do_one_run
+
+logger = get_logger()
+
+EfficientPoint = namedtuple('EfficientPoint', ['cost', 'serviceability', 'spares_allocated'])
+GreedyResult = namedtuple('GreedyResult', ['serviceability', 'spares_allocated', 'budget', 'path'])
+
+# set in each worker process by _init_worker, so the catalog and blueprint are only sent once per worker
+_worker_catalog = None
+_worker_blueprint = None
+
+
+def allocation_cost(spares_allocated, part_quantities, fleet_size):
+    """cost of the spares on top of the parts fitted to the fleet"""
+    return sum(part.cost * (count - part_quantities.get(part.name, 0) * fleet_size)
+               for part, count in spares_allocated.items())
+
+
+def replication_values(spares_allocated, days, fleet_size, hours_per_day, car_blueprint, simulation=None, seed=0,
+                       replications=5, run=do_one_run, cache=None):
+    """
+    serviceability of an allocation in each of a fixed number of replications. replication i always uses the
+    same random number stream (see replication.replication_seed), so two allocations evaluated with the same
+    seed are compared with common random numbers and most of the run to run noise cancels out.
+    with a cache.RunCache, replications which have been run before come from the cache.
+    """
+    simulation = Simulation.resolve(simulation)
+    values = []
+    for index in range(replications):
+        if cache is None:
+            values.append(run(spares_allocated, days, fleet_size, hours_per_day, car_blueprint,
+                              simulation.new_run(replication_seed(seed, index)))[0])
+        else:
+            values.append(cache.run(spares_allocated, days, fleet_size, hours_per_day, car_blueprint, simulation,
+                                    replication_seed(seed, index), run)[0])
+    return values
+
+
+def evaluate_allocation(spares_allocated, days, fleet_size, hours_per_day, car_blueprint, simulation=None, seed=0,
+                        replications=5, run=do_one_run, cache=None):
+    """mean serviceability of an allocation over a fixed number of replications, see replication_values"""
+    values = replication_values(spares_allocated, days, fleet_size, hours_per_day, car_blueprint, simulation, seed,
+                                replications, run, cache)
+    return sum(values) / len(values)
+
+
+def _init_worker(part_catalog, car_blueprint):
+    global _worker_catalog, _worker_blueprint
+    _worker_catalog = part_catalog
+    _worker_blueprint = car_blueprint
+
+
+def _evaluate_worker(counts, days, fleet_size, hours_per_day, seed, replications, run, cache):
+    # the allocation comes over by part name, so the keys are this worker's own catalog objects
+    simulation = Simulation(part_catalog=_worker_catalog)
+    spares_allocated = {part: counts[part.name] for part in _worker_catalog if part.name in counts}
+    return replication_values(spares_allocated, days, fleet_size, hours_per_day, _worker_blueprint, simulation,
+                              seed, replications, run, cache)
+
+
+def greedy_allocation(budget, days, fleet_size, hours_per_day, car_blueprint, part_quantities, simulation=None,
+                      seed=0, replications=5, start=None, steps=None, max_workers=1, run=do_one_run, cache=None,
+                      confidence=0.95, patience=None):
+    """
+    marginal analysis with the simulator: every round evaluates all the "buy one more of part X" moves in one
+    batch, with common random numbers, and takes the one with the largest gain in serviceability per unit
+    cost. this builds the cost / serviceability efficient path until the budget runs out.
+    the gain of a move is the mean of its paired differences with the current allocation over the
+    replications. a round where even the best move is not better by more than the confidence half width of
+    those differences (see replication.confidence_half_width) is a stall. the move is still taken, as a spare
+    never makes the fleet worse in expectation and a small gain is easily lost in the noise, so by default
+    the whole budget gets spent. with patience it stops after that many stalls in a row instead, leaving the
+    rest of the budget.
+
+    start is the allocation to build from, for example availability.marginal_allocation of part of the
+    budget, and defaults to the fleet fit with no spares. budget is what is left to spend on top of start.
+    steps can give {part name: spares per move} for parts which are cheap and needed in bulk.
+    with max_workers other than 1 the moves of a round are evaluated on a process pool.
+    returns a GreedyResult with the final serviceability, allocation, budget left and the efficient path
+    """
+    simulation = Simulation.resolve(simulation)
+    steps = steps or {}
+    if start is None:
+        spares_allocated = {part: part_quantities[part.name] * fleet_size for part in simulation.part_catalog
+                            if part.name in part_quantities}
+    else:
+        spares_allocated = dict(start)
+    candidates = [part for part in spares_allocated if part.cost > 0]
+
+    executor = None
+    if max_workers != 1:
+        executor = ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                       initargs=(list(simulation.part_catalog), car_blueprint))
+
+    def evaluate_batch(allocations):
+        if executor is None:
+            return [replication_values(allocation, days, fleet_size, hours_per_day, car_blueprint, simulation,
+                                       seed, replications, run, cache) for allocation in allocations]
+        futures = [executor.submit(_evaluate_worker, {part.name: count for part, count in allocation.items()},
+                                   days, fleet_size, hours_per_day, seed, replications, run, cache)
+                   for allocation in allocations]
+        return [future.result() for future in futures]
+
+    try:
+        current_values = evaluate_batch([spares_allocated])[0]
+        current = sum(current_values) / len(current_values)
+        spent = allocation_cost(spares_allocated, part_quantities, fleet_size)
+        path = [EfficientPoint(spent, current, dict(spares_allocated))]
+        stalls = 0
+
+        while True:
+            moves = [(part, steps.get(part.name, 1)) for part in candidates
+                     if part.cost * steps.get(part.name, 1) <= budget]
+            if not moves:
+                break
+            trials = []
+            for part, step in moves:
+                trial = dict(spares_allocated)
+                trial[part] += step
+                trials.append(trial)
+            gains = []
+            for values in evaluate_batch(trials):
+                differences = [value - base for value, base in zip(values, current_values)]
+                gains.append((sum(differences) / len(differences), confidence_half_width(differences, confidence),
+                              values))
+
+            best = max(range(len(moves)), key=lambda index: gains[index][0] / (moves[index][0].cost * moves[index][1]))
+            gain, half_width, values = gains[best]
+            stalls = stalls + 1 if gain <= half_width else 0
+            if patience is not None and stalls > patience:
+                logger.info(f"No move improved the serviceability by more than the noise in {patience} rounds")
+                break
+            part, step = moves[best]
+            spares_allocated = trials[best]
+            current_values = values
+            current = sum(values) / len(values)
+            budget -= part.cost * step
+            spent += part.cost * step
+            path.append(EfficientPoint(spent, current, dict(spares_allocated)))
+            logger.info(f"Added {step} {part.name}: serviceability {current}, budget left {budget}")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return GreedyResult(current, spares_allocated, budget, path)
+
+
+class SurrogateOptimiser:
+    """
+    ask / tell spares optimiser. it fits a Gaussian process to the (spares bought -> serviceability) pairs
+    told so far and asks for the allocation under the budget with the largest expected improvement, so the
+    simulator only runs for promising allocations.
+
+        optimiser = SurrogateOptimiser(part_quantities, fleet_size, budget, simulation.part_catalog)
+        for x1 in range(30):
+            allocation = optimiser.ask()
+            optimiser.tell(allocation, evaluate_allocation(allocation, ...))
+        serviceability, allocation = optimiser.best()
+
+    the first few asks are random allocations spending most of the budget. allocations can also be told
+    without being asked for, for example the analytic seed from availability.marginal_allocation.
+    """
+
+    def __init__(self, part_quantities, fleet_size, budget, part_catalog, seed=0, initial=5, candidates=2000,
+                 noise=1e-2):
+        self.fleet_size = fleet_size
+        self.budget = budget
+        # the fleet fit, which comes free, and the parts spares can be bought for
+        self.fleet_fit = {part: part_quantities[part.name] * fleet_size for part in part_catalog
+                          if part.name in part_quantities}
+        self.parts = [part for part in self.fleet_fit if part.cost > 0]
+        self.costs = np.array([part.cost for part in self.parts], dtype=float)
+        self.upper = np.maximum(1.0, np.floor(budget / self.costs))
+        self.rng = np.random.default_rng(seed)
+        self.initial = initial
+        self.candidates = candidates
+        self.noise = noise
+        self.x = []
+        self.y = []
+
+    def _vector(self, spares_allocated):
+        return np.array([spares_allocated[part] - self.fleet_fit[part] for part in self.parts], dtype=float)
+
+    def _allocation(self, vector):
+        spares_allocated = dict(self.fleet_fit)
+        for part, spares in zip(self.parts, vector):
+            spares_allocated[part] += int(spares)
+        return spares_allocated
+
+    def _random_vectors(self, count):
+        """random allocations spending between half and all of the budget"""
+        if not self.parts:
+            return np.zeros((count, 0))
+        shares = self.rng.dirichlet(np.ones(len(self.parts)), size=count)
+        spend = self.rng.uniform(0.5, 1.0, size=(count, 1)) * self.budget
+        return np.floor(shares * spend / self.costs)
+
+    def _neighbours(self, vector):
+        """the best allocation so far with one part moved up or down, and pairs of parts swapped"""
+        moves = [np.eye(len(self.parts))[index] * sign for index in range(len(self.parts)) for sign in (1, -1)]
+        neighbours = [vector + move for move in moves]
+        neighbours += [vector + first - second for first in moves[::2] for second in moves[::2]
+                       if first is not second]
+        return np.array(neighbours) if neighbours else np.zeros((0, len(self.parts)))
+
+    def _feasible(self, vectors):
+        return vectors[(vectors >= 0).all(axis=1) & (vectors @ self.costs <= self.budget)]
+
+    def _fit(self):
+        x = np.array(self.x) / self.upper
+        y = np.array(self.y)
+        mean, scale = y.mean(), y.std() or 1.0
+        y = (y - mean) / scale
+
+        # pick the length scale with the highest marginal likelihood
+        best = None
+        for length in (0.05, 0.1, 0.2, 0.4, 0.8):
+            kernel = self._kernel(x, x, length) + self.noise * np.eye(len(x))
+            try:
+                factor = np.linalg.cholesky(kernel)
+            except np.linalg.LinAlgError:
+                continue
+            alpha = np.linalg.solve(factor.T, np.linalg.solve(factor, y))
+            likelihood = -0.5 * y @ alpha - np.log(np.diag(factor)).sum()
+            if best is None or likelihood > best[0]:
+                best = (likelihood, length, factor, alpha)
+        likelihood, length, factor, alpha = best
+        return x, mean, scale, length, factor, alpha
+
+    @staticmethod
+    def _kernel(a, b, length):
+        distance = ((a[:, None, :] - b[None, :, :]) ** 2).sum(axis=2)
+        return np.exp(-0.5 * distance / length ** 2)
+
+    def _expected_improvement(self, vectors):
+        x, mean, scale, length, factor, alpha = self._fit()
+        points = vectors / self.upper
+        cross = self._kernel(points, x, length)
+        mu = cross @ alpha
+        v = np.linalg.solve(factor, cross.T)
+        sigma = np.sqrt(np.maximum(1e-12, 1 - (v ** 2).sum(axis=0)))
+        best = (max(self.y) - mean) / scale
+        z = (mu - best) / sigma
+        cdf = 0.5 * (1 + np.array([math.erf(value / math.sqrt(2)) for value in z]))
+        pdf = np.exp(-0.5 * z ** 2) / math.sqrt(2 * math.pi)
+        return (mu - best) * cdf + sigma * pdf
+
+    def ask(self):
+        """the next allocation to simulate, as {Part_attributes: parts bought} including the fleet fit"""
+        seen = {tuple(vector) for vector in self.x}
+        if len(self.x) < self.initial:
+            vectors = self._random_vectors(self.candidates)
+        else:
+            best_vector = self.x[int(np.argmax(self.y))]
+            vectors = np.vstack([self._random_vectors(self.candidates), self._neighbours(best_vector)])
+        vectors = self._feasible(vectors)
+        vectors = np.array([vector for vector in vectors if tuple(vector) not in seen])
+        if len(vectors) == 0:
+            # everything nearby has been tried, so repeat the best one
+            return self.best()[1]
+        if len(self.x) < self.initial:
+            return self._allocation(vectors[0])
+        return self._allocation(vectors[int(np.argmax(self._expected_improvement(vectors)))])
+
+    def tell(self, spares_allocated, serviceability):
+        """adds the simulated serviceability of an allocation"""
+        self.x.append(self._vector(spares_allocated))
+        self.y.append(serviceability)
+
+    def best(self):
+        """the highest serviceability told so far and its allocation"""
+        if not self.y:
+            return None, dict(self.fleet_fit)
+        index = int(np.argmax(self.y))
+        return self.y[index], self._allocation(self.x[index])
+
+
+def surrogate_allocation(budget, days, fleet_size, hours_per_day, car_blueprint, part_quantities, simulation=None,
+                         seed=0, evaluations=30, replications=3, start=None, run=do_one_run, cache=None):
+    """
+    runs a SurrogateOptimiser for the given number of simulated evaluations, each over the same replication
+    seeds. start is an optional allocation to tell it first, for example the analytic seed.
+    returns the highest serviceability and its allocation, like runners.optimise_budget
+    """
+    simulation = Simulation.resolve(simulation)
+    optimiser = SurrogateOptimiser(part_quantities, fleet_size, budget, simulation.part_catalog, seed)
+
+    def evaluate(spares_allocated):
+        value = evaluate_allocation(spares_allocated, days, fleet_size, hours_per_day, car_blueprint, simulation,
+                                    seed, replications, run, cache)
+        optimiser.tell(spares_allocated, value)
+        logger.info(f"Surrogate evaluation {len(optimiser.y)}: {value}")
+
+    if start is not None:
+        evaluate({part: start[part] for part in optimiser.fleet_fit})
+    while len(optimiser.y) < evaluations:
+        evaluate(optimiser.ask())
+
+    return optimiser.best()
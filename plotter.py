@@ -1,12 +1,29 @@
-import matplotlib.pyplot as plt
 from logger import get_logger
 
 logger = get_logger()
 
-def plot_serv(car_serviceable,car_breakage):
+
+def _pyplot():
+    # matplotlib is slow to import and not needed for headless runs, so it is only imported to plot
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def _finish(plt, filename):
+    """shows the plot, or saves it to filename without showing it"""
+    if filename is None:
+        plt.show(block=True)
+    else:
+        plt.savefig(filename)
+        plt.close()
+        logger.info(f"Saved plot to {filename}")
+
+
+def plot_serv(car_serviceable,car_breakage,filename=None):
     """
-    plots the servicable and broken cars
+    plots the servicable and broken cars, to filename if given
     """
+    plt = _pyplot()
     plt.plot(car_breakage)
     plt.plot(car_serviceable)
     # Adding labels and title
@@ -15,16 +32,18 @@ def plot_serv(car_serviceable,car_breakage):
     plt.title('Plot of a List')
 
     # Show the plot
-    plt.show(block=True)
+    _finish(plt, filename)
 
 
-def plot_partnumber_values(data_list, partnumber):
+def plot_partnumber_values(data_list, partnumber, filename=None):
     """
     Plots the values of a given partnumber from the dictionary.
 
     :param data_dict: Dictionary where keys are partnumbers and values are lists of numbers.
     :param partnumber: The partnumber whose values need to be plotted.
+    :param filename: Saves the plot to this file instead of showing it.
     """
+    plt = _pyplot()
     for data_dict in data_list:
         if partnumber in data_dict:
             plt.plot(data_dict[partnumber])
@@ -36,18 +55,20 @@ def plot_partnumber_values(data_list, partnumber):
     plt.xlabel("Index")
     plt.ylabel("Value")
     plt.grid(True)
-    plt.show(block=True)
+    _finish(plt, filename)
 
 
-def plot_partnumber_all(data_dict):
+def plot_partnumber_all(data_dict, filename=None):
     """
     Plots the values of all partnumbers from the dictionary.
 
     :param data_dict: Dictionary where keys are partnumbers and values are lists of numbers.
+    :param filename: Saves the plot to this file instead of showing it.
     """
     if not data_dict:
         logger.info("The dictionary is empty.")
         return
+    plt = _pyplot()
     for partnumber, values in data_dict.items():
         plt.plot(values, label=partnumber)  # Plot each partnumber with a label
 
@@ -56,10 +77,11 @@ def plot_partnumber_all(data_dict):
     plt.ylabel("Value")
     plt.legend()  # Add a legend to differentiate between partnumbers
     plt.grid(True)
-    plt.show(block=True)
+    _finish(plt, filename)
 
 
-def plot_budget_serv(budget_list,service_list):
+def plot_budget_serv(budget_list,service_list,filename=None):
+    plt = _pyplot()
     plt.figure(figsize=(8, 6))
     plt.plot(budget_list, service_list, marker='o', linestyle='-', color='b', label='Service vs Budget')
 
@@ -73,4 +95,4 @@ def plot_budget_serv(budget_list,service_list):
 
     # Display the plot
     plt.grid(True)
-    plt.show(block = True)
\ No newline at end of file
+    _finish(plt, filename)
@@ -0,0 +1,109 @@
+import time
+from contextlib import contextmanager
+
+from logger import get_logger
+
+logger = get_logger()
+
+
+class PhaseTimer:
+    """
+    wall time, calls and items processed per phase of a run. set it as simulation.profiler to switch it
+    on; like the metrics, the engines only check whether simulation.profiler is None, so leaving it off
+    costs nothing.
+
+    the hot loops time their phases back to back with mark() and lap(phase, items), everything else can
+    use the phase() context manager. finish_run() closes the run's report, and merge() adds the reports
+    of another PhaseTimer, for example one from a sweep worker.
+    """
+
+    def __init__(self, keep_reports=True):
+        # phase -> [seconds, calls, items], for the run in progress and for all finished runs
+        self.current = {}
+        self.totals = {}
+        self.runs = 0
+        # the report of every finished run, in order
+        self.keep_reports = keep_reports
+        self.reports = []
+        self._last = None
+
+    def mark(self):
+        """starts timing the next lap"""
+        self._last = time.perf_counter()
+
+    def lap(self, phase, items=0):
+        """adds the time since the last mark or lap to phase"""
+        now = time.perf_counter()
+        self.add(phase, now - self._last, items)
+        self._last = now
+
+    def add(self, phase, seconds, items=0, calls=1):
+        entry = self.current.get(phase)
+        if entry is None:
+            entry = self.current[phase] = [0.0, 0, 0]
+        entry[0] += seconds
+        entry[1] += calls
+        entry[2] += items
+
+    @contextmanager
+    def phase(self, phase, items=0):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - start, items)
+
+    @staticmethod
+    def _report(phases):
+        return {phase: {'seconds': seconds, 'calls': calls, 'items': items}
+                for phase, (seconds, calls, items) in sorted(phases.items(), key=lambda item: -item[1][0])}
+
+    @staticmethod
+    def _add_phases(target, phases):
+        for phase, (seconds, calls, items) in phases.items():
+            entry = target.setdefault(phase, [0.0, 0, 0])
+            entry[0] += seconds
+            entry[1] += calls
+            entry[2] += items
+
+    def finish_run(self):
+        """called by the engines at the end of a run. returns the run's report"""
+        report = self._report(self.current)
+        self._add_phases(self.totals, self.current)
+        self.current = {}
+        self.runs += 1
+        if self.keep_reports:
+            self.reports.append(report)
+        return report
+
+    def _all_phases(self):
+        # the finished runs and whatever has been timed since, for example around the runs of an optimiser
+        phases = {phase: list(entry) for phase, entry in self.totals.items()}
+        self._add_phases(phases, self.current)
+        return phases
+
+    def report(self):
+        """{'runs': runs, 'phases': {phase: {'seconds', 'calls', 'items'}}} over everything timed, slowest first"""
+        return {'runs': self.runs, 'phases': self._report(self._all_phases())}
+
+    def merge(self, other):
+        """adds everything timed by another PhaseTimer"""
+        self._add_phases(self.totals, other._all_phases())
+        self.runs += other.runs
+        if self.keep_reports:
+            self.reports.extend(other.reports)
+        return self
+
+    def summary(self):
+        """the report as a text table. phases timed around others, like optimise.run, include their time"""
+        phases = self._report(self._all_phases())
+        total = sum(entry['seconds'] for entry in phases.values()) or 1.0
+        lines = [f"{'phase':24} {'seconds':>10} {'share':>6} {'calls':>10} {'items':>12}"]
+        for phase, entry in phases.items():
+            lines.append(f"{phase:24} {entry['seconds']:10.4f} {entry['seconds'] / total:6.1%} "
+                         f"{entry['calls']:10d} {entry['items']:12d}")
+        return "\n".join(lines)
+
+    def emit(self):
+        """logs the summary of everything timed"""
+        logger.info(f"Phase times after {self.runs} runs:\n{self.summary()}")
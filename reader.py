@@ -1,20 +1,93 @@
-import openpyxl
 import csv
+import hashlib
+import os
+import pickle
+import tempfile
 from logger import get_logger
 from classes import Blueprint, Part_attributes
 
 logger = get_logger()
 
-def load_part_attributes(filename='parts_data.xlsx'):
+# parsed workbooks are kept in this folder next to the workbook
+INPUT_CACHE_DIR = '.input_cache'
+
+
+def _read_sheet_rows(filename):
     """
-    Load part attributes from an Excel file and return a dictionary of Part_attributes instances.
+    Reads the rows of the active sheet below the header, as tuples of values.
     """
-    wb = openpyxl.load_workbook(filename)
-    sheet = wb.active
+    # openpyxl takes a while to import, and is not needed at all when the rows come from the cache
+    import openpyxl
+
+    wb = openpyxl.load_workbook(filename, read_only=True)
+    try:
+        return list(wb.active.iter_rows(min_row=2, values_only=True))
+    finally:
+        wb.close()
 
+
+def _file_hash(filename):
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_sheet_rows(filename, cache=True):
+    """
+    Returns the rows of the active sheet of a workbook, from the input cache when the workbook has not
+    changed since it was last parsed.
+    The cache entry records the workbook's size, modification time and sha256. When the size and time
+    match the entry is used straight away, when only the content matches (the file was touched or copied)
+    the entry is refreshed, and otherwise the workbook is parsed again.
+    """
+    if not cache:
+        return _read_sheet_rows(filename)
+
+    path = os.path.abspath(filename)
+    cache_dir = os.path.join(os.path.dirname(path), INPUT_CACHE_DIR)
+    cache_path = os.path.join(cache_dir, hashlib.sha256(path.encode()).hexdigest()[:32] + '.pkl')
+    stat = os.stat(path)
+
+    entry = None
+    try:
+        with open(cache_path, 'rb') as file:
+            entry = pickle.load(file)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        pass
+
+    if entry is not None and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+        return entry['rows']
+
+    content_hash = _file_hash(path)
+    if entry is not None and entry['sha256'] == content_hash:
+        rows = entry['rows']
+    else:
+        rows = _read_sheet_rows(path)
+        logger.info(f"Parsed '{filename}', updating the input cache")
+
+    entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': content_hash, 'rows': rows}
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        file_descriptor, temp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(file_descriptor, 'wb') as file:
+            pickle.dump(entry, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, cache_path)
+    except OSError as error:
+        logger.warning(f"Could not write the input cache for '{filename}': {error}")
+    return rows
+
+
+def load_part_attributes(filename='parts_data.xlsx', simulation=None, cache=True):
+    """
+    Load part attributes from an Excel file and return a dictionary of Part_attributes instances.
+    The parts are added to the catalog of the given simulation, or the default one.
+    The parsed sheet is cached, see read_sheet_rows.
+    """
     parts = {}
 
-    for row in sheet.iter_rows(min_row=2, values_only=True):
+    for row in read_sheet_rows(filename, cache):
         part_type, failure_hours, life_limit, oh_limit, shape_factor, cost, depot_tat, placeholder = row
         # Apply defaults
         object_name = part_type + "_blueprint"
@@ -33,7 +106,8 @@ def load_part_attributes(filename='parts_data.xlsx'):
             cost=cost,
             depot_overhaul=oh_limit,
             depot_tat=depot_tat,
-            placeholder=placeholder
+            placeholder=placeholder,
+            simulation=simulation
         )
 
         parts[object_name] = part_object
@@ -44,9 +118,10 @@ def load_part_attributes(filename='parts_data.xlsx'):
     #print("after load:", len(Part_attributes.master_list))
     return parts
 
-def load_part_attributes_csv(filename='parts_data.csv'):
+def load_part_attributes_csv(filename='parts_data.csv', simulation=None):
     """
     Load part attributes from a CSV file and return a dictionary of Part_attributes instances.
+    The parts are added to the catalog of the given simulation, or the default one.
     """
     parts = {}
 
@@ -81,7 +156,8 @@ def load_part_attributes_csv(filename='parts_data.csv'):
                 cost=cost,
                 depot_overhaul=oh_limit,
                 depot_tat=depot_tat,
-                placeholder=placeholder
+                placeholder=placeholder,
+                simulation=simulation
             )
 
             parts[object_name] = part_object
@@ -89,40 +165,58 @@ def load_part_attributes_csv(filename='parts_data.csv'):
     logger.info(f"Loaded {len(parts)} part attributes from '{filename}'")
     return parts
 
-def load_blueprints(filename='blueprint_data.xlsx'):
+def build_blueprint_tree(rows):
     """
-    Load blueprint hierarchy from Excel and return the root Blueprint object.
+    Builds the blueprint tree from (place, part_type, parent_place) rows and returns the root Blueprint.
+    The root is the row whose parent_place is 'None' or empty. Children are added in the order of their
+    rows, breadth first from the root, so it takes one pass whatever order the rows come in.
+    Raises ValueError for duplicate places, no root or several roots, rows whose parent does not exist,
+    and rows which are not connected to the root because their parents form a cycle.
     """
-    wb = openpyxl.load_workbook(filename)
-    sheet = wb.active
-
-    rows = [(place, part_type, parent_place) for place, part_type, parent_place in sheet.iter_rows(min_row=2, values_only=True)]
-    place_to_blueprint = {}
-    root = None
-
-    # Identify root node
+    rows = [row for row in rows if any(value is not None for value in row)]
+    children = {}
+    places = set()
+    roots = []
     for place, part_type, parent_place in rows:
-        if parent_place == 'None':
-            root = Blueprint(place, part_type)
-            place_to_blueprint[place] = root
-            break
-
-    if not root:
-        logger.error("No root node found where Parent_Place is 'None'")
-        return None
+        if place in places:
+            raise ValueError(f"Place '{place}' appears more than once in the blueprint")
+        places.add(place)
+        if parent_place in ('None', None, ''):
+            roots.append((place, part_type))
+        else:
+            children.setdefault(parent_place, []).append((place, part_type))
+
+    if not roots:
+        raise ValueError("No root node found where parent_place is 'None'")
+    if len(roots) > 1:
+        raise ValueError(f"More than one root node in the blueprint: {[place for place, x1 in roots]}")
+
+    orphans = [place for parent_place, nodes in children.items() if parent_place not in places
+               for place, x1 in nodes]
+    if orphans:
+        raise ValueError(f"Blueprint places with a parent_place that does not exist: {orphans}")
+
+    root = Blueprint(*roots[0])
+    queue = [root]
+    for node in queue:
+        for place, part_type in children.get(node.place, ()):
+            queue.append(node.add_child(place, part_type))
+
+    if len(queue) < len(rows):
+        connected = {node.place for node in queue}
+        raise ValueError(f"Blueprint places in a parent cycle, not connected to the root: "
+                         f"{[place for place, x1, x2 in rows if place not in connected]}")
+
+    logger.info(f"Constructed blueprint tree with {len(queue)} nodes.")
+    return root
 
-    added_parts = {root.place}
 
-    while len(added_parts) < len(rows):
-        for place, part_type, parent_place in rows:
-            if place not in added_parts and parent_place in place_to_blueprint:
-                parent = place_to_blueprint[parent_place]
-                parent.add_child(place, part_type)
-                place_to_blueprint[place] = parent.children[-1]
-                added_parts.add(place)
-
-    logger.info(f"Constructed blueprint tree with {len(added_parts)} nodes.")
-    return root
+def load_blueprints(filename='blueprint_data.xlsx', cache=True):
+    """
+    Load blueprint hierarchy from Excel and return the root Blueprint object.
+    The parsed sheet is cached, see read_sheet_rows.
+    """
+    return build_blueprint_tree(read_sheet_rows(filename, cache))
 
 def load_blueprints_csv(filename='blueprint_data.csv'):
     """
@@ -137,32 +231,7 @@ def load_blueprints_csv(filename='blueprint_data.csv'):
             parent_place = row.get('parent_place')
             rows.append((place, part_type, parent_place))
 
-    place_to_blueprint = {}
-    root = None
-
-    # Identify root node
-    for place, part_type, parent_place in rows:
-        if parent_place == 'None' or parent_place is None:
-            root = Blueprint(place, part_type)
-            place_to_blueprint[place] = root
-            break
-
-    if not root:
-        logger.error("No root node found where parent_place is 'None'")
-        return None
-
-    added_parts = {root.place}
-
-    while len(added_parts) < len(rows):
-        for place, part_type, parent_place in rows:
-            if place not in added_parts and parent_place in place_to_blueprint:
-                parent = place_to_blueprint[parent_place]
-                parent.add_child(place, part_type)
-                place_to_blueprint[place] = parent.children[-1]
-                added_parts.add(place)
-
-    logger.info(f"Constructed blueprint tree with {len(added_parts)} nodes.")
-    return root
+    return build_blueprint_tree(rows)
 
 """
 
@@ -0,0 +1,65 @@
+import math
+import random
+from collections import namedtuple
+
+from logger import get_logger
+from classes import Simulation
+from mathstuff import student_t_quantile
+from runners import do_one_run
+
+logger = get_logger()
+
+ReplicationResult = namedtuple('ReplicationResult', ['mean', 'half_width', 'confidence', 'replications', 'values'])
+
+
+def replication_seed(seed, index):
+    """
+    the seed of one replication. replication i gets the same stream for every allocation, so comparing two
+    allocations with the same seed uses common random numbers.
+    """
+    return random.Random(f"{seed}:replication:{index}").getrandbits(64)
+
+
+def confidence_half_width(values, confidence=0.95):
+    """
+    half width of the Student t confidence interval on the mean of the values, inf with fewer than two
+    """
+    n = len(values)
+    if n < 2:
+        return float('inf')
+    mean = sum(values) / n
+    variance = sum((value - mean) ** 2 for value in values) / (n - 1)
+    return student_t_quantile(1 - (1 - confidence) / 2, n - 1) * math.sqrt(variance / n)
+
+
+def run_replications(spares_allocated,days,fleet_size,hours_per_day,car_blueprint,simulation=None,seed=0,
+                     half_width=0.5,confidence=0.95,min_replications=5,max_replications=200,run=do_one_run):
+    """
+    repeats a run with independent, reproducible random number streams until the confidence interval on
+    the mean serviceability is no wider than +/- half_width (in serviceability percentage points), or until
+    max_replications have been run.
+    run can be any function with the do_one_run signature, for example fleet_arrays.do_array_run.
+    each replication gets a fresh simulation sharing the part catalog of the given one.
+    returns a ReplicationResult with the mean serviceability, the half width reached, the confidence level,
+    the number of replications and the serviceability of each replication
+    """
+    simulation = Simulation.resolve(simulation)
+    values = []
+    current_half_width = float('inf')
+
+    for index in range(max_replications):
+        service_current = run(spares_allocated, days, fleet_size, hours_per_day, car_blueprint,
+                              simulation.new_run(replication_seed(seed, index)))[0]
+        values.append(service_current)
+
+        if len(values) >= max(min_replications, 2):
+            current_half_width = confidence_half_width(values, confidence)
+            if current_half_width <= half_width:
+                break
+
+    mean = sum(values) / len(values)
+    if current_half_width > half_width:
+        logger.warning(f"Stopped at {len(values)} replications with half width {current_half_width}, "
+                       f"target was {half_width}")
+    logger.info(f"Mean serviceability {mean} +/- {current_half_width} from {len(values)} replications")
+    return ReplicationResult(mean, current_half_width, confidence, len(values), values)
@@ -1,16 +1,51 @@
+import copy
+import heapq
 import math
+import random
 
 from logger import get_logger
-from classes import Part_physical, Part_attributes, Car
+from classes import Part_physical, Car, Simulation
+from mathstuff import weibull_mean
+from availability import marginal_allocation
+from trajectory import Trajectory, TrackerView, DaySnapshot, STOCK_METRICS, TRANSITION_METRICS
 logger = get_logger()
 
 
-def do_first_allocation(budget,part_quantities,non_zero_parts,fleet_size):
+def get_non_zero_parts(part_quantities,fleet_size,simulation=None):
+    """
+    works out the average number of each repairable part needed in the depot pipeline, and scales them by
+    the lowest one. this serves as the first estimate for allocating repairables budget.
+    returns {part name: [parts needed, cost of parts needed, increment]}
+    """
+    # can be amended if there is also scheduled heavy maintenance - just reduce the MTBF
+    parts_needed = {}
+
+    for key, value in part_quantities.items():
+        for parts in Simulation.resolve(simulation).part_catalog:
+            if key == parts.name and parts.depot_tat is not None:
+                mtbf = weibull_mean(parts.shape_factor, parts.failure_hours)
+                zero_stoppages = value * fleet_size / mtbf * parts.depot_tat
+                parts_needed[key] = [zero_stoppages, zero_stoppages * parts.cost]
+
+    # scale as per lowest common denominator
+    non_zero_parts = {key: value.copy() for key, value in parts_needed.items() if value[0] != 0}
+    lowest_part = min(non_zero_parts, key=lambda x: non_zero_parts[x][0])
+    lowest_value = non_zero_parts[lowest_part][0]
+
+    for key, value in non_zero_parts.items():
+        # Append the result of value[1] / lowest_value rounded up
+        rounded_value = math.ceil(value[0] / lowest_value)
+        value.append(rounded_value)
+
+    return non_zero_parts
+
+
+def do_first_allocation(budget,part_quantities,non_zero_parts,fleet_size,simulation=None):
     # now allocate the spares
     # first build the cars
     spares_allocated = {}
     for key, value in part_quantities.items():
-        for parts in Part_attributes.master_list:
+        for parts in Simulation.resolve(simulation).part_catalog:
             if key == parts.name:
                 spares_allocated[parts] = 0
 
@@ -27,12 +62,11 @@ def do_first_allocation(budget,part_quantities,non_zero_parts,fleet_size):
             if key.name in non_zero_parts:
                 spares_allocated[key] += non_zero_parts[key.name][-1]
                 budget -= key.cost * non_zero_parts[key.name][-1]
-                print(key.name,budget)
+                logger.info(f"{key.name} {budget}")
                 if budget < 0:
                     spares_allocated[key] -= non_zero_parts[key.name][-1]
                     budget += key.cost * non_zero_parts[key.name][-1]
-                    print("reversing")
-                    print(key.name, budget)
+                    logger.info(f"reversing {key.name} {budget}")
                     break_outer = True
                     break
         if break_outer == True:
@@ -40,60 +74,245 @@ def do_first_allocation(budget,part_quantities,non_zero_parts,fleet_size):
     return spares_allocated, budget
 
 
-def do_one_run(spares_allocated,days,fleet_size,hours_per_day,car_blueprint):
+def _day_counts(simulation, part_names):
+    """
+    the day's counts as {metric: tuple per part name}, read from the simulation's count table. moves the
+    parts out of transition as it goes
+    """
+    counts = simulation.location_counts
+    day_counts = {}
+
+    # shift from car to depot
+    day_counts['breakage'] = tuple(counts.get((name, 'Transit_Depot_UER'), 0) for name in part_names)
+    day_counts['overhaul'] = tuple(counts.get((name, 'Transit_Depot_OH'), 0) for name in part_names)
+    day_counts['life_ex'] = tuple(counts.get((name, 'Transit_Graveyard'), 0) for name in part_names)
+    Part_physical.settle_transit(('Transit_Graveyard', 'Transit_Depot_OH', 'Transit_Depot_UER'), simulation)
+
+    # from depot to warehouse
+    day_counts['depot_at'] = tuple(counts.get((name, 'Depot'), 0) for name in part_names)
+    day_counts['depot_done'] = tuple(counts.get((name, 'Transit_Warehouse'), 0) for name in part_names)
+    Part_physical.settle_transit(('Transit_Warehouse',), simulation)
+
+    day_counts['serv'] = tuple(counts.get((name, 'Car'), 0) for name in part_names)
+    day_counts['depot'] = tuple(counts.get((name, 'Depot'), 0) for name in part_names)
+    day_counts['warehouse'] = tuple(counts.get((name, 'Warehouse'), 0) for name in part_names)
+    day_counts['graveyard'] = tuple(counts.get((name, 'Graveyard'), 0) for name in part_names)
+    return day_counts
+
+
+def _record_day(trajectory, day, simulation):
+    """
+    records the day's counts in the trajectory and moves the parts out of transition. returns the number of
+    parts which finished repair today
+    """
+    day_counts = _day_counts(simulation, trajectory.part_names)
+    for metric, values in day_counts.items():
+        trajectory.data[metric][day] = values
+    return sum(day_counts['depot_done'])
+
+
+def _setup_run(spares_allocated, fleet_size, car_blueprint, simulation):
+    simulation.day = 0
     for key, value in spares_allocated.items():
         for x1 in range(value):
-            Part_physical(key)
+            Part_physical(key, simulation=simulation)
 
-    Part_physical.assign_parts_to_location(None, "Warehouse")
+    Part_physical.assign_parts_to_location(None, "Warehouse", simulation)
 
     for x1 in range(fleet_size):
-        car = Car(car_blueprint)
+        car = Car(car_blueprint, simulation)
         car.fill_parts()
 
-    serv_tracker = {}
-    depot_tracker = {}
-    warehouse_tracker = {}
-    graveyard_tracker = {}
-    breakage_tracker = {}
-    overhaul_tracker = {}
-    life_ex_tracker = {}
-    depot_done = {}
-    depot_at = {}
-    perf_tracker = {}
-    for part_number in Part_attributes.master_list:
-        serv_tracker[part_number.name] = []
-        depot_tracker[part_number.name] = []
-        warehouse_tracker[part_number.name] = []
-        graveyard_tracker[part_number.name] = []
-        breakage_tracker[part_number.name] = []
-        overhaul_tracker[part_number.name] = []
-        life_ex_tracker[part_number.name] = []
-        depot_done[part_number.name] = []
-        depot_at[part_number.name] = []
-        perf_tracker[part_number.name] = []
-
-    wheels_list = []
+
+def _finish_run(simulation):
+    """emits the run metrics and closes the phase report, if the simulation keeps them"""
+    if simulation.metrics is not None:
+        simulation.metrics.finish_run()
+    if simulation.profiler is not None:
+        simulation.profiler.finish_run()
+
+
+def iter_days(spares_allocated,days,fleet_size,hours_per_day,car_blueprint,simulation=None):
+    """
+    the event driven run as a generator of DaySnapshots, one per day. instead of stepping every car through
+    every hour, it keeps a heap of the next thing that happens (a car reaching the failure, life or depot
+    limit of one of its parts, or a part finishing its depot TAT) and jumps from one event to the next.
+    days where nothing happens just carry the previous day's counts forward.
+
+    nothing is kept from one day to the next apart from the simulation itself, so with days=None it runs
+    until the caller stops asking, in constant memory. closing the generator stops the run where it is,
+    the cars still running are only brought up to the end of the horizon when it is reached.
+    see streaming.py for consumers of the snapshots, and do_one_run for the whole run as trackers.
+    """
+    simulation = Simulation.resolve(simulation)
+    profiler = simulation.profiler
+    try:
+        if profiler is not None:
+            profiler.mark()
+        cars = simulation.cars
+        _setup_run(spares_allocated, fleet_size, car_blueprint, simulation)
+        part_names = tuple(part_number.name for part_number in simulation.part_catalog)
+        no_transitions = {metric: (0,) * len(part_names) for metric in TRANSITION_METRICS}
+
+        # heap entries are (day, kind, order, object). kind 0 is a depot return, ordered by serial number so
+        # the failure times are resampled in the same order as the hourly run. kind 1 is a car stopping.
+        events = []
+        # car index -> operating clock (day * hours_per_day + hour) the car started running at
+        run_start = {}
+        broken = set()
+
+        def start_car(index, car, clock):
+            run_start[index] = clock
+            hours = [part.hours_to_transition() for part in car.installed_parts()]
+            hours = [value for value in hours if value is not None]
+            if hours and hours_per_day > 0:
+                stop_clock = clock + min(hours)
+                heapq.heappush(events, ((stop_clock - 1) // hours_per_day, 1, index, (car, stop_clock)))
+
+        # the cars only get checked after the first hour of the first day, so they cannot run in that hour
+        for index, car in enumerate(cars):
+            if hours_per_day > 0 and car.check_serviceability():
+                start_car(index, car, 1)
+            else:
+                broken.add(index)
+        if profiler is not None:
+            profiler.lap('setup', len(simulation.parts_by_serial))
+
+        fill_pending = True
+        snapshot = None
+        day = 0
+        while days is None or day < days:
+            if profiler is not None:
+                profiler.mark()
+            if not fill_pending and (not events or events[0][0] > day):
+                # nothing happens until the next event, so the counts carry over
+                quiet = {metric: snapshot.counts[metric] for metric in STOCK_METRICS}
+                quiet.update(no_transitions)
+                snapshot = snapshot._replace(breakage=len(broken), counts=quiet)
+                next_day = events[0][0] if events else days
+                if days is not None:
+                    next_day = min(next_day, days)
+                if profiler is not None:
+                    profiler.lap('quiet', 0 if next_day is None else next_day - day)
+                while next_day is None or day < next_day:
+                    snapshot = snapshot._replace(day=day)
+                    yield snapshot
+                    day += 1
+                continue
+
+            simulation.day = day
+            # fix the parts
+            repaired = 0
+            while events and events[0][0] == day and events[0][1] == 0:
+                part = heapq.heappop(events)[3]
+                part.update_depot_days(max(1, math.ceil(part.depot_tat)))
+                repaired += 1
+            if profiler is not None:
+                profiler.lap('depot', repaired)
+
+            # run the machines
+            stopped = 0
+            while events and events[0][0] == day:
+                x1, x2, index, (car, stop_clock) = heapq.heappop(events)
+                car.do_run(stop_clock - run_start.pop(index))
+                car.check_serviceability()
+                for part in car.installed_parts():
+                    if part.location in ('Transit_Depot_OH', 'Transit_Depot_UER'):
+                        heapq.heappush(events, (day + max(1, math.ceil(part.depot_tat)), 0, part.serial_number, part))
+                car.remove_unserviceable_parts()
+                broken.add(index)
+                stopped += 1
+            if profiler is not None:
+                profiler.lap('run', stopped)
+
+            breakage = len(broken)
+
+            # from warehouse to car
+            for index in sorted(broken):
+                car = cars[index]
+                car.fill_parts()
+                if car.check_serviceability():
+                    broken.discard(index)
+                    start_car(index, car, (day + 1) * hours_per_day)
+            if profiler is not None:
+                profiler.lap('fill', breakage)
+
+            day_counts = _day_counts(simulation, part_names)
+            fill_pending = sum(day_counts['depot_done']) > 0 and len(broken) > 0
+            if profiler is not None:
+                profiler.lap('record', len(part_names))
+            snapshot = DaySnapshot(day, len(cars) - len(broken), breakage, part_names, day_counts)
+            yield snapshot
+            day += 1
+
+        # the horizon has been reached, bring the cars which are still running up to the end of it
+        for index, clock in run_start.items():
+            if days * hours_per_day > clock:
+                cars[index].do_run(days * hours_per_day - clock)
+    finally:
+        # also when the caller stops early, so the metrics and phases do not leak into the next run
+        _finish_run(simulation)
+
+
+def do_one_run(spares_allocated,days,fleet_size,hours_per_day,car_blueprint,simulation=None):
+    """
+    event driven version of the run, see iter_days. gives the same results as do_one_run_hourly for the
+    same random seed. the parts and cars are created in the given simulation, which should not have any
+    left over from an earlier run.
+    """
+    simulation = Simulation.resolve(simulation)
+    trajectory = Trajectory.for_catalog(simulation.part_catalog, days)
+
+    car_breakage = []
+    car_serviceable = []
+    for snapshot in iter_days(spares_allocated, days, fleet_size, hours_per_day, car_blueprint, simulation):
+        car_breakage.append(snapshot.breakage)
+        car_serviceable.append(snapshot.serviceable)
+        trajectory.record_snapshot(snapshot)
+
+    service_current = (sum(car_serviceable) / fleet_size / days) * 100
+
+    return (service_current, car_serviceable, car_breakage) + trajectory.run_trackers()
+
+
+def do_one_run_hourly(spares_allocated,days,fleet_size,hours_per_day,car_blueprint,simulation=None):
+    """
+    the original hour by hour run. much slower than do_one_run, kept as the reference implementation.
+    """
+    simulation = Simulation.resolve(simulation)
+    profiler = simulation.profiler
+    if profiler is not None:
+        profiler.mark()
+    _setup_run(spares_allocated, fleet_size, car_blueprint, simulation)
+    trajectory = Trajectory.for_catalog(simulation.part_catalog, days)
+    if profiler is not None:
+        profiler.lap('setup', len(simulation.parts_by_serial))
+
     car_breakage = []
     car_serviceable = []
 
 
     for x1 in range(days):
+        simulation.day = x1
         day_breakage = 0
 
         # fix the parts
-        for part_number in Part_physical.master_list:
+        for part_number in simulation.parts:
             if part_number.location == 'Depot':
                 part_number.update_depot_days(1)
+        if profiler is not None:
+            profiler.lap('depot', len(simulation.parts_by_serial))
 
         # run the machines
         for x2 in range(hours_per_day):
-            for car_object in Car.created_cars:
+            for car_object in simulation.cars:
                 car_object.do_run(1)
                 car_object.check_serviceability()
                 car_object.remove_unserviceable_parts()
+        if profiler is not None:
+            profiler.lap('run', hours_per_day * len(simulation.cars))
 
-        for car_object in Car.created_cars:
+        for car_object in simulation.cars:
             if car_object.serviceable == False:
                 day_breakage += 1
             # print("something broke",day_breakage)
@@ -101,56 +320,53 @@ def do_one_run(spares_allocated,days,fleet_size,hours_per_day,car_blueprint):
             # from warehouse to car
             car_object.fill_parts()
             car_object.check_serviceability()
+        if profiler is not None:
+            profiler.lap('fill', len(simulation.cars))
 
-        car_serviceable.append(Car.count_serviceable_cars())
+        car_serviceable.append(Car.count_serviceable_cars(simulation))
         # you cannot move parts out of transition
-
-        # shift from car to depot
-        temp_dict = Part_physical.group_parts_by_blueprint()
-        for part_number in Part_attributes.master_list:
-            breakage_tracker[part_number.name].append(temp_dict[part_number.name]["Failed"])
-            overhaul_tracker[part_number.name].append(temp_dict[part_number.name]["Overhaul"])
-            life_ex_tracker[part_number.name].append(temp_dict[part_number.name]["Life_Ex"])
-            # wheels_list.append(Part.group_parts_by_blueprint()["Wheel"]["serviceable_count"])
         car_breakage.append(day_breakage)
 
-        # from depot to warehouse
-        temp_dict2 = Part_physical.parts_grouped_depot_warehouse()
-        for part_number in Part_attributes.master_list:
-            depot_at[part_number.name].append(temp_dict2[part_number.name]["Under_Repair"])
-            depot_done[part_number.name].append(temp_dict2[part_number.name]["Finished_Repair"])
-
-        temp_dict3 = Part_physical.parts_grouped_summary()
-        for part_number in Part_attributes.master_list:
-            serv_tracker[part_number.name].append(temp_dict3[part_number.name]["In_Use"])
-            depot_tracker[part_number.name].append(temp_dict3[part_number.name]["Depot"])
-            warehouse_tracker[part_number.name].append(temp_dict3[part_number.name]["Warehouse"])
-            graveyard_tracker[part_number.name].append(temp_dict3[part_number.name]["Graveyard"])
-
-
+        _record_day(trajectory, x1, simulation)
+        if profiler is not None:
+            profiler.lap('record', len(trajectory.part_names))
 
+    _finish_run(simulation)
     service_current = (sum(car_serviceable) / fleet_size / days) * 100
 
-    return service_current, car_serviceable,car_breakage, serv_tracker, depot_tracker, warehouse_tracker,graveyard_tracker
+    return (service_current, car_serviceable, car_breakage) + trajectory.run_trackers()
 
 
-def get_new_service(days,fleet_size,part_quantities,spares_allocated,serv_tracker,warehouse_tracker,budget):
+def get_new_service(days,fleet_size,part_quantities,spares_allocated,serv_tracker,warehouse_tracker,budget,
+                    simulation=None,min_stock=None):
+    """
+    moves spares from the part number with the most stock to spare to the one with the least. min_stock can
+    give the lowest stock of each part number straight away, for example the result of a
+    streaming.MinStockTracker, in which case the trackers are not used.
+    """
 
     perf_tracker = {}
-    for part_number in Part_attributes.master_list:
+    for part_number in Simulation.resolve(simulation).part_catalog:
         if part_number.depot_tat != 0 and part_number.depot_tat != None:
             perf_tracker[part_number.name] = []
 
-    for key, value in perf_tracker.items():
-        min_value = part_quantities[key] * fleet_size
-        temp_min = float('inf')
+    if min_stock is not None:
+        perf_tracker = {key: min_stock[key] for key in perf_tracker}
+    elif (isinstance(serv_tracker, TrackerView) and serv_tracker.metric == 'serv'
+            and isinstance(warehouse_tracker, TrackerView) and warehouse_tracker.metric == 'warehouse'
+            and serv_tracker.trajectory is warehouse_tracker.trajectory and serv_tracker.trajectory.days == days):
+        perf_tracker = serv_tracker.trajectory.min_stock(part_quantities, fleet_size, perf_tracker)
+    else:
+        for key, value in perf_tracker.items():
+            min_value = part_quantities[key] * fleet_size
+            temp_min = float('inf')
 
-        for x1 in range(days):
+            for x1 in range(days):
 
-            if (serv_tracker[key][x1] + warehouse_tracker[key][x1]) - min_value < temp_min:
-                temp_min = (serv_tracker[key][x1] + warehouse_tracker[key][x1]) - min_value
+                if (serv_tracker[key][x1] + warehouse_tracker[key][x1]) - min_value < temp_min:
+                    temp_min = (serv_tracker[key][x1] + warehouse_tracker[key][x1]) - min_value
 
-        perf_tracker[key] = temp_min / part_quantities[key]
+            perf_tracker[key] = temp_min / part_quantities[key]
 
     max_key, max_value = max(perf_tracker.items(), key=lambda item: item[1])
     min_key, min_value = min(perf_tracker.items(), key=lambda item: item[1])
@@ -179,7 +395,7 @@ def get_new_service(days,fleet_size,part_quantities,spares_allocated,serv_tracke
     if can_change == True:
         for key, value in spares_allocated.items():
             if key.name == min_key:
-                spares_to_incr = max(0, cost_to_change // key.cost)
+                spares_to_incr = max(0, int(cost_to_change // key.cost))
                 spares_allocated[key] += spares_to_incr
                 budget -= key.cost * spares_to_incr
                 logger.info(f"de {key.name}, {spares_to_de}, {budget}")
@@ -199,7 +415,7 @@ def get_new_service(days,fleet_size,part_quantities,spares_allocated,serv_tracke
 
         for key, value in sorted_spares:
             if budget >= key.cost:  # Check if the budget is sufficient for the part
-                max_spares_to_add = budget // key.cost  # Max we can add based on the remaining budget
+                max_spares_to_add = int(budget // key.cost)  # Max we can add based on the remaining budget
                 spares_allocated[key] += max_spares_to_add
                 budget -= key.cost * max_spares_to_add
                 logger.info(f"Allocated {max_spares_to_add} of {key.name}. Remaining budget: {budget}")
@@ -210,3 +426,69 @@ def get_new_service(days,fleet_size,part_quantities,spares_allocated,serv_tracke
 
 
     return spares_allocated, budget
+
+
+def optimise_budget(budget,days,fleet_size,hours_per_day,car_blueprint,part_quantities,non_zero_parts,
+                    simulation=None,seed=None,refinements=10,analytic_seed=False,cache=None):
+    """
+    spends the budget with do_first_allocation, then keeps moving spares with get_new_service for as long
+    as the serviceability improves, up to the given number of refinements.
+    with analytic_seed the budget is first spent with availability.marginal_allocation instead, which
+    usually starts much closer to the best allocation.
+    every run gets a fresh simulation sharing the part catalog of the given one, and all the runs use the
+    same random number stream, derived from seed. so allocations are compared with common random numbers,
+    the same seed always gives the same answer, and with a cache.RunCache an allocation which has been run
+    before (by this optimisation, or another one with the same seed) is not run again.
+    when the simulation has a profiler, the runs and get_new_service are timed as optimise.run and
+    optimise.get_new_service, on top of the phases of the runs themselves.
+    returns the highest serviceability and the spares allocated
+    """
+    simulation = Simulation.resolve(simulation)
+    run_seed = random.Random(seed).getrandbits(64)
+    profiler = simulation.profiler
+
+    def run(spares_allocated):
+        if profiler is not None:
+            with profiler.phase('optimise.run'):
+                return simulate(spares_allocated)
+        return simulate(spares_allocated)
+
+    def simulate(spares_allocated):
+        if cache is None:
+            return do_one_run(spares_allocated, days, fleet_size, hours_per_day, car_blueprint,
+                              simulation.new_run(run_seed))
+        return cache.run(spares_allocated, days, fleet_size, hours_per_day, car_blueprint, simulation, run_seed)
+
+    if analytic_seed:
+        temp_spares_allocated, budget = marginal_allocation(budget, part_quantities, fleet_size, hours_per_day,
+                                                            simulation)
+    else:
+        temp_spares_allocated, budget = do_first_allocation(budget, part_quantities, non_zero_parts, fleet_size,
+                                                            simulation)
+    spares_allocated = copy.deepcopy(temp_spares_allocated)
+
+    highest_servicability = 0
+
+    service_current, car_serviceable, car_breakage, serv_tracker, depot_tracker, warehouse_tracker, graveyard_tracker = run(
+        spares_allocated)
+
+    logger.info(service_current)
+
+    for x2 in range(refinements):
+
+        if service_current > highest_servicability:
+            highest_servicability = service_current
+            spares_allocated = copy.deepcopy(temp_spares_allocated)
+            if profiler is not None:
+                profiler.mark()
+            temp_spares_allocated, budget = get_new_service(days, fleet_size, part_quantities, spares_allocated,
+                                                            serv_tracker, warehouse_tracker, budget, simulation)
+            if profiler is not None:
+                profiler.lap('optimise.get_new_service', len(spares_allocated))
+            service_current, car_serviceable, car_breakage, serv_tracker, depot_tracker, warehouse_tracker, graveyard_tracker = run(
+                spares_allocated)
+        else:
+            logger.info("no more improvements")
+            break
+
+    return highest_servicability, spares_allocated
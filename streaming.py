@@ -0,0 +1,146 @@
+import csv
+
+from logger import get_logger
+from classes import Simulation
+from runners import iter_days
+from trajectory import METRICS
+
+logger = get_logger()
+
+
+class RunningMean:
+    """
+    running means of the daily snapshots: serviceable and broken cars, and every metric for every part
+    number. with a fleet size the result also has service_current, as returned by do_one_run.
+    """
+
+    def __init__(self, fleet_size=None):
+        self.fleet_size = fleet_size
+        self.days = 0
+        self.serviceable = 0.0
+        self.breakage = 0.0
+        self.part_names = None
+        self.counts = None
+
+    def update(self, snapshot):
+        if self.counts is None:
+            self.part_names = snapshot.part_names
+            self.counts = {metric: [0.0] * len(snapshot.part_names) for metric in METRICS}
+        self.days += 1
+        self.serviceable += (snapshot.serviceable - self.serviceable) / self.days
+        self.breakage += (snapshot.breakage - self.breakage) / self.days
+        for metric, values in snapshot.counts.items():
+            means = self.counts[metric]
+            for index, value in enumerate(values):
+                means[index] += (value - means[index]) / self.days
+
+    def result(self):
+        """{'days', 'serviceable', 'breakage', 'counts': {metric: {part name: mean}}} and maybe 'service_current'"""
+        result = {'days': self.days, 'serviceable': self.serviceable, 'breakage': self.breakage,
+                  'counts': {metric: dict(zip(self.part_names or (), means))
+                             for metric, means in (self.counts or {}).items()}}
+        if self.fleet_size:
+            result['service_current'] = self.serviceable / self.fleet_size * 100
+        return result
+
+
+class MinStockTracker:
+    """
+    the lowest number of parts in cars and in the warehouse, less the number the fleet needs, divided by the
+    number needed per car. the same as Trajectory.min_stock, without keeping the days, and can be passed to
+    runners.get_new_service as min_stock.
+    with stop_below, the run is stopped as soon as any part number falls below it, for example -1 to stop
+    at the first car held up for want of a part.
+    """
+
+    def __init__(self, part_quantities, fleet_size, stop_below=None):
+        self.part_quantities = part_quantities
+        self.fleet_size = fleet_size
+        self.stop_below = stop_below
+        self.columns = None
+        self.lowest = {}
+
+    def update(self, snapshot):
+        if self.columns is None:
+            self.columns = [(index, name) for index, name in enumerate(snapshot.part_names)
+                            if name in self.part_quantities]
+            self.lowest = {name: float('inf') for index, name in self.columns}
+        serv = snapshot.counts['serv']
+        warehouse = snapshot.counts['warehouse']
+        stop = False
+        for index, name in self.columns:
+            per_car = self.part_quantities[name]
+            value = (serv[index] + warehouse[index] - per_car * self.fleet_size) / per_car
+            if value < self.lowest[name]:
+                self.lowest[name] = value
+                if self.stop_below is not None and value < self.stop_below:
+                    stop = True
+        return stop
+
+    def result(self):
+        return dict(self.lowest)
+
+
+class FileSink:
+    """
+    writes every snapshot as a row of a csv file: day, serviceable, breakage, then a metric:part column for
+    every metric and part number
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        self.header = False
+
+    def update(self, snapshot):
+        if not self.header:
+            self.writer.writerow(['day', 'serviceable', 'breakage'] +
+                                 [f"{metric}:{name}" for metric in snapshot.counts for name in snapshot.part_names])
+            self.header = True
+        row = [snapshot.day, snapshot.serviceable, snapshot.breakage]
+        for values in snapshot.counts.values():
+            row.extend(values)
+        self.writer.writerow(row)
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+    def result(self):
+        self.close()
+        logger.info(f"Wrote daily snapshots to {self.path}")
+        return self.path
+
+
+def consume(snapshots, consumers):
+    """
+    feeds every snapshot to every consumer. a consumer's update returns something true to stop the run,
+    which closes the generator. returns the result() of each consumer, in order
+    """
+    try:
+        for snapshot in snapshots:
+            stop = False
+            for consumer in consumers:
+                if consumer.update(snapshot):
+                    stop = True
+            if stop:
+                logger.info(f"Run stopped by a consumer on day {snapshot.day}")
+                break
+    finally:
+        if hasattr(snapshots, 'close'):
+            snapshots.close()
+    return [consumer.result() for consumer in consumers]
+
+
+def stream_run(spares_allocated, days, fleet_size, hours_per_day, car_blueprint, consumers, simulation=None):
+    """
+    one event driven run (runners.iter_days) fed straight to the consumers, without keeping the days.
+    days=None runs until a consumer stops it.
+
+        mean, stock = stream_run(spares_allocated, 100000, fleet_size, hours_per_day, car_blueprint,
+                                 [RunningMean(fleet_size), MinStockTracker(part_quantities, fleet_size)])
+    """
+    simulation = Simulation.resolve(simulation)
+    return consume(iter_days(spares_allocated, days, fleet_size, hours_per_day, car_blueprint, simulation),
+                   consumers)
@@ -0,0 +1,99 @@
+import itertools
+import random
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from logger import get_logger
+from classes import Simulation
+from runners import get_non_zero_parts, optimise_budget
+from profiling import PhaseTimer
+
+logger = get_logger()
+
+SweepPoint = namedtuple('SweepPoint', ['budget', 'fleet_size', 'hours_per_day', 'days'])
+SweepResult = namedtuple('SweepResult', ['budget', 'fleet_size', 'hours_per_day', 'days', 'highest_servicability',
+                                         'spares_allocated'])
+
+# set in each worker process by _init_worker, so the catalog and blueprint are only sent once per worker
+_worker_catalog = None
+_worker_blueprint = None
+
+
+def make_grid(budgets, fleet_sizes, hours_per_day, days):
+    """
+    every combination of the given budgets, fleet sizes, hours per day and day horizons.
+    single values are allowed in place of lists.
+    """
+    def as_list(value):
+        return list(value) if isinstance(value, (list, tuple, range)) else [value]
+
+    return [SweepPoint(*point) for point in itertools.product(as_list(budgets), as_list(fleet_sizes),
+                                                               as_list(hours_per_day), as_list(days))]
+
+
+def point_seed(seed, point):
+    """
+    the seed for one grid point. it only depends on the sweep seed and the mission profile of the point, so a
+    point gives the same answer whatever else is in the grid and whichever worker runs it. the budget is left
+    out, so points with different budgets run the same allocation with the same seed and share cache entries.
+    """
+    return random.Random(f"{seed}:{point.fleet_size}:{point.hours_per_day}:{point.days}").getrandbits(64)
+
+
+def run_point(point, part_catalog, car_blueprint, seed, refinements=10, cache=None, profiler=None):
+    """
+    first allocation and refinement for one grid point, see runners.optimise_budget. profiler is an
+    optional profiling.PhaseTimer to time the runs with.
+    """
+    simulation = Simulation(part_catalog=part_catalog, profiler=profiler)
+    part_quantities = car_blueprint.get_part_quantities()
+    non_zero_parts = get_non_zero_parts(part_quantities, point.fleet_size, simulation)
+    highest_servicability, spares_allocated = optimise_budget(point.budget, point.days, point.fleet_size,
+                                                              point.hours_per_day, car_blueprint, part_quantities,
+                                                              non_zero_parts, simulation, seed, refinements,
+                                                              cache=cache)
+    return SweepResult(*point, highest_servicability, spares_allocated)
+
+
+def _init_worker(part_catalog, car_blueprint):
+    global _worker_catalog, _worker_blueprint
+    _worker_catalog = part_catalog
+    _worker_blueprint = car_blueprint
+
+
+def _run_worker_point(point, seed, refinements, cache, profile):
+    # the worker's phase times come back with the result, to be merged into the caller's profiler
+    profiler = PhaseTimer(keep_reports=False) if profile else None
+    return run_point(point, _worker_catalog, _worker_blueprint, seed, refinements, cache, profiler), profiler
+
+
+def run_sweep(grid, part_catalog, car_blueprint, seed=0, max_workers=None, refinements=10, cache=None,
+              profiler=None):
+    """
+    runs the allocation and refinement for every point of the grid (see make_grid) on a process pool,
+    and yields a SweepResult for each point as it completes. results come back in completion order, not
+    grid order.
+    part_catalog is the list of Part_attributes, for example simulation.part_catalog after loading.
+    with max_workers=1 everything runs in this process, which is handy for debugging.
+    cache is an optional cache.RunCache shared by all the workers.
+    profiler is an optional profiling.PhaseTimer, which gets the phase times of every point.
+    scripts using the pool need an if __name__ == '__main__' guard on platforms which spawn workers.
+    """
+    part_catalog = list(part_catalog)
+    if max_workers == 1:
+        for point in grid:
+            yield run_point(point, part_catalog, car_blueprint, point_seed(seed, point), refinements, cache,
+                            profiler)
+        return
+
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                             initargs=(part_catalog, car_blueprint)) as executor:
+        futures = {executor.submit(_run_worker_point, point, point_seed(seed, point), refinements, cache,
+                                   profiler is not None): point
+                   for point in grid}
+        for future in as_completed(futures):
+            result, worker_profiler = future.result()
+            if profiler is not None:
+                profiler.merge(worker_profiler)
+            logger.info(f"Finished {futures[future]}: {result.highest_servicability}")
+            yield result
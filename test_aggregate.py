@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from aggregate import OnlineStats, QuantileSketch
+
+QUANTILES = (0.0, 0.05, 0.25, 0.5, 0.75, 0.95, 1.0)
+
+
+def _sketch(rows, parts=1, compression=50):
+    sketches = [QuantileSketch(rows.shape[1:], compression) for x1 in range(parts)]
+    for index, row in enumerate(rows):
+        sketches[index % parts].add(row)
+    for other in sketches[1:]:
+        sketches[0].merge(other)
+    return sketches[0]
+
+
+@pytest.mark.parametrize('parts', [1, 4])
+def test_counts_give_the_exact_quantiles(parts):
+    rows = np.random.default_rng(0).poisson(3, (200, 30, 2)).astype(float)
+    sketch = _sketch(rows, parts)
+    assert sketch.exact
+    for q in QUANTILES:
+        np.testing.assert_allclose(sketch.quantile(q), np.quantile(rows, q, axis=0))
+
+
+def test_counts_widen_both_ways():
+    rows = np.array([[5, 5], [2, 9], [40, 0], [-10, 4]], dtype=float)
+    sketch = _sketch(rows)
+    assert sketch.exact
+    for q in QUANTILES:
+        np.testing.assert_allclose(sketch.quantile(q), np.quantile(rows, q, axis=0))
+
+
+@pytest.mark.parametrize('parts', [1, 4])
+@pytest.mark.parametrize('draw', ['normal', 'exponential'])
+def test_continuous_values_close_to_numpy(parts, draw):
+    rng = np.random.default_rng(1)
+    rows = rng.normal(10, 2, (1000, 40)) if draw == 'normal' else rng.exponential(2, (1000, 40))
+    sketch = _sketch(rows, parts)
+    assert not sketch.exact
+    np.testing.assert_allclose(sketch.quantile(0.0), np.quantile(rows, 0.0, axis=0))
+    np.testing.assert_allclose(sketch.quantile(1.0), np.quantile(rows, 1.0, axis=0))
+    # the t-digest bound is on the rank, and is tighter at the tails
+    for q in (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99):
+        rank = (rows < sketch.quantile(q)).mean(axis=0)
+        assert np.abs(rank - q).max() <= (0.01 if abs(q - 0.5) > 0.4 else 0.015), q
+
+
+def test_counts_switch_to_the_digest():
+    rng = np.random.default_rng(2)
+    counts = rng.poisson(3, (100, 10)).astype(float)
+    values = rng.normal(3, 1, (100, 10))
+    first, second = _sketch(counts), _sketch(values)
+    first.merge(second)
+    rows = np.vstack([counts, values])
+    assert not first.exact
+    np.testing.assert_allclose(first.min, rows.min(axis=0))
+    np.testing.assert_allclose(first.max, rows.max(axis=0))
+    error = np.abs(first.quantile(0.5) - np.quantile(rows, 0.5, axis=0))
+    assert error.max() < 0.3
+
+
+def test_empty_sketch():
+    assert np.isnan(QuantileSketch((3,)).quantile(0.5)).all()
+
+
+def test_online_stats_merge_matches_numpy():
+    rows = np.random.default_rng(3).normal(size=(50, 4))
+    first, second = OnlineStats((4,)), OnlineStats((4,))
+    for row in rows[:20]:
+        first.add(row)
+    for row in rows[20:]:
+        second.add(row)
+    first.merge(second)
+    np.testing.assert_allclose(first.mean, rows.mean(axis=0))
+    np.testing.assert_allclose(first.variance(), rows.var(axis=0, ddof=1))
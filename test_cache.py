@@ -0,0 +1,113 @@
+import os
+
+import pytest
+
+from classes import Simulation
+from reader import load_part_attributes, load_blueprints
+from runners import do_one_run, do_one_run_hourly
+from cache import RunCache, run_key
+
+
+@pytest.fixture(scope='module')
+def inputs():
+    simulation = Simulation()
+    load_part_attributes(simulation=simulation)
+    car_blueprint = load_blueprints()
+    part_quantities = car_blueprint.get_part_quantities()
+    spares_allocated = {part: part_quantities[part.name] * 5 + (4 if part.name == 'Wheel' else 0)
+                        for part in simulation.part_catalog if part.name in part_quantities}
+    return simulation, car_blueprint, spares_allocated
+
+
+def _more_wheels(spares_allocated):
+    return {part: count + (1 if part.name == 'Wheel' else 0) for part, count in spares_allocated.items()}
+
+
+def test_run_hits_after_a_miss(tmp_path, inputs):
+    simulation, car_blueprint, spares_allocated = inputs
+    cache = RunCache(str(tmp_path))
+    first = cache.run(spares_allocated, 60, 5, 5, car_blueprint, simulation, 7)
+    second = cache.run(spares_allocated, 60, 5, 5, car_blueprint, simulation, 7)
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert first[0] == second[0] == do_one_run(spares_allocated, 60, 5, 5, car_blueprint, simulation.new_run(7))[0]
+    assert list(first[1]) == list(second[1])
+
+
+def test_runs_without_a_seed_are_not_cached(tmp_path, inputs):
+    simulation, car_blueprint, spares_allocated = inputs
+    cache = RunCache(str(tmp_path))
+    cache.run(spares_allocated, 30, 5, 5, car_blueprint, simulation)
+    assert (cache.hits, cache.misses) == (0, 0)
+    assert not os.listdir(tmp_path)
+
+
+def test_key_depends_on_everything_the_run_does(inputs):
+    simulation, car_blueprint, spares_allocated = inputs
+    catalog = simulation.part_catalog
+    key = run_key(spares_allocated, 60, 5, 5, car_blueprint, catalog, 7)
+    assert key == run_key(dict(spares_allocated), 60, 5, 5, car_blueprint, catalog, 7)
+    others = [
+        run_key(spares_allocated, 60, 5, 5, car_blueprint, catalog, 8),
+        run_key(_more_wheels(spares_allocated), 60, 5, 5, car_blueprint, catalog, 7),
+        run_key(spares_allocated, 61, 5, 5, car_blueprint, catalog, 7),
+        run_key(spares_allocated, 60, 6, 5, car_blueprint, catalog, 7),
+        run_key(spares_allocated, 60, 5, 6, car_blueprint, catalog, 7),
+        run_key(spares_allocated, 60, 5, 5, car_blueprint, catalog, 7, 'runners.do_one_run_hourly'),
+    ]
+    assert len({key, *others}) == len(others) + 1
+
+
+def test_run_misses_for_another_seed_allocation_or_engine(tmp_path, inputs):
+    simulation, car_blueprint, spares_allocated = inputs
+    cache = RunCache(str(tmp_path))
+    cache.run(spares_allocated, 60, 5, 5, car_blueprint, simulation, 7)
+    cache.run(spares_allocated, 60, 5, 5, car_blueprint, simulation, 8)
+    cache.run(_more_wheels(spares_allocated), 60, 5, 5, car_blueprint, simulation, 7)
+    cache.run(spares_allocated, 60, 5, 5, car_blueprint, simulation, 7, do_one_run_hourly)
+    assert (cache.hits, cache.misses) == (0, 4)
+    assert len(os.listdir(tmp_path)) == 4
+
+
+def test_evicts_the_least_recently_used(tmp_path):
+    cache = RunCache(str(tmp_path))
+    payload = b'x' * 1000
+    for index, key in enumerate('abc'):
+        cache.put(key, payload)
+        # a second apart, so the order does not depend on the file system's time resolution
+        os.utime(cache._path(key), (1000 + index, 1000 + index))
+    size = os.path.getsize(cache._path('a'))
+    assert cache.total_bytes == 3 * size
+
+    assert cache.get('a') == payload
+    cache.max_bytes = 3 * size
+    cache.put('d', payload)
+    assert cache.get('b') is None
+    assert all(cache.get(key) == payload for key in 'acd')
+    assert cache.total_bytes == 3 * size
+
+
+def test_only_scans_when_over_budget(tmp_path, monkeypatch):
+    cache = RunCache(str(tmp_path), max_bytes=1 << 20)
+    scans = []
+    scan = cache._scan
+    monkeypatch.setattr(cache, '_scan', lambda: scans.append(1) or scan())
+    for index in range(20):
+        cache.put(str(index), b'x' * 100)
+    cache.put('0', b'x' * 100)
+    assert not scans
+    assert cache.total_bytes == 20 * os.path.getsize(cache._path('0'))
+
+    cache.max_bytes = cache.total_bytes
+    cache.put('big', b'x' * 1000)
+    assert len(scans) == 1
+    assert cache.total_bytes <= cache.max_bytes
+    assert cache.get('big') is not None
+
+
+def test_clear(tmp_path):
+    cache = RunCache(str(tmp_path))
+    cache.put('a', 1)
+    cache.clear()
+    assert cache.total_bytes == 0
+    assert cache.get('a') is None
+    assert RunCache(str(tmp_path)).total_bytes == 0
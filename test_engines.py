@@ -0,0 +1,97 @@
+import copy
+
+import numpy as np
+import pytest
+
+from classes import Simulation, Part_attributes
+from reader import build_blueprint_tree, load_part_attributes, load_blueprints
+from runners import do_one_run, do_one_run_hourly
+from fleet_arrays import do_array_run
+from trajectory import METRICS
+
+ROWS = [
+    ('Car', 'Frame', 'None'),
+    ('Engine', 'Engine', 'Car'),
+    ('Piston 1', 'Piston', 'Engine'),
+    ('Piston 2', 'Piston', 'Engine'),
+    ('Wheel 1', 'Wheel', 'Car'),
+    ('Wheel 2', 'Wheel', 'Car'),
+    ('Wheel 3', 'Wheel', 'Car'),
+    ('Wheel 4', 'Wheel', 'Car'),
+]
+
+# (name, attributes) covering random failures, life limits, depot limits and fractional or zero TATs
+PARTS = [
+    ('Frame', {}),
+    ('Engine', {'failure_hours': 600, 'shape_factor': 1.5, 'depot_limit': 900, 'depot_tat': 9.5, 'cost': 1000}),
+    ('Piston', {'failure_hours': 2000, 'shape_factor': 1, 'life_limit': 250, 'depot_tat': 3, 'cost': 100}),
+    ('Wheel', {'failure_hours': 150, 'shape_factor': 3, 'depot_limit': 220, 'depot_tat': 0.4, 'cost': 10}),
+]
+
+# (spares on top of the fleet fit, days, fleet size, hours per day)
+CASES = [
+    ({'Engine': 1, 'Piston': 2, 'Wheel': 6}, 150, 4, 6),
+    ({'Wheel': 2}, 120, 3, 24),
+    ({'Engine': 2, 'Piston': 4, 'Wheel': 12}, 200, 6, 1),
+    ({}, 40, 2, 0),
+]
+
+
+@pytest.fixture(scope='module')
+def synthetic():
+    simulation = Simulation()
+    for name, attributes in PARTS:
+        Part_attributes(name, simulation=simulation, **attributes)
+    return simulation, build_blueprint_tree(ROWS)
+
+
+def _allocation(simulation, car_blueprint, extra, fleet_size):
+    part_quantities = car_blueprint.get_part_quantities()
+    return {part: part_quantities[part.name] * fleet_size + extra.get(part.name, 0)
+            for part in simulation.part_catalog if part.name in part_quantities}
+
+
+def _assert_same_run(first, second):
+    assert first[0] == second[0]
+    assert list(first[1]) == list(second[1])
+    assert list(first[2]) == list(second[2])
+    first_trajectory, second_trajectory = first[3].trajectory, second[3].trajectory
+    assert first_trajectory.part_names == second_trajectory.part_names
+    for metric in METRICS:
+        np.testing.assert_array_equal(first_trajectory.data[metric], second_trajectory.data[metric], metric)
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+@pytest.mark.parametrize('extra, days, fleet_size, hours_per_day', CASES)
+def test_event_engine_matches_hourly(synthetic, seed, extra, days, fleet_size, hours_per_day):
+    simulation, car_blueprint = synthetic
+    spares_allocated = _allocation(simulation, car_blueprint, extra, fleet_size)
+    hourly = do_one_run_hourly(spares_allocated, days, fleet_size, hours_per_day, car_blueprint,
+                               simulation.new_run(seed))
+    event = do_one_run(spares_allocated, days, fleet_size, hours_per_day, car_blueprint, simulation.new_run(seed))
+    _assert_same_run(hourly, event)
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+@pytest.mark.parametrize('extra, days, fleet_size, hours_per_day', CASES)
+def test_array_engine_matches_event(synthetic, seed, extra, days, fleet_size, hours_per_day):
+    simulation, car_blueprint = synthetic
+    spares_allocated = _allocation(simulation, car_blueprint, extra, fleet_size)
+    event = do_one_run(spares_allocated, days, fleet_size, hours_per_day, car_blueprint, simulation.new_run(seed))
+    array = do_array_run(spares_allocated, days, fleet_size, hours_per_day, car_blueprint, simulation.new_run(seed))
+    _assert_same_run(event, array)
+
+
+@pytest.mark.parametrize('seed', [0, 3])
+def test_array_engine_with_copied_allocation(seed):
+    simulation = Simulation()
+    load_part_attributes(simulation=simulation)
+    car_blueprint = load_blueprints()
+    spares_allocated = _allocation(simulation, car_blueprint, {'Wheel': 10, 'Engine': 1}, 5)
+    copied = copy.deepcopy(spares_allocated)
+    assert not set(copied) & set(spares_allocated)
+
+    event = do_one_run(spares_allocated, 300, 5, 5, car_blueprint, simulation.new_run(seed))
+    array = do_array_run(copied, 300, 5, 5, car_blueprint, simulation.new_run(seed))
+    _assert_same_run(event, array)
+    assert len(array[3].trajectory.part_names) == len(simulation.part_catalog)
@@ -0,0 +1,35 @@
+import math
+
+import pytest
+
+from mathstuff import student_t_cdf, student_t_quantile, weibull_mean
+
+# two sided table values, t(p, dof)
+T_TABLE = [
+    (0.975, 3, 3.182446305),
+    (0.995, 3, 5.840909310),
+    (0.9995, 3, 12.92397864),
+    (0.975, 4, 2.776445105),
+    (0.9995, 4, 8.610301581),
+    (0.9995, 5, 6.868826626),
+    (0.975, 9, 2.262157163),
+    (0.975, 10, 2.228138852),
+    (0.995, 30, 2.749995654),
+]
+
+
+@pytest.mark.parametrize('p, dof, expected', T_TABLE)
+def test_student_t_quantile_matches_table(p, dof, expected):
+    assert student_t_quantile(p, dof) == pytest.approx(expected, rel=3e-4)
+    assert student_t_quantile(1 - p, dof) == pytest.approx(-expected, rel=3e-4)
+
+
+@pytest.mark.parametrize('dof', [1, 2, 3, 4, 7, 9])
+def test_student_t_cdf_inverts_quantile(dof):
+    for p in (0.6, 0.9, 0.975, 0.9995):
+        assert student_t_cdf(student_t_quantile(p, dof), dof) == pytest.approx(p, abs=1e-9)
+
+
+@pytest.mark.parametrize('shape, expected', [(1, 1000), (2, 500 * math.sqrt(math.pi)), (0.5, 2000)])
+def test_weibull_mean(shape, expected):
+    assert weibull_mean(shape, 1000) == pytest.approx(expected, rel=1e-12)
@@ -0,0 +1,52 @@
+import pytest
+
+from classes import Simulation
+from reader import load_part_attributes, load_blueprints
+from memory import BUDGETS, measure_run, check_budgets, pool_size
+
+
+@pytest.fixture(scope='module')
+def inputs():
+    simulation = Simulation()
+    load_part_attributes(simulation=simulation)
+    car_blueprint = load_blueprints()
+    return simulation, car_blueprint
+
+
+def _report(inputs, days, fleet_size=3, hours_per_day=5):
+    simulation, car_blueprint = inputs
+    part_quantities = car_blueprint.get_part_quantities()
+    spares_allocated = {part: part_quantities[part.name] * fleet_size * 2 for part in simulation.part_catalog
+                        if part.name in part_quantities}
+    return measure_run(spares_allocated, days, fleet_size, hours_per_day, car_blueprint, simulation)
+
+
+@pytest.mark.parametrize('days', [200, 1000])
+def test_bytes_per_serial_within_budget(inputs, days):
+    report = _report(inputs, days)
+    assert report['serials'] > 0
+    assert 0 < report['bytes_per_serial'] <= BUDGETS['bytes_per_serial']
+
+
+@pytest.mark.parametrize('days', [200, 1000])
+def test_bytes_per_tracked_day_within_budget(inputs, days):
+    report = _report(inputs, days)
+    assert 0 < report['bytes_per_tracked_day'] <= BUDGETS['bytes_per_tracked_day']
+    assert check_budgets(report) == []
+
+
+def test_bytes_per_tracked_day_does_not_depend_on_run_length(inputs):
+    short = _report(inputs, 200)['bytes_per_tracked_day']
+    long = _report(inputs, 2000)['bytes_per_tracked_day']
+    assert short == pytest.approx(long, rel=0.25)
+
+
+def test_check_budgets_reports_the_measures_over_budget():
+    report = {'bytes_per_serial': 500, 'bytes_per_tracked_day': 10}
+    assert check_budgets(report) == [('bytes_per_serial', 500, BUDGETS['bytes_per_serial'])]
+
+
+def test_pool_size():
+    assert pool_size(1 << 30, 100 << 20, worker_overhead=0) == 10
+    assert pool_size(1 << 30, 100 << 20, worker_overhead=0, max_workers=4) == 4
+    assert pool_size(0, 100 << 20) == 1
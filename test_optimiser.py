@@ -0,0 +1,30 @@
+import pytest
+
+from classes import Simulation
+from reader import load_part_attributes, load_blueprints
+from optimiser import greedy_allocation, allocation_cost
+
+
+@pytest.fixture(scope='module')
+def inputs():
+    simulation = Simulation()
+    load_part_attributes(simulation=simulation)
+    car_blueprint = load_blueprints()
+    return simulation, car_blueprint, car_blueprint.get_part_quantities()
+
+
+def test_greedy_spends_the_budget_through_the_noise(inputs):
+    simulation, car_blueprint, part_quantities = inputs
+    result = greedy_allocation(1000, 200, 5, 5, car_blueprint, part_quantities, simulation, steps={'Wheel': 5})
+    assert result.budget < 50
+    assert allocation_cost(result.spares_allocated, part_quantities, 5) == 1000 - result.budget
+    assert [point.cost for point in result.path] == sorted(point.cost for point in result.path)
+    assert result.serviceability > result.path[0].serviceability
+
+
+def test_greedy_patience_stops_early(inputs):
+    simulation, car_blueprint, part_quantities = inputs
+    result = greedy_allocation(1000, 200, 5, 5, car_blueprint, part_quantities, simulation, steps={'Wheel': 5},
+                               patience=0)
+    assert result.budget > 0
+    assert len(result.path) > 1
@@ -0,0 +1,128 @@
+import os
+
+import pytest
+
+import reader
+from reader import build_blueprint_tree
+
+
+def _tree(node):
+    return (node.place, node.part_type, [_tree(child) for child in node.children])
+
+
+def test_blueprint_tree_in_any_row_order():
+    rows = [
+        ('Wheel 1', 'Wheel', 'Car'),
+        ('Piston', 'Piston', 'Engine'),
+        ('Car', 'Vehicle', 'None'),
+        ('Engine', 'Engine', 'Car'),
+        ('Wheel 2', 'Wheel', 'Car'),
+        (None, None, None),
+    ]
+    root = build_blueprint_tree(rows)
+    assert _tree(root) == ('Car', 'Vehicle', [('Wheel 1', 'Wheel', []),
+                                              ('Engine', 'Engine', [('Piston', 'Piston', [])]),
+                                              ('Wheel 2', 'Wheel', [])])
+
+
+def test_blueprint_duplicate_place():
+    with pytest.raises(ValueError, match="more than once"):
+        build_blueprint_tree([('Car', 'Vehicle', 'None'), ('Wheel', 'Wheel', 'Car'), ('Wheel', 'Wheel', 'Car')])
+
+
+def test_blueprint_without_root():
+    with pytest.raises(ValueError, match="No root"):
+        build_blueprint_tree([('Car', 'Vehicle', 'Depot'), ('Wheel', 'Wheel', 'Car')])
+
+
+def test_blueprint_with_several_roots():
+    with pytest.raises(ValueError, match="More than one root"):
+        build_blueprint_tree([('Car', 'Vehicle', 'None'), ('Truck', 'Vehicle', '')])
+
+
+def test_blueprint_orphan():
+    with pytest.raises(ValueError, match="does not exist.*Wheel"):
+        build_blueprint_tree([('Car', 'Vehicle', 'None'), ('Wheel', 'Wheel', 'Axle')])
+
+
+def test_blueprint_cycle():
+    with pytest.raises(ValueError, match="cycle.*'Engine', 'Piston'"):
+        build_blueprint_tree([('Car', 'Vehicle', 'None'), ('Engine', 'Engine', 'Piston'),
+                              ('Piston', 'Piston', 'Engine')])
+
+
+def _write_workbook(path, rows):
+    import openpyxl
+
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(['place', 'part_type', 'parent_place'])
+    for row in rows:
+        sheet.append(list(row))
+    workbook.save(path)
+
+
+@pytest.fixture
+def parses(monkeypatch):
+    """counts the workbooks actually parsed by read_sheet_rows"""
+    calls = []
+    parse = reader._read_sheet_rows
+
+    def counting(filename):
+        calls.append(filename)
+        return parse(filename)
+
+    monkeypatch.setattr(reader, '_read_sheet_rows', counting)
+    return calls
+
+
+def test_input_cache_reuses_unchanged_workbook(tmp_path, parses):
+    path = tmp_path / 'blueprint.xlsx'
+    rows = [('Car', 'Vehicle', 'None'), ('Wheel', 'Wheel', 'Car')]
+    _write_workbook(path, rows)
+    assert reader.read_sheet_rows(str(path)) == rows
+    assert reader.read_sheet_rows(str(path)) == rows
+    assert len(parses) == 1
+    assert os.listdir(tmp_path / reader.INPUT_CACHE_DIR)
+
+
+def test_input_cache_picks_up_new_rows(tmp_path, parses):
+    path = tmp_path / 'blueprint.xlsx'
+    _write_workbook(path, [('Car', 'Vehicle', 'None')])
+    reader.read_sheet_rows(str(path))
+    rows = [('Car', 'Vehicle', 'None'), ('Wheel 1', 'Wheel', 'Car'), ('Wheel 2', 'Wheel', 'Car')]
+    _write_workbook(path, rows)
+    assert reader.read_sheet_rows(str(path)) == rows
+    assert len(parses) == 2
+
+
+def test_input_cache_picks_up_edited_cells(tmp_path, parses):
+    path = tmp_path / 'blueprint.xlsx'
+    _write_workbook(path, [('Car', 'Vehicle', 'None'), ('Wheel', 'Wheel', 'Car')])
+    reader.read_sheet_rows(str(path))
+    stat = os.stat(path)
+    rows = [('Car', 'Vehicle', 'None'), ('Wheel', 'Whell', 'Car')]
+    _write_workbook(path, rows)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert reader.read_sheet_rows(str(path)) == rows
+    assert len(parses) == 2
+
+
+def test_input_cache_only_rehashes_a_touched_workbook(tmp_path, parses):
+    path = tmp_path / 'blueprint.xlsx'
+    rows = [('Car', 'Vehicle', 'None')]
+    _write_workbook(path, rows)
+    reader.read_sheet_rows(str(path))
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert reader.read_sheet_rows(str(path)) == rows
+    assert len(parses) == 1
+
+
+def test_input_cache_can_be_skipped(tmp_path, parses):
+    path = tmp_path / 'blueprint.xlsx'
+    _write_workbook(path, [('Car', 'Vehicle', 'None')])
+    reader.read_sheet_rows(str(path), cache=False)
+    reader.read_sheet_rows(str(path), cache=False)
+    assert len(parses) == 2
+    assert not os.path.exists(tmp_path / reader.INPUT_CACHE_DIR)
@@ -0,0 +1,130 @@
+from collections import namedtuple
+from collections.abc import Mapping
+
+import numpy as np
+
+from logger import get_logger
+
+logger = get_logger()
+
+# stock levels, carried over on days when nothing moves
+STOCK_METRICS = ('serv', 'depot', 'warehouse', 'graveyard', 'depot_at')
+# transitions, zero on days when nothing moves
+TRANSITION_METRICS = ('breakage', 'overhaul', 'life_ex', 'depot_done')
+METRICS = STOCK_METRICS + TRANSITION_METRICS
+
+# one day of a run: the day, serviceable and broken cars, the part names in catalog order and
+# {metric: tuple of counts in part_names order}
+DaySnapshot = namedtuple('DaySnapshot', ['day', 'serviceable', 'breakage', 'part_names', 'counts'])
+
+
+class Trajectory:
+    """
+    the daily per part number counts of one run. every metric is a preallocated (days x part types) integer
+    array, filled in a row per day by the run functions.
+    view(metric) gives the old {part number: daily values} tracker for a metric.
+    """
+
+    def __init__(self, part_names, days, dtype=np.int32):
+        self.part_names = list(part_names)
+        self.index = {name: index for index, name in enumerate(self.part_names)}
+        self.days = days
+        self.data = {metric: np.zeros((days, len(self.part_names)), dtype=dtype) for metric in METRICS}
+
+    @classmethod
+    def for_catalog(cls, part_catalog, days):
+        return cls([part_number.name for part_number in part_catalog], days)
+
+    def record_snapshot(self, snapshot):
+        """writes the counts of a DaySnapshot into its day's row"""
+        for metric, values in snapshot.counts.items():
+            self.data[metric][snapshot.day] = values
+
+    def view(self, metric):
+        return TrackerView(self, metric)
+
+    def run_trackers(self):
+        """the serv, depot, warehouse and graveyard trackers, as returned by the run functions"""
+        return self.view('serv'), self.view('depot'), self.view('warehouse'), self.view('graveyard')
+
+    def column(self, metric, part_name):
+        return self.data[metric][:, self.index[part_name]]
+
+    def min_stock(self, part_quantities, fleet_size, part_names=None):
+        """
+        for each part number, the lowest number of parts in cars and in the warehouse over the run, less the
+        number the fleet needs, divided by the number needed per car. this is the performance measure used
+        by runners.get_new_service.
+        """
+        part_names = self.part_names if part_names is None else list(part_names)
+        columns = [self.index[name] for name in part_names]
+        per_car = np.array([part_quantities[name] for name in part_names], dtype=float)
+        available = self.data['serv'][:, columns] + self.data['warehouse'][:, columns]
+        lowest = available.min(axis=0) - per_car * fleet_size if self.days else np.full(len(columns), np.inf)
+        return {name: float(value) for name, value in zip(part_names, lowest / per_car)}
+
+    def to_npz(self, path):
+        """saves the trajectory to a compressed numpy .npz file"""
+        np.savez_compressed(path, part_names=np.array(self.part_names), **self.data)
+        logger.info(f"Saved trajectory to {path}")
+
+    @classmethod
+    def from_npz(cls, path):
+        with np.load(path) as stored:
+            part_names = [str(name) for name in stored['part_names']]
+            trajectory = cls(part_names, stored[METRICS[0]].shape[0])
+            for metric in METRICS:
+                trajectory.data[metric] = stored[metric]
+        return trajectory
+
+    def to_parquet(self, path):
+        """
+        saves the trajectory as a long table (day, part number, one column per metric) to a parquet file.
+        needs pyarrow.
+        """
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("to_parquet needs pyarrow, use to_npz instead or install pyarrow")
+
+        n_parts = len(self.part_names)
+        columns = {'day': np.repeat(np.arange(self.days), n_parts),
+                   'part_number': np.tile(np.array(self.part_names, dtype=object), self.days)}
+        for metric in METRICS:
+            columns[metric] = self.data[metric].ravel()
+        pq.write_table(pa.table(columns), path)
+        logger.info(f"Saved trajectory to {path}")
+
+    def nbytes(self):
+        return sum(values.nbytes for values in self.data.values())
+
+
+class TrackerView(Mapping):
+    """
+    a read only {part number: daily values} view of one metric of a Trajectory, used where the run functions
+    used to return a dict of lists. the values are numpy columns of the trajectory, not copies.
+    """
+
+    def __init__(self, trajectory, metric):
+        self.trajectory = trajectory
+        self.metric = metric
+
+    def __getitem__(self, part_name):
+        if part_name not in self.trajectory.index:
+            raise KeyError(part_name)
+        return self.trajectory.column(self.metric, part_name)
+
+    def __iter__(self):
+        return iter(self.trajectory.part_names)
+
+    def __len__(self):
+        return len(self.trajectory.part_names)
+
+    def __eq__(self, other):
+        if not isinstance(other, Mapping) or set(self) != set(other):
+            return False
+        return all(np.array_equal(self[key], other[key]) for key in self)
+
+    def __repr__(self):
+        return f"TrackerView({self.metric}, {len(self)} part numbers, {self.trajectory.days} days)"